@@ -1,9 +1,10 @@
 from .part import PartitionedList, part
+from .manifest import Manifest, ManifestError
 from .py3 import to_str, to_bytes
-from .cmplib import cmp3_generator, intersection_count
+from .cmplib import cmp3_generator, cmp5_generator, cmp2_generator, intersection_count, validate_lists, AbortGuard, ComparisonAborted
 from .stats import Stats
 from .config import CEConfiguration, DBConfig
 from .version import Version as __version__, version_info
 from .trace import Tracer, DummyTracer
 
-__all__ = "PartitionedList,part,to_str,to_bytes,cmp3_generator,Stats,CEConfiguration,DBConfig,__version__".split(",")
\ No newline at end of file
+__all__ = "PartitionedList,part,Manifest,ManifestError,validate_lists,to_str,to_bytes,cmp3_generator,cmp5_generator,cmp2_generator,intersection_count,AbortGuard,ComparisonAborted,Stats,CEConfiguration,DBConfig,__version__".split(",")
\ No newline at end of file
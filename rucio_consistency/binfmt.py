@@ -0,0 +1,204 @@
+"""Compact binary format for partition files.
+
+File layout::
+
+    header (32 bytes):
+        magic           4s      b"RCEB"
+        version         uint8
+        hash id         uint8   see HashIDs
+        hash width      uint8   bytes per stored hash
+        reserved        uint8
+        partition index uint32
+        nparts          uint32
+        record count    uint64  UnknownCount if the writer could not seek back to update it (compressed files)
+        reserved        8 bytes
+
+    blocks of records, each block:
+        count           uint32  number of records in the block
+        data length     uint64  length of the data section in bytes
+        hashes          count * uint32 or uint64 depending on the hash width, full (not reduced modulo nparts) partition hash for each item
+        data            utf-8 encoded items joined with b"\\n"
+
+All integers are little-endian. Records are grouped into length-prefixed blocks, so that a whole block is
+decoded and split with a single call instead of parsing each record separately. Only whole blocks are length-prefixed,
+individual records are not: the items in the data section are separated by b"\n", so items can not contain b"\n".
+The reader checks that the number of items in each block matches the count in the block header.
+"""
+
+import struct, sys, zlib
+from array import array
+from .hashes import HashWidths, content_hash
+
+Magic = b"RCEB"
+FormatVersion = 1
+UnknownCount = 0xFFFFFFFFFFFFFFFF
+
+HashIDs = {
+    "adler32":      1,
+    "crc32":        2,
+    "blake2b64":    3
+}
+ArrayTypes = {4: "I", 8: "Q"}           # array type codes by hash width
+HashNames = {i: name for name, i in HashIDs.items()}
+
+_Header = struct.Struct("<4sBBBBIIQ8x")
+_BlockHead = struct.Struct("<IQ")
+
+HeaderSize = _Header.size
+
+
+def _hash_array(data=b"", width=4):
+    a = array(ArrayTypes[width])
+    a.frombytes(data)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a
+
+def is_binary(f):
+    """Returns True if the buffered binary file object is positioned at the beginning of a binary partition file.
+    The file position is not changed.
+    """
+    return f.peek(len(Magic))[:len(Magic)] == Magic
+
+
+class BinaryWriter(object):
+    """Writes blocks of records into a binary file object.
+    """
+
+    def __init__(self, f, index=0, nparts=1, hash_name="adler32", update_count=True):
+        self.F = f
+        self.Index = index
+        self.NParts = nparts
+        self.HashName = hash_name
+        self.UpdateCount = update_count         # whether the file can be seeked back to update the header on close
+        self.Count = 0
+        self.Checksum = 0                       # CRC32 of everything after the header
+        self.Digest = content_hash()            # digest of everything after the header
+        self.F.write(self.header(UnknownCount))
+
+    def header(self, count):
+        return _Header.pack(Magic, FormatVersion, HashIDs[self.HashName], HashWidths[self.HashName], 0, self.Index, self.NParts, count)
+
+    def write_block(self, items, hashes):
+        # items: list of bytes, hashes: array("I") or array("Q") depending on the hash width, of the same length
+        if items:
+            if len(hashes) != len(items):
+                raise ValueError("Number of hashes (%d) does not match number of items (%d)" % (len(hashes), len(items)))
+            data = b"\n".join(items)
+            if data.count(b"\n") != len(items) - 1:
+                raise ValueError("Items written to a binary partition file can not contain newlines")
+            if sys.byteorder != "little":
+                hashes = array(hashes.typecode, hashes)
+                hashes.byteswap()
+            block = _BlockHead.pack(len(items), len(data)) + hashes.tobytes() + data
+            self.F.write(block)
+            self.Count += len(items)
+            self.Checksum = zlib.crc32(block, self.Checksum)
+            self.Digest.update(block)
+
+    def close(self):
+        if self.F is not None:
+            if self.UpdateCount:
+                self.F.seek(0, 0)
+                self.F.write(self.header(self.Count))
+            self.F.close()
+            self.F = None
+
+
+class BinaryReader(object):
+    """Reads a binary partition file. Also provides ``readline`` so that it can be used in place of a text file object.
+    """
+
+    def __init__(self, f, path=None):
+        self.F = f
+        self.Path = path or getattr(f, "name", None) or "binary partition file"       # used in error messages
+        self.read_header()
+        self.Lines = None
+
+    def read_header(self):
+        data = self.F.read(HeaderSize)
+        if len(data) < HeaderSize:
+            raise ValueError("Truncated binary partition file header in %s" % (self.Path,))
+        magic, version, hash_id, hash_width, _, self.Index, self.NParts, count = _Header.unpack(data)
+        if magic != Magic:
+            raise ValueError("Not a binary partition file: %s" % (self.Path,))
+        if version != FormatVersion:
+            raise ValueError("Unsupported binary partition format version: %d" % (version,))
+        if hash_id not in HashNames:
+            raise ValueError("Unknown hash id in binary partition file: %d" % (hash_id,))
+        if hash_width not in ArrayTypes:
+            raise ValueError("Unsupported hash width in binary partition file: %d" % (hash_width,))
+        self.HashName = HashNames[hash_id]
+        self.HashWidth = hash_width
+        self.Count = None if count == UnknownCount else count
+
+    def _read(self, n):
+        data = self.F.read(n)
+        while len(data) < n:
+            more = self.F.read(n - len(data))
+            if not more:
+                raise ValueError("Truncated block in binary partition file %s" % (self.Path,))
+            data += more
+        return data
+
+    def blocks(self):
+        """Generator yielding (hashes, data) tuples for each block, where hashes is an array("I") or array("Q") and data is the items joined with b"\\n"
+        """
+        while True:
+            head = self.F.read(_BlockHead.size)
+            if not head:
+                break
+            if len(head) < _BlockHead.size:
+                head += self._read(_BlockHead.size - len(head))
+            count, nbytes = _BlockHead.unpack(head)
+            hashes = _hash_array(self._read(count*self.HashWidth), self.HashWidth)
+            data = self._read(nbytes)
+            yield hashes, data
+
+    def _split(self, hashes, data, separator=b"\n"):
+        items = data.split(separator)
+        if len(items) != len(hashes):
+            raise ValueError("Block with %d records has %d items in binary partition file %s" % (len(hashes), len(items), self.Path))
+        return items
+
+    def byte_batches(self):
+        """Generator yielding lists of items as bytes, one list per block
+        """
+        for hashes, data in self.blocks():
+            yield self._split(hashes, data)
+
+    def batches(self):
+        """Generator yielding lists of items as str, one list per block
+        """
+        for hashes, data in self.blocks():
+            yield self._split(hashes, data.decode("utf-8"), "\n")
+
+    def records(self):
+        """Generator yielding (hash, item bytes) tuples in the order they were written
+        """
+        for hashes, data in self.blocks():
+            yield from zip(hashes, self._split(hashes, data))
+
+    def items(self):
+        """Generator yielding items as str
+        """
+        for batch in self.batches():
+            yield from batch
+
+    def readline(self):
+        if self.Lines is None:
+            self.Lines = self.items()
+        try:
+            return next(self.Lines) + "\n"
+        except StopIteration:
+            return ""
+
+    def seek(self, offset, whence=0):
+        # only rewinding to the beginning is supported
+        assert offset == 0 and whence == 0, "BinaryReader can only be rewound to the beginning"
+        self.F.seek(0, 0)
+        self.read_header()
+        self.Lines = None
+
+    def close(self):
+        self.F.close()
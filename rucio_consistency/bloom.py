@@ -0,0 +1,154 @@
+"""Bloom filters for approximate membership checks against partitioned lists without reading the partition files.
+
+A filter is stored as a sidecar file next to the partition file, <partition file without compression extension>.bloom::
+
+    header (32 bytes):
+        magic           4s      b"RCBF"
+        version         uint8
+        nhashes         uint8
+        reserved        2 bytes
+        nbits           uint64
+        count           uint64  number of items added
+        reserved        8 bytes
+    bits            nbits/8 bytes, rounded up
+
+Bit positions for an item are computed by double hashing of the 64-bit BLAKE2b digest of the item:
+(h1 + i*h2) mod nbits, i = 0...nhashes-1, where h1 and h2 are the lower and upper 32 bits of the digest.
+The file is memory-mapped when loaded, so only the pages touched by the queries are read.
+"""
+
+import math, mmap, os, struct
+from .hashes import blake2b64
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+Magic = b"RCBF"
+FormatVersion = 1
+Suffix = ".bloom"
+DefaultFPRate = 0.01
+
+_Header = struct.Struct("<4sBB2xQQ8x")
+
+
+def digest(item):
+    """Returns 64-bit BLAKE2b digest of the item (str or bytes) as an integer
+    """
+    if isinstance(item, str):
+        item = item.encode("utf-8")
+    return blake2b64(item)
+
+def optimal_parameters(n, fp_rate=DefaultFPRate):
+    """Returns (nbits, nhashes) for a filter holding ``n`` items with the false positive rate ``fp_rate``
+    """
+    n = max(n, 1)
+    nbits = int(math.ceil(-n * math.log(fp_rate) / math.log(2)**2))
+    nbits = max((nbits + 7) // 8 * 8, 64)
+    nhashes = max(1, min(255, int(round(nbits / n * math.log(2)))))
+    return nbits, nhashes
+
+
+class BloomFilter(object):
+
+    def __init__(self, nbits, nhashes, bits=None, count=0):
+        self.NBits = nbits
+        self.NHashes = nhashes
+        self.Bits = bytearray((nbits + 7) // 8) if bits is None else bits
+        self.Count = count
+        self.MMap = None
+
+    @staticmethod
+    def from_digests(digests, fp_rate=DefaultFPRate):
+        """Creates the filter sized for the given digests and adds them
+
+        Parameters
+        ----------
+        digests : sequence of int
+            64-bit digests of the items, see ``digest``. ``array("Q")`` is the most compact representation
+        fp_rate : float
+            Desired false positive rate
+        """
+        nbits, nhashes = optimal_parameters(len(digests), fp_rate)
+        f = BloomFilter(nbits, nhashes)
+        f.add_digests(digests)
+        return f
+
+    def positions(self, d):
+        h1 = d & 0xFFFFFFFF
+        h2 = (d >> 32) | 1
+        nbits = self.NBits
+        return [(h1 + i*h2) % nbits for i in range(self.NHashes)]
+
+    def add_digests(self, digests):
+        if np is not None and len(digests) > 1000:
+            self._add_digests_numpy(digests)
+        else:
+            bits = self.Bits
+            for d in digests:
+                for p in self.positions(d):
+                    bits[p >> 3] |= 1 << (p & 7)
+        self.Count += len(digests)
+
+    def _add_digests_numpy(self, digests, chunk=1000000):
+        bits = np.frombuffer(self.Bits, dtype=np.uint8)
+        digests = np.asarray(digests, dtype=np.uint64)
+        for i in range(0, len(digests), chunk):
+            d = digests[i:i+chunk]
+            h1 = d & np.uint64(0xFFFFFFFF)
+            h2 = (d >> np.uint64(32)) | np.uint64(1)
+            for k in range(self.NHashes):
+                p = (h1 + np.uint64(k)*h2) % np.uint64(self.NBits)
+                np.bitwise_or.at(bits, p >> np.uint64(3), np.left_shift(1, p & np.uint64(7)).astype(np.uint8))
+
+    def add(self, item):
+        self.add_digests([digest(item)])
+
+    def might_contain(self, item):
+        """Returns False if the item is definitely not in the set, True if it may be in the set
+        """
+        bits = self.Bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self.positions(digest(item)))
+
+    __contains__ = might_contain
+
+    def fp_rate(self):
+        """Returns expected false positive rate for the current number of items
+        """
+        return (1.0 - math.exp(-self.NHashes * self.Count / self.NBits)) ** self.NHashes
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_Header.pack(Magic, FormatVersion, self.NHashes, self.NBits, self.Count))
+            f.write(self.Bits)
+        os.rename(tmp, path)
+
+    @staticmethod
+    def load(path):
+        """Loads the filter from the file. Returns None if the file does not exist
+        """
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            header = f.read(_Header.size)
+            if len(header) < _Header.size:
+                raise ValueError("Truncated Bloom filter file %s" % (path,))
+            magic, version, nhashes, nbits, count = _Header.unpack(header)
+            if magic != Magic:
+                raise ValueError("Not a Bloom filter file: %s" % (path,))
+            if version != FormatVersion:
+                raise ValueError("Unsupported Bloom filter format version %d in %s" % (version, path))
+            if os.fstat(f.fileno()).st_size != _Header.size + (nbits + 7) // 8:
+                raise ValueError("Bloom filter file %s has wrong size" % (path,))
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        bloom = BloomFilter(nbits, nhashes, memoryview(m)[_Header.size:], count)
+        bloom.MMap = m
+        return bloom
+
+    def close(self):
+        if self.MMap is not None:
+            self.Bits.release()
+            self.MMap.close()
+            self.Bits = self.MMap = None
@@ -1,6 +1,430 @@
-from .part import PartitionedList
+import math, os, random, shutil, tempfile
+from .part import PartitionedList, read_partition
+from .hashes import subpartition_hash
+from .manifest import ManifestError
+from .compression import codec_for_path, NoCompression
+from .hll import ItemOverhead, parse_size
+from .dirset import DirDictSet
 
-def cmp3(a, r, b):
+AverageItemSize = 100           # bytes, used to estimate partition memory when the item counts are unknown
+CompressionRatio = 5            # assumed for compressed partition files when the item counts are unknown
+DigestMemoryRatio = 0.35        # memory used by the "digest" engine relative to the "set" engine, see ``digestcmp``
+DirSetMemoryRatio = 0.3         # memory used by the "dirset" engine relative to the "set" engine, see ``dirset``
+SubpartitionMargin = 1.25       # partitions over the memory budget are split into this many times more sub-partitions than estimated
+
+def validate_lists(*lists):
+    """
+    Checks that the partitioned lists can be compared with each other: they must have the same number of partitions and use
+    the same hash scheme. Lists which have manifests are validated against them, so that missing or truncated partition files
+    are detected before any comparison work is done.
+    
+    Raises
+    ------
+    ManifestError
+        if the lists are inconsistent
+    """
+    nparts = set(lst.NParts for lst in lists)
+    if len(nparts) > 1:
+        raise ManifestError("Inconsistent number of parts: %s" % (", ".join(str(lst.NParts) for lst in lists),))
+    hashes = set(lst.HashName for lst in lists)
+    if len(hashes) > 1:
+        raise ManifestError("Inconsistent partition hash schemes: %s" % (", ".join(lst.HashName for lst in lists),))
+    for lst in lists:
+        lst.validate()
+
+class ComparisonAborted(ValueError):
+    """Raised by ``AbortGuard`` when the fraction of dark or missing items is too high for the comparison to be meaningful.
+    ``Kind`` is "dark" or "missing", ``Fraction`` is the estimated fraction and ``Partitions`` is the number of partitions compared
+    """
+
+    def __init__(self, message, kind=None, fraction=None, partitions=None):
+        ValueError.__init__(self, message)
+        self.Kind = kind
+        self.Fraction = fraction
+        self.Partitions = partitions
+
+class AbortGuard(object):
+    """Stops the comparison early when the fraction of dark or missing items is above the threshold, e.g. because the site scan
+    covered only part of the root or a database dump used a wrong path root.
+
+    The items are assigned to the partitions by hash, so each compared partition is a random sample of the lists, and the fractions
+    are estimated from the partitions compared so far. The comparison is aborted when at least ``min_partitions`` partitions have been
+    compared and the lower confidence bound of the fraction (Wilson score interval with ``z`` standard deviations) is above the threshold.
+
+    Parameters
+    ----------
+    max_dark : float or None
+        Maximum fraction of dark items among the site scan items, e.g. 0.1. None - not checked
+    max_missing : float or None
+        Maximum fraction of missing items among the items of the database dump made after the scan. None - not checked
+    min_partitions : int
+        Minimum number of partitions to compare before the comparison can be aborted
+    z : float
+        Width of the confidence interval, standard deviations
+    """
+
+    def __init__(self, max_dark=None, max_missing=None, min_partitions=3, z=3.0):
+        self.MaxDark = max_dark
+        self.MaxMissing = max_missing
+        self.MinPartitions = min_partitions
+        self.Z = z
+        self.Partitions = 0
+        self.Counts = {"dark": [0, 0], "missing": [0, 0]}        # {kind: [found, compared]}
+
+    def lower_bound(self, kind):
+        found, n = self.Counts[kind]
+        if not n:
+            return 0.0
+        p = min(1.0, found / n)
+        z2 = self.Z ** 2
+        return (p + z2/(2*n) - self.Z * math.sqrt(p*(1-p)/n + z2/(4*n*n))) / (1 + z2/n)
+
+    def fraction(self, kind):
+        found, n = self.Counts[kind]
+        return found / n if n else 0.0
+
+    def check(self, dark=None, r_count=None, missing=None, a_count=None):
+        """Adds the results of a compared partition: the numbers of dark and missing items found and the numbers of items in the
+        partitions of the site scan and of the database dump made after the scan.
+
+        Raises
+        ------
+        ComparisonAborted
+            if the fraction of dark or missing items is confidently above the threshold
+        """
+        self.Partitions += 1
+        for kind, found, n in (("dark", dark, r_count), ("missing", missing, a_count)):
+            if found is not None and n:
+                counts = self.Counts[kind]
+                counts[0] += found
+                counts[1] += n
+        if self.Partitions < self.MinPartitions:
+            return
+        for kind, limit in (("dark", self.MaxDark), ("missing", self.MaxMissing)):
+            if limit is not None and self.lower_bound(kind) > limit:
+                raise ComparisonAborted("Comparison aborted after %d partitions: %s fraction %.4f is above the limit %.4f" % (
+                    self.Partitions, kind, self.fraction(kind), limit), kind, self.fraction(kind), self.Partitions)
+
+def aborted_stats(e, partition_stats, dark, missing):
+    """Returns dictionary to be stored in the comparison stats when the comparison is aborted with ``ComparisonAborted`` ``e``
+    after finding ``dark`` and ``missing`` items. ``partition_stats`` is the dictionary filled by the comparison generator
+    """
+    return {
+        "status": "aborted",
+        "error": str(e),
+        "abort_reason": {"kind": e.Kind, "fraction": e.Fraction, "partitions_compared": e.Partitions},
+        "missing": missing,
+        "dark": dark,
+        "partitions": [dict(partition=i, **partition_stats[i]) for i in sorted(partition_stats)]
+    }
+
+def sample_partitions(nparts, k, seed=None):
+    """Returns sorted list of ``k`` partition indices chosen at random out of ``nparts``, or all the indices if ``k`` >= ``nparts``.
+    Items are assigned to partitions by hash, so the partitions with the same index in the lists to be compared are a random sample
+    of the items, see ``extrapolate``
+    """
+    if k >= nparts:
+        return list(range(nparts))
+    return sorted(random.Random(seed).sample(range(nparts), k))
+
+def extrapolate(values, nparts, z=1.96):
+    """Estimates the total over all partitions from the values, e.g. numbers of dark items, found in a random sample of the partitions.
+
+    Parameters
+    ----------
+    values : list of numbers
+        Values for the sampled partitions
+    nparts : int
+        Total number of partitions
+    z : float
+        Width of the confidence interval, standard deviations, default: 1.96 (95%)
+
+    Returns
+    -------
+    tuple (estimate, low, high)
+        Estimate of the total and the confidence interval. The interval is computed from the variance of the values between the
+        partitions, with the finite population correction, so it is exact if all the partitions were sampled.
+        low and high are None if fewer than 2 partitions were sampled
+    """
+    k = len(values)
+    if not k:
+        return None, None, None
+    mean = sum(values) / k
+    estimate = mean * nparts
+    if k >= nparts:
+        return estimate, estimate, estimate
+    if k < 2:
+        return estimate, None, None
+    variance = sum((x - mean)**2 for x in values) / (k - 1)
+    error = z * nparts * math.sqrt(variance / k * (nparts - k) / (nparts - 1))
+    return estimate, max(0.0, estimate - error), estimate + error
+
+def estimate_totals(partition_stats, nparts, keys=("dark", "missing"), z=1.96):
+    """Extrapolates the values stored in ``partition_stats`` for a random sample of the partitions to all ``nparts`` partitions,
+    see ``extrapolate``. Returns dictionary {key: {"estimate": ..., "low": ..., "high": ...}}
+    """
+    out = {}
+    for key in keys:
+        estimate, low, high = extrapolate([ps[key] for ps in partition_stats.values() if key in ps], nparts, z)
+        out[key] = {"estimate": estimate, "low": low, "high": high}
+    return out
+
+def sample_estimate(partition_stats, partitions, nparts, keys=("dark", "missing"), quiet=False):
+    """Extrapolates the results of the comparison of the sampled ``partitions`` to all ``nparts`` partitions with 95% confidence
+    intervals, see ``estimate_totals``, and prints the estimates unless ``quiet`` is True. Returns the dictionary to be stored in
+    the comparison stats as "estimate"
+    """
+    totals = estimate_totals(partition_stats, nparts, keys)
+    if not quiet:
+        for key in keys:
+            e = totals[key]
+            if e["low"] is None:
+                print("Estimated %s: %.0f" % (key, e["estimate"]))
+            else:
+                print("Estimated %s: %.0f (95%% confidence interval: %.0f - %.0f)" % (key, e["estimate"], e["low"], e["high"]))
+    return dict(totals, nparts=nparts, sampled_partitions=partitions, confidence=0.95)
+
+def _guard_check(guard, r_list, a_list):
+    # returns function checking the numbers of dark and missing items found in partition i with the guard, or None
+    if guard is None:
+        return None
+    r_counts, a_counts = _estimated_counts(r_list), _estimated_counts(a_list)
+    return lambda i, dark, missing: guard.check(dark, r_counts[i], missing, a_counts[i])
+
+def _set_of_batches(batches, set_factory=set):
+    s = set_factory()
+    for batch in batches:
+        s.update(batch)
+    return s
+
+def _file_batches(path):
+    # indexed gzip partition files are read in chunks by several threads, so that building the digests or the set of
+    # a large partition is not limited by the decompression speed of a single thread
+    return read_partition(path)
+
+class _file_source(object):
+
+    # picklable callable returning a new generator of batches of items read from the file, see ``digestcmp``.
+    # Sorted is True if the file is in "sorted" format, so that the items are read in sorted order, see ``mergecmp``
+
+    def __init__(self, path, is_sorted=False):
+        self.Path = path
+        self.Sorted = is_sorted
+
+    def __call__(self):
+        return _file_batches(self.Path)
+
+def _sources(lst):
+    return [_file_source(path, lst.Format == "sorted") for path in lst.FileNames]
+
+def _source_size(source):
+    # approximate uncompressed size of the partition file
+    size = os.path.getsize(source.Path)
+    if not isinstance(codec_for_path(source.Path), NoCompression):
+        size *= CompressionRatio
+    return size
+
+def _split_sources(sources, nsub):
+    # splits the partitions into nsub sub-partitions by the secondary hash. The sub-partitions are written into a temporary
+    # directory in $TMPDIR. Returns the directory and list of tuples of sources, one tuple per sub-partition
+    directory = tempfile.mkdtemp(prefix="rce-subpartitions-")
+    subs = []
+    for k, source in enumerate(sources):
+        paths = [os.path.join(directory, "%d.%05d" % (k, j)) for j in range(nsub)]
+        files = [open(path, "wb") for path in paths]
+        for batch in source():
+            buckets = [[] for _ in range(nsub)]
+            for item in batch:
+                buckets[subpartition_hash(item) % nsub].append(item)
+            for f, bucket in zip(files, buckets):
+                if bucket:
+                    f.write(b"\n".join(bucket) + b"\n")
+        for f in files:
+            f.close()
+        subs.append([_file_source(path) for path in paths])
+    return directory, list(zip(*subs))
+
+def _subpartitions(memory, mem_budget):
+    # number of sub-partitions to split each partition into to fit the memory budget
+    if not mem_budget:
+        return [1]*len(memory)
+    return [1 if x <= mem_budget else int(math.ceil(x * SubpartitionMargin / mem_budget)) for x in memory]
+
+Engines = ("set", "dirset", "digest", "merge")
+
+def _set_factory(engine):
+    # type of the sets used by the set-based engines
+    return DirDictSet if engine == "dirset" else set
+
+def parse_engine(engine):
+    """Parses the comparison engine specification: "set", "dirset", "digest" or "merge[:<run size>]", e.g. "merge:256M".
+    
+    Returns
+    -------
+    tuple (name, run size)
+        run size is the amount of memory used to sort a partition by the "merge" engine, bytes, see ``mergecmp``
+    
+    Raises
+    ------
+    ValueError
+        if the engine is unknown or can not be used
+    """
+    from .mergecmp import RunSize
+    name, _, run_size = engine.partition(":")
+    if name not in Engines:
+        raise ValueError("Unknown comparison engine: %s" % (engine,))
+    if name == "digest":
+        from . import digestcmp
+        if not digestcmp.available():
+            raise ValueError("The digest comparison engine requires numpy, which is not installed")
+    return name, parse_size(run_size) if run_size else RunSize
+
+def _task_memory(lists, engine, run_size):
+    # estimated memory needed to compare each partition of the lists with the engine
+    memory = partition_memory(*lists)
+    if engine == "digest":
+        memory = [x * DigestMemoryRatio for x in memory]
+    elif engine == "dirset":
+        memory = [x * DirSetMemoryRatio for x in memory]
+    elif engine == "merge":
+        memory = [min(x, run_size * (len(lists) + 1)) for x in memory]
+    return memory
+
+def _estimated_counts(lst):
+    # item counts per partition from the manifest, or estimated from the file sizes
+    counts = lst.counts()
+    if counts is not None:
+        return counts
+    counts = []
+    for path in lst.FileNames:
+        size = os.path.getsize(path)
+        if not isinstance(codec_for_path(path), NoCompression):
+            size *= CompressionRatio
+        counts.append(size // (AverageItemSize + 1))
+    return counts
+
+def partition_memory(*lists):
+    """Estimates memory needed to compare each partition of the lists, assuming that all the items of the partitions are held
+    in memory as Python objects, see ``hll.ItemOverhead``. Item counts are taken from the manifests, or estimated from the file sizes
+    if the lists have no manifests.
+
+    Returns
+    -------
+    list of int
+        estimated memory per partition, bytes
+    """
+    return [sum(counts) * (AverageItemSize + ItemOverhead) for counts in zip(*(_estimated_counts(lst) for lst in lists))]
+
+def run_parallel(function, tasks, workers, memory=None, mem_budget=None):
+    """Runs the tasks in a pool of worker processes and yields the results in the order the tasks complete. The number of tasks
+    running at the same time is limited by ``workers`` and, if ``mem_budget`` is given, by the estimated memory of the running tasks.
+    At least one task is always running, even if its estimate alone exceeds the budget.
+
+    Parameters
+    ----------
+    function : callable
+        Module level function receiving a task and returning a picklable result
+    tasks : list
+        Picklable task parameters
+    workers : int
+        Maximum number of tasks running at the same time
+    memory : list of int or None
+        Estimated memory needed by each task, bytes, see ``partition_memory``
+    mem_budget : int or None
+        Memory budget for the running tasks, bytes
+    """
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    memory = memory or [0]*len(tasks)
+    pending = list(zip(tasks, memory))[::-1]
+    running = {}                    # future -> memory estimate
+    in_use = 0
+    with ProcessPoolExecutor(max(1, min(workers, len(tasks)))) as pool:
+        while pending or running:
+            while pending and len(running) < workers and \
+                        (not running or mem_budget is None or in_use + pending[-1][1] <= mem_budget):
+                task, mem = pending.pop()
+                running[pool.submit(function, task)] = mem
+                in_use += mem
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_use -= running.pop(future)
+                yield future.result()
+
+def _batched(items, size=10000):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def cmp3_r(a, r, b, batches=False, set_factory=set):
+    """
+    Same as ``cmp3``, but holds ``r`` in memory instead of ``a``, so it uses less memory when ``r`` is the smallest of the 3 lists:
+    about the size of ``r`` plus the size of A-R instead of the size of ``a`` plus the size of R-A.
+    """
+    if not batches:
+        a, r, b = _batched(a), _batched(r), _batched(b)
+    r_set = _set_of_batches(r, set_factory)     # R minus the items found in A
+    r_a = set_factory()                         # R*A, moved out of r_set
+    a_r = set_factory()                         # A-R
+    for batch in a:
+        batch = set(batch)
+        in_r = r_set.intersection(batch)
+        r_set.difference_update(in_r)
+        r_a.update(in_r)
+        batch -= in_r
+        batch -= r_a.intersection(batch)
+        a_r.update(batch)
+    del r_a
+    m = set_factory()
+    for batch in b:
+        r_set.difference_update(batch)
+        m.update(a_r.intersection(batch))
+    return list(r_set), list(m)
+
+def cmp5(a_m, a_d, r, b_m, b_d, batches=False, set_factory=set):
+    """
+    Performs the 5-way comparison between the site scan ``r`` and 2 pairs of the database dumps, made after (``a_m``, ``a_d``) and
+    before (``b_m``, ``b_d``) the scan, in one pass over each list. Produces the same results as ``cmp3`` applied to
+    ``a_m``, ``r``, ``b_m`` for the missing items and to ``a_d``, ``r``, ``b_d`` for the dark items:
+
+        dark items - D = R - A_d - B_d
+        missing items - M = A_m * B_m - R
+        expected count - number of items in A_m * B_m
+
+    Parameters
+    ----------
+    a_m, a_d, r, b_m, b_d : iterable
+        Lists of items, or batches of items if ``batches`` is True
+    set_factory : callable
+        Type of the sets of items held in memory, ``set`` or ``dirset.DirDictSet``
+    
+    Returns
+    -------
+    tuple (d, m, expected)
+    """
+    if not batches:
+        a_m, a_d, r, b_m, b_d = map(_batched, (a_m, a_d, r, b_m, b_d))
+    m = _set_of_batches(a_m, set_factory)
+    expected = set_factory()
+    for batch in b_m:
+        expected.update(m.intersection(batch))
+    m = expected
+    n_expected = len(expected)
+    d = set_factory()
+    for batch in r:
+        m.difference_update(batch)
+        d.update(batch)
+    for batch in a_d:
+        d.difference_update(batch)
+    for batch in b_d:
+        d.difference_update(batch)
+    return list(d), list(m), n_expected
+
+def cmp3(a, r, b, batches=False, set_factory=set):
     """
     Performs the 3-way consistency comparison between 3 lists:
         
@@ -20,12 +444,31 @@ def cmp3(a, r, b):
     a : iterable
     b : iterable
     r : iterable
+    batches : boolean
+        If True, ``a``, ``r`` and ``b`` are iterables of batches (lists) of items, e.g. produced by ``PartitionedList.iter_batches``
+    set_factory : callable
+        Type of the sets of items held in memory: ``set`` or ``dirset.DirDictSet``, which uses several times less memory
+        for path-like items, but is slower
     
     Returns
     -------
     tuple (d, m)
         d and m are dark list and missing list respectively
     """
+    if batches:
+        a_r = _set_of_batches(a, set_factory)
+        r_a = set_factory()
+        for batch in r:
+            batch = set(batch)
+            in_a = a_r.intersection(batch)
+            a_r.difference_update(in_a)
+            r_a.update(batch - in_a)
+        d = r_a
+        m = set_factory()
+        for batch in b:
+            d.difference_update(batch)
+            m.update(a_r.intersection(batch))
+        return list(d), list(m)
     
     #
     # produces 2 lists:
@@ -33,14 +476,14 @@ def cmp3(a, r, b):
     #       D = R-A-B = (R-A)-B
     #       M = A*B-R = (A-R)*B
     #
-    a_r = set(a)    # this will be A-R
-    r_a = set()     # this will be R-A
+    a_r = set_factory(a)    # this will be A-R
+    r_a = set_factory()     # this will be R-A
     for x in r:
             try:    a_r.remove(x)
             except KeyError:
                     r_a.add(x)
     d = r_a
-    m = set()
+    m = set_factory()
     for x in b:
             try:    d.remove(x)
             except KeyError:    pass
@@ -49,14 +492,29 @@ def cmp3(a, r, b):
     #print("memory utilization at the end of cmp3, MB:", getMemory())
     return list(d), list(m)
     
-def cmp2(a, b):
+def cmp2(a, b, batches=False, set_factory=set):
     """
     returns tuple:   (a&b), (a-b), (b-a)
+    
+    If ``batches`` is True, ``a`` and ``b`` are iterables of batches (lists) of items. ``set_factory`` is the type of the sets,
+    see ``cmp3``
     """
-    a_set = set(a)
-    a_and_b = set()
-    b_minus_a = set()
-    a_minus_b = set()
+    if batches:
+        a_set = _set_of_batches(a, set_factory)
+        a_and_b = set_factory()
+        b_minus_a = set_factory()
+        for batch in b:
+            batch = set(batch)
+            in_a = a_set.intersection(batch)
+            a_and_b.update(in_a)
+            b_minus_a.update(batch - in_a)
+        a_set.difference_update(a_and_b)
+        return a_and_b, a_set, b_minus_a
+
+    a_set = set_factory(a)
+    a_and_b = set_factory()
+    b_minus_a = set_factory()
+    a_minus_b = set_factory()
 
     for x in b:
         if x in a_set:
@@ -69,10 +527,19 @@ def cmp2(a, b):
     
     return a_and_b, a_minus_b, b_minus_a
     
-def cmp3_missing(a, r, b):
+def cmp3_missing(a, r, b, batches=False, set_factory=set):
     #       M = A*B-R
-    m = set()    
-    a_set = set(a)    
+    if batches:
+        a_set = _set_of_batches(a, set_factory)
+        m = set_factory()
+        for batch in b:
+            m.update(a_set.intersection(batch))
+        del a_set
+        for batch in r:
+            m.difference_update(batch)
+        return list(m)
+    m = set_factory()
+    a_set = set_factory(a)
     for x in b:
         if x in a_set:
             m.add(x)
@@ -82,9 +549,16 @@ def cmp3_missing(a, r, b):
             m.remove(x)
     return list(m)
     
-def cmp3_dark(a, r, b):
+def cmp3_dark(a, r, b, batches=False, set_factory=set):
     #       D = R-A-B = (R-A)-B
-    d = set(r)     
+    if batches:
+        d = _set_of_batches(r, set_factory)
+        for batch in a:
+            d.difference_update(batch)
+        for batch in b:
+            d.difference_update(batch)
+        return list(d)
+    d = set_factory(r)
     for x in a:
         try:    d.remove(x)
         except KeyError: pass
@@ -112,14 +586,112 @@ def cmp3_lists(a_list, r_list, b_list):
             print("Partition %d compared: dark:%d missing:%d" % (i, len(d), len(m))) 
     return d_list, m_list
 
-def intersection_count(a_list, b_list):
+def _intersection_count(a_batches, b_batches, set_factory=set):
+    a_set = _set_of_batches(a_batches, set_factory)
     n = 0
-    for i, (ap, bp) in enumerate(zip(a_list.partitions, b_list.partitions)):
-        a_and_b, _, _ = cmp2(ap, bp)
-        n += len(a_and_b)
+    for batch in b_batches:
+        n += len(a_set.intersection(batch))
     return n
 
-def cmp3_generator(a_list, r_list, b_list, stream=None):
+def _intersection_count_task(params):
+    i, a_source, b_source, engine, run_size = params
+    if engine == "digest":
+        from .digestcmp import digest_intersection_count
+        return i, digest_intersection_count(a_source, b_source)
+    elif engine == "merge":
+        from .mergecmp import merge_intersection_count, sorted_items
+        return i, merge_intersection_count(*(sorted_items(source(), source.Sorted, run_size) for source in (a_source, b_source)))
+    return i, _intersection_count(a_source(), b_source(), _set_factory(engine))
+
+def intersection_count(a_list, b_list, workers=None, mem_budget=None, partition_stats=None, engine="set"):
+    """Counts the items present in both partitioned lists.
+
+    Parameters
+    ----------
+    a_list, b_list : PartitionedList
+    workers : int or None
+        If greater than 1, the partitions are compared in parallel worker processes, see ``run_parallel``
+    mem_budget : int or None
+        With ``workers``, the memory budget for the partitions being compared at the same time, bytes
+    partition_stats : dict or None
+        If given, the count for each partition is stored as ``partition_stats[i]["intersection"]``
+    engine : str
+        Comparison engine, see ``cmp3_generator``
+    """
+    validate_lists(a_list, b_list)
+    engine, run_size = parse_engine(engine)
+    tasks = [(i, a_source, b_source, engine, run_size) for i, (a_source, b_source) in enumerate(zip(_sources(a_list), _sources(b_list)))]
+    if workers and workers > 1:
+        results = run_parallel(_intersection_count_task, tasks, workers, _task_memory([a_list], engine, run_size), mem_budget)
+    elif engine not in ("set", "dirset"):
+        results = map(_intersection_count_task, tasks)
+    else:
+        results = ((i, _intersection_count(ap.iter_batches(), bp.iter_batches(), _set_factory(engine)))
+                    for i, (ap, bp) in enumerate(zip(a_list.partitions, b_list.partitions)))
+    n = 0
+    for i, count in results:
+        if partition_stats is not None:
+            partition_stats.setdefault(i, {})["intersection"] = count
+        n += count
+    return n
+
+def _cmp3_partition(a, r, b, stream, batches, sizes=None, set_factory=set):
+    # returns (dark, missing) lists for one partition. sizes are the approximate sizes of the a, r and b partitions, used to
+    # hold the smallest of the lists in memory
+    if sizes is not None:
+        a_size, r_size, b_size = sizes
+        if stream != 'd' and b_size < a_size:
+            a, b, a_size, b_size = b, a, b_size, a_size         # the comparison is symmetric with respect to a and b
+        if stream is None and r_size < a_size:
+            d, m = cmp3_r(a, r, b, batches, set_factory)
+            if batches:
+                d, m = [f.decode("utf-8") for f in d], [f.decode("utf-8") for f in m]
+            return d, m
+    if stream is None:
+        d, m = cmp3(a, r, b, batches, set_factory)
+    elif stream == 'd':
+        d, m = cmp3_dark(a, r, b, batches, set_factory), []
+    else:
+        d, m = [], cmp3_missing(a, r, b, batches, set_factory)
+    if batches:
+        d, m = [f.decode("utf-8") for f in d], [f.decode("utf-8") for f in m]
+    return d, m
+
+def _merge_cmp3(a_source, r_source, b_source, stream, run_size):
+    # generator of (stream, item as str) for one partition, see ``mergecmp``
+    from .mergecmp import merge_cmp3, sorted_items
+    inputs = [sorted_items(source(), source.Sorted, run_size) for source in (a_source, r_source, b_source)]
+    for t, item in merge_cmp3(*inputs, stream):
+        yield t, item.decode("utf-8")
+
+def _cmp3_task(params):
+    i, a_source, r_source, b_source, stream, engine, run_size, nsub = params
+    if nsub > 1:
+        # compare the sub-partitions one at a time
+        directory, subs = _split_sources((a_source, r_source, b_source), nsub)
+        try:
+            d, m = [], []
+            for sub in subs:
+                _, sub_d, sub_m = _cmp3_task((i,) + sub + (stream, engine, run_size, 1))
+                d += sub_d
+                m += sub_m
+            return i, d, m
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    if engine == "digest":
+        from .digestcmp import digest_cmp3
+        d, m = digest_cmp3(a_source, r_source, b_source, stream)
+        return i, [f.decode("utf-8") for f in d], [f.decode("utf-8") for f in m]
+    elif engine == "merge":
+        d, m = [], []
+        for t, item in _merge_cmp3(a_source, r_source, b_source, stream, run_size):
+            (d if t == 'd' else m).append(item)
+        return i, d, m
+    sizes = [_source_size(source) for source in (a_source, r_source, b_source)]
+    return (i,) + _cmp3_partition(a_source(), r_source(), b_source(), stream, True, sizes, _set_factory(engine))
+
+def cmp3_generator(a_list, r_list, b_list, stream=None, batches=False, workers=None, mem_budget=None, partition_stats=None, engine="set",
+                    cache=None, guard=None, partitions=None):
     """
     Performs the 3-way consistency comparison between 3 partitoined lists:
         
@@ -141,6 +713,40 @@ def cmp3_generator(a_list, r_list, b_list, stream=None):
     r : ParitionedList object
     stream : str or None
         output stream selection, "d" or "m" or None
+    batches : boolean
+        If True, the partitions are read as batches of bytes (see ``PartitionedList.iter_batches``), which is faster.
+        The items are still returned as str
+    workers : int or None
+        If greater than 1, the partitions are compared in parallel worker processes and the results of each partition are returned
+        as soon as the partition is compared, see ``run_parallel``. The partitions are always read as batches in this case
+    mem_budget : int or None
+        Memory budget for the comparison, bytes. Memory needed to compare a partition is estimated with ``partition_memory``
+        and the engine. A partition estimated to need more than the budget is split with a secondary hash (see ``hashes.subpartition_hash``)
+        into temporary sub-partitions in $TMPDIR, which are compared one at a time. With ``workers``, the budget also limits
+        the partitions being compared at the same time. Not used by the "merge" engine, which needs bounded memory anyway
+    partition_stats : dict or None
+        If given, the numbers of dark and missing items found in each partition are stored as ``partition_stats[i]["dark"]``
+        and ``partition_stats[i]["missing"]``, depending on ``stream``
+    engine : str
+        "set" - compare Python sets of the items, "dirset" - same, but with the items stored with the directory parts
+        encoded in a dictionary (see ``dirset``), which uses several times less memory for typical LFNs and is several times slower,
+        "digest" - compare arrays of digests of the items (see ``digestcmp``), which uses
+        several times less memory and requires numpy. With the "digest" engine, each partition is read twice and read-ahead is not used.
+        "merge[:<run size>]" - compare sorted streams of the items (see ``mergecmp``), using about <run size> bytes of memory
+        (default 64MB) to sort each of the partitions not in "sorted" format, regardless of the partition size. Without ``workers``,
+        the items are returned as they are found, in sorted order within each partition
+    cache : rescache.ResultCache or None
+        If given, the results of the partitions whose input partitions have the same contents as in a previous comparison are taken
+        from the cache instead of comparing the partitions again, and the results of the compared partitions are stored in the cache.
+        Such partitions are marked as ``partition_stats[i]["cached"] = True``. Results of the comparison of both streams are reused
+        when only one stream is requested
+    guard : AbortGuard or None
+        If given, the numbers of dark and missing items found in each partition are checked with the guard, which raises
+        ``ComparisonAborted`` when their fractions are too high. The fractions are relative to the item counts of the partitions
+        of ``r_list`` and ``a_list`` from the manifests, or estimated from the file sizes. The exception is raised after the items of
+        the partition are returned, so the items returned match ``partition_stats``. No more partitions are compared after that
+    partitions : list of int or None
+        Indices of the partitions to compare, e.g. a random sample produced by ``sample_partitions``. Default: all
     
     Returns
     -------
@@ -152,23 +758,263 @@ def cmp3_generator(a_list, r_list, b_list, stream=None):
     -----
     The order in which items are retruned is not specified and may change depending on the implementation details.
     
-    Number of partitions in all 3 lists must be the same.
+    Number of partitions in all 3 lists must be the same. Lists with manifests are validated before the comparison starts,
+    see ``validate_lists``.
+    
+    If the lists are open with read-ahead (see ``PartitionedList.open``), all 3 partitions to be compared are read and decompressed
+    in background threads while the items are being processed.
     """
 
     assert a_list.NParts == r_list.NParts and r_list.NParts == b_list.NParts, "Inconsistent number of parts: B:%d, R:%d, A:%d" % (
         b_list.NParts, r_list.NParts, a_list.NParts)
+    validate_lists(a_list, r_list, b_list)
+    engine, run_size = parse_engine(engine)
+    check = _guard_check(guard, r_list, a_list)
 
-    d_list, m_list = [], []
-    for i, (ap, rp, bp) in enumerate(zip(a_list.partitions, r_list.partitions, b_list.partitions)):
-            #print("Comparing %s %s %s..." % (an, rn, bn))
-            if stream is None:
-                d, m = cmp3(ap, rp, bp)
-                yield from (('d',f) for f in d)
-                yield from (('m',f) for f in m)
-            elif stream == 'd':
-                yield from cmp3_dark(ap, rp, bp)
-            elif stream == 'm':
-                yield from cmp3_missing(ap, rp, bp)
+    memory = _task_memory([a_list, r_list], engine, run_size)
+    nsubs = _subpartitions(memory, mem_budget if engine != "merge" else None)
+    tasks = [(i, a_source, r_source, b_source, stream, engine, run_size, nsub) 
+                for i, (a_source, r_source, b_source, nsub) in enumerate(zip(_sources(a_list), _sources(r_list), _sources(b_list), nsubs))]
+    if partitions is not None:
+        selected = set(partitions)
+        tasks = [task for task in tasks if task[0] in selected]
+    if workers and workers > 1:
+        memory = [x if mem_budget is None else min(x, mem_budget) for x in memory]
+        run = lambda tasks: run_parallel(_cmp3_task, tasks, workers, [memory[t[0]] for t in tasks], mem_budget)
+    elif engine == "merge" and cache is None:
+        yield from _cmp3_merge_sequential(tasks, stream, partition_stats, check)
+        return
+    elif engine not in ("set", "dirset"):
+        run = lambda tasks: map(_cmp3_task, tasks)
+    else:
+        run = lambda tasks: _cmp3_sequential(a_list, r_list, b_list, stream, batches, tasks)
+    if cache is not None:
+        from .rescache import cached_results
+        keys = cache.partition_keys("cmp3", [a_list, r_list, b_list], [stream] if stream is None else [stream, None])
+        results = cached_results(cache, keys, tasks, run, partition_stats)
+    else:
+        results = run(tasks)
+    for i, d, m in results:
+        if partition_stats is not None:
+            ps = partition_stats.setdefault(i, {})
+            if stream != 'm':   ps["dark"] = len(d)
+            if stream != 'd':   ps["missing"] = len(m)
+        if stream is None:
+            yield from (('d',f) for f in d)
+            yield from (('m',f) for f in m)
+        else:
+            yield from (d if stream == 'd' else m)
+        if check is not None:
+            # checked after the items of the partition are returned, so that they are accounted for in the partition stats
+            check(i, len(d) if stream != 'm' else None, len(m) if stream != 'd' else None)
+
+def _cmp3_merge_sequential(tasks, stream, partition_stats, check):
+    # streams the results of the "merge" engine without collecting them in memory
+    for i, a_source, r_source, b_source, _, _, run_size, _ in tasks:
+        counts = {'d': 0, 'm': 0}
+        for t, item in _merge_cmp3(a_source, r_source, b_source, stream, run_size):
+            counts[t] += 1
+            yield (t, item) if stream is None else item
+        if partition_stats is not None:
+            ps = partition_stats.setdefault(i, {})
+            if stream != 'm':   ps["dark"] = counts['d']
+            if stream != 'd':   ps["missing"] = counts['m']
+        if check is not None:
+            check(i, counts['d'] if stream != 'm' else None, counts['m'] if stream != 'd' else None)
+
+def _cmp3_sequential(a_list, r_list, b_list, stream, batches, tasks):
+    partitions = list(zip(a_list.partitions, r_list.partitions, b_list.partitions))
+    for task in tasks:
+            i = task[0]
+            ap, rp, bp = partitions[i]
+            if task[-1] > 1:
+                yield _cmp3_task(task)      # split into sub-partitions
+                continue
+            for p in (ap, rp, bp):
+                p.start(batches)    # with read-ahead enabled, read all 3 partitions while the first one is being processed
+            if batches:
+                ap, rp, bp = ap.iter_batches(), rp.iter_batches(), bp.iter_batches()
+            sizes = [_source_size(source) for source in task[1:4]]
+            yield (i,) + _cmp3_partition(ap, rp, bp, stream, batches, sizes, _set_factory(task[5]))
+
+def _cmp5_task(params):
+    i, sources, engine, run_size, nsub = params
+    if nsub > 1:
+        # compare the sub-partitions one at a time
+        directory, subs = _split_sources(sources, nsub)
+        try:
+            d, m, expected = [], [], 0
+            for sub in subs:
+                _, sub_d, sub_m, sub_expected = _cmp5_task((i, sub, engine, run_size, 1))
+                d += sub_d
+                m += sub_m
+                expected += sub_expected
+            return i, d, m, expected
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    if engine == "digest":
+        from .digestcmp import digest_cmp5
+        d, m, expected = digest_cmp5(*sources)
+    elif engine == "merge":
+        from .mergecmp import merge_cmp5, sorted_items
+        d, m, expected = merge_cmp5(*(sorted_items(source(), source.Sorted, run_size) for source in sources))
+    else:
+        d, m, expected = cmp5(*(source() for source in sources), batches=True, set_factory=_set_factory(engine))
+    return i, [f.decode("utf-8") for f in d], [f.decode("utf-8") for f in m], expected
+
+def cmp5_generator(a_m_list, a_d_list, r_list, b_m_list, b_d_list, workers=None, mem_budget=None, partition_stats=None, engine="set",
+                    cache=None, guard=None, partitions=None):
+    """
+    Performs the 5-way comparison between the site scan and 2 pairs of the database dumps (see ``cmp5``) partition by partition,
+    reading each partition of each list once.
+
+    Parameters
+    ----------
+    a_m_list, b_m_list : PartitionedList
+        Database dumps after and before the scan used to find the missing items, e.g. active replicas
+    a_d_list, b_d_list : PartitionedList
+        Database dumps after and before the scan used to find the dark items, e.g. all replicas
+    r_list : PartitionedList
+        Site scan
+    workers, mem_budget, engine
+        See ``cmp3_generator``
+    partition_stats : dict or None
+        If given, the numbers of dark and missing items and the expected count, the number of items in both ``a_m_list`` and
+        ``b_m_list``, are stored for each partition as ``partition_stats[i]["dark"]``, ``["missing"]`` and ``["expected"]``
+    cache : rescache.ResultCache or None
+        Cache of the partition results, see ``cmp3_generator``
+    guard : AbortGuard or None
+        Checks the fractions of dark and missing items, see ``cmp3_generator``. The fraction of missing items is relative to
+        the item count of ``a_m_list``
+    partitions : list of int or None
+        Indices of the partitions to compare, see ``cmp3_generator``
+    
+    Returns
+    -------
+    generator of tuples (<stream>, <item>)
+        ``stream`` is "d" for dark items or "m" for missing items
+    """
+    lists = (a_m_list, a_d_list, r_list, b_m_list, b_d_list)
+    validate_lists(*lists)
+    engine, run_size = parse_engine(engine)
+    check = _guard_check(guard, r_list, a_m_list)
+    memory = _task_memory(lists if engine == "merge" else [a_m_list, r_list], engine, run_size)
+    nsubs = _subpartitions(memory, mem_budget if engine != "merge" else None)
+    tasks = [(i, sources, engine, run_size, nsub) for i, (sources, nsub) in enumerate(zip(zip(*map(_sources, lists)), nsubs))]
+    if partitions is not None:
+        selected = set(partitions)
+        tasks = [task for task in tasks if task[0] in selected]
+    if workers and workers > 1:
+        memory = [x if mem_budget is None else min(x, mem_budget) for x in memory]
+        run = lambda tasks: run_parallel(_cmp5_task, tasks, workers, [memory[t[0]] for t in tasks], mem_budget)
+    elif engine in ("set", "dirset"):
+        run = lambda tasks: _cmp5_sequential(lists, tasks)
+    else:
+        run = lambda tasks: map(_cmp5_task, tasks)
+    if cache is not None:
+        from .rescache import cached_results
+        results = cached_results(cache, cache.partition_keys("cmp5", lists), tasks, run, partition_stats)
+    else:
+        results = run(tasks)
+    for i, d, m, expected in results:
+        if partition_stats is not None:
+            partition_stats.setdefault(i, {}).update({"dark": len(d), "missing": len(m), "expected": expected})
+        yield from (('d',f) for f in d)
+        yield from (('m',f) for f in m)
+        if check is not None:
+            check(i, len(d), len(m))
+
+def _cmp5_sequential(lists, tasks):
+    all_partitions = list(zip(*(lst.partitions for lst in lists)))
+    for task in tasks:
+        i = task[0]
+        partitions = all_partitions[i]
+        if task[-1] > 1:
+            yield _cmp5_task(task)      # split into sub-partitions
+            continue
+        for p in partitions:
+            p.start(True)       # with read-ahead enabled, read all 5 partitions while the first one is being processed
+        d, m, expected = cmp5(*(p.iter_batches() for p in partitions), batches=True, set_factory=_set_factory(task[2]))
+        yield i, [f.decode("utf-8") for f in d], [f.decode("utf-8") for f in m], expected
+
+def _cmp2_partition(a_batches, b_batches, op):
+    # returns (out, n_a, n_b) for one partition: the result of the set operation as list of str and the numbers of items in a and b
+    b_set = _set_of_batches(b_batches)
+    n_b = len(b_set)
+    n_a = 0
+    out = []
+    for batch in a_batches:
+        n_a += len(batch)
+        if op in ("and", "join"):
+            out += [f for f in batch if f in b_set]
+        elif op == "minus":
+            out += [f for f in batch if f not in b_set]
+        elif op == "xor":
+            for f in batch:
+                if f in b_set:
+                    b_set.remove(f)
+                else:
+                    out.append(f)
+        elif op == "or":
+            b_set.difference_update(batch)
+            out += batch
+    if op in ("or", "xor"):
+        out += b_set
+    return [f.decode("utf-8") for f in out], n_a, n_b
+
+def _cmp2_task(params):
+    i, a_path, b_path, op = params
+    return (i,) + _cmp2_partition(_file_batches(a_path), _file_batches(b_path), op)
+
+Cmp2Operations = ("and", "join", "minus", "xor", "or")
+
+def cmp2_generator(a_list, b_list, op, workers=None, mem_budget=None, partition_stats=None):
+    """
+    Applies the set operation to 2 partitioned lists partition by partition.
+
+    Parameters
+    ----------
+    a_list, b_list : PartitionedList
+    op : str
+        "and" (or "join") - items in both lists, "minus" - items in ``a_list`` but not in ``b_list``, "xor" - items in only one of the lists,
+        "or" - items in any of the lists
+    workers : int or None
+        If greater than 1, the partitions are processed in parallel worker processes, see ``cmp3_generator``
+    mem_budget : int or None
+        With ``workers``, the memory budget for the partitions being processed at the same time, bytes
+    partition_stats : dict or None
+        If given, the numbers of items read from each list and the number of items produced for each partition are stored in
+        ``partition_stats[i]`` as "a", "b" and "out"
+
+    Returns
+    -------
+    generator of str
+        the resulting items
+
+    Raises
+    ------
+    ValueError
+        if the operation is unknown
+    ManifestError
+        if the lists are inconsistent, see ``validate_lists``. The lists are validated when the function is called, before the
+        generator is returned, so that the caller can check them before creating the output
+    """
+    if op not in Cmp2Operations:
+        raise ValueError("Unknown operation: %s" % (op,))
+    validate_lists(a_list, b_list)
+    return _cmp2_generator(a_list, b_list, op, workers, mem_budget, partition_stats)
+
+def _cmp2_generator(a_list, b_list, op, workers, mem_budget, partition_stats):
+    if workers and workers > 1:
+        tasks = [(i, a_path, b_path, op) for i, (a_path, b_path) in enumerate(zip(a_list.FileNames, b_list.FileNames))]
+        results = run_parallel(_cmp2_task, tasks, workers, partition_memory(a_list, b_list), mem_budget)
+    else:
+        results = ((i,) + _cmp2_partition(ap.iter_batches(), bp.iter_batches(), op)
+                    for i, (ap, bp) in enumerate(zip(a_list.partitions, b_list.partitions)))
+    for i, out, n_a, n_b in results:
+        if partition_stats is not None:
+            partition_stats.setdefault(i, {}).update({"a": n_a, "b": n_b, "out": len(out)})
+        yield from out
 
 def cmp3_parts(a_prefix, r_prefix, b_prefix):
     a_list = PartitionedList.open(a_prefix)
@@ -0,0 +1,92 @@
+"""Numeric columns aligned with the records of partition files, e.g. file sizes and modification times from the site scan.
+
+Each column of a partition is stored as a sidecar file <partition file without compression extension>.<column name>.col
+with a fixed-width array of signed 64-bit integers, one per record of the partition file, in the same order::
+
+    header (32 bytes):
+        magic           4s      b"RCCL"
+        version         uint8
+        reserved        3 bytes
+        column name     16s     utf-8, padded with zeros
+        reserved        8 bytes
+    values          int64 * number of records, little-endian
+
+Missing values are stored as -1. Columns are supported for text and binary partition files, where records are stored in the order
+they were added.
+"""
+
+import os, struct, sys
+from array import array
+from .compression import Extensions
+
+Magic = b"RCCL"
+FormatVersion = 1
+Suffix = ".col"
+Missing = -1
+TypeCode = "q"
+
+_Header = struct.Struct("<4sB3x16s8x")
+
+HeaderSize = _Header.size
+
+
+def column_path(path, name):
+    """Returns path of the column sidecar file for the partition file, e.g. prefix.00001.gz -> prefix.00001.size.col
+    """
+    base, ext = os.path.splitext(path)
+    if ext not in Extensions:
+        base = path
+    return "%s.%s%s" % (base, name, Suffix)
+
+def check_name(name):
+    if not name or "." in name or "/" in name or len(name.encode("utf-8")) > 16:
+        raise ValueError("Invalid column name: %r. Column names must be up to 16 bytes long and must not contain '.' or '/'" % (name,))
+    return name
+
+def _to_little(values):
+    if sys.byteorder != "little":
+        values = array(TypeCode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class ColumnWriter(object):
+    """Appends values to a column file. The file is open only while the values are written.
+    """
+
+    def __init__(self, path, name):
+        self.Path = path
+        self.Name = check_name(name)
+        self.Count = 0
+        with open(path, "wb") as f:
+            f.write(_Header.pack(Magic, FormatVersion, name.encode("utf-8")))
+
+    def append(self, values):
+        # values: array("q")
+        if values:
+            with open(self.Path, "ab") as f:
+                f.write(_to_little(values))
+            self.Count += len(values)
+
+
+def load_column(path):
+    """Reads the column file. Returns tuple (name, values), where values is array("q"), or None if the file does not exist
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HeaderSize:
+        raise ValueError("Truncated column file %s" % (path,))
+    magic, version, name = _Header.unpack(data[:HeaderSize])
+    if magic != Magic:
+        raise ValueError("Not a column file: %s" % (path,))
+    if version != FormatVersion:
+        raise ValueError("Unsupported column format version %d in %s" % (version, path))
+    if (len(data) - HeaderSize) % 8:
+        raise ValueError("Column file %s has wrong size" % (path,))
+    values = array(TypeCode)
+    values.frombytes(data[HeaderSize:])
+    if sys.byteorder != "little":
+        values.byteswap()
+    return name.rstrip(b"\0").decode("utf-8"), values
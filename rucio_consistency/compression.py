@@ -0,0 +1,220 @@
+"""Compression codecs used for partition files and other outputs.
+
+Codecs are selected by name: "gzip", "zstd", "lz4". zstd and lz4 are used only if the corresponding optional module
+(``zstandard``, ``lz4``) is installed. Codec specification string has the form <name>[:<level>[:<threads>]], e.g. "gzip:6:4".
+With more than one thread, gzip output is produced by compressing blocks of data in parallel, each block as a separate
+gzip member. Concatenated members form a standard gzip file, readable by any gzip tool.
+
+On read, the codec is chosen by the file name extension.
+"""
+
+import gzip, io, os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .gzindex import IndexedGzipWriter, index_path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    """Writable binary file object producing multi-member gzip file. Data is accumulated into blocks of at least ``block_size`` bytes,
+    which are compressed by a pool of threads. Blocks are cut only between ``write`` calls, so if each ``write`` call
+    receives complete lines, each gzip member will contain complete lines.
+    """
+
+    BlockSize = 1024*1024
+
+    def __init__(self, f, level=9, threads=2, block_size=None):
+        io.RawIOBase.__init__(self)
+        self.F = f
+        self.Level = level
+        self.Threads = threads
+        self.BlockSize = block_size or self.BlockSize
+        self.Executor = ThreadPoolExecutor(threads)
+        self.Pending = deque()
+        self.Buffer = []
+        self.Buffered = 0
+        self.NBlocks = 0
+
+    def writable(self):
+        return True
+
+    def _submit(self):
+        data = b"".join(self.Buffer)
+        self.Buffer = []
+        self.Buffered = 0
+        self.Pending.append(self.Executor.submit(gzip.compress, data, self.Level, mtime=0))
+        self.NBlocks += 1
+        while len(self.Pending) > self.Threads*2:
+            self.F.write(self.Pending.popleft().result())
+
+    def write(self, data):
+        self.Buffer.append(bytes(data))
+        self.Buffered += len(data)
+        if self.Buffered >= self.BlockSize:
+            self._submit()
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            if self.Buffer or not self.NBlocks:
+                self._submit()          # write at least one (possibly empty) member
+            while self.Pending:
+                self.F.write(self.Pending.popleft().result())
+            self.Executor.shutdown()
+            self.F.close()
+        io.RawIOBase.close(self)
+
+
+class Codec(object):
+
+    Name = None
+    Extension = ""
+    DefaultLevel = None
+    Available = True
+
+    def __init__(self, level=None, threads=1):
+        self.Level = self.DefaultLevel if level is None else level
+        self.Threads = threads or 1
+
+    def __str__(self):
+        return "%s:%s:%s" % (self.Name, self.Level, self.Threads)
+
+    def open_write(self, path, append=False, index=False):
+        # index: whether to write the file so that it can be read from several access points, supported by gzip only, see ``gzindex``
+        raise NotImplementedError()
+
+    def open_read(self, path):
+        raise NotImplementedError()
+
+    def open(self, path, mode="rb"):
+        """Opens the file with the codec. Mode can be "r", "w" or "a" (append), optionally followed by "b" (default) or "t"
+        """
+        text = "t" in mode
+        if mode[0] == "r":
+            f = self.open_read(path)
+        else:
+            f = self.open_write(path, append=mode[0] == "a")
+        return io.TextIOWrapper(f, encoding="utf-8") if text else f
+
+
+class NoCompression(Codec):
+
+    Name = "none"
+
+    def open_write(self, path, append=False, index=False):
+        return open(path, "ab" if append else "wb")
+
+    def open_read(self, path):
+        return open(path, "rb")
+
+
+class GzipCodec(Codec):
+
+    Name = "gzip"
+    Extension = ".gz"
+    DefaultLevel = 9
+
+    def open_write(self, path, append=False, index=False):
+        if index:
+            # written by single thread as a sequence of members starting at the access points
+            return IndexedGzipWriter(open(path, "ab" if append else "wb"), self.Level, index_path(path), append=append)
+        if self.Threads > 1:
+            return ParallelGzipWriter(open(path, "ab" if append else "wb"), self.Level, self.Threads)
+        return gzip.open(path, "ab" if append else "wb", compresslevel=self.Level)
+
+    def open_read(self, path):
+        return gzip.open(path, "rb")
+
+
+class ZstdCodec(Codec):
+
+    Name = "zstd"
+    Extension = ".zst"
+    DefaultLevel = 3
+    Available = zstandard is not None
+
+    def open_write(self, path, append=False, index=False):
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard module")
+        cctx = zstandard.ZstdCompressor(level=self.Level, threads=self.Threads if self.Threads > 1 else 0)
+        return cctx.stream_writer(open(path, "ab" if append else "wb"), closefd=True)
+
+    def open_read(self, path):
+        if zstandard is None:
+            raise ValueError("zstd decompression requires the zstandard module")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+        return io.BufferedReader(reader)
+
+
+class Lz4Codec(Codec):
+
+    Name = "lz4"
+    Extension = ".lz4"
+    DefaultLevel = 0
+    Available = lz4 is not None
+
+    def open_write(self, path, append=False, index=False):
+        if lz4 is None:
+            raise ValueError("lz4 compression requires the lz4 module")
+        return lz4.frame.open(path, "ab" if append else "wb", compression_level=self.Level)
+
+    def open_read(self, path):
+        if lz4 is None:
+            raise ValueError("lz4 decompression requires the lz4 module")
+        return lz4.frame.open(path, "rb")
+
+
+Codecs = {c.Name: c for c in (NoCompression, GzipCodec, ZstdCodec, Lz4Codec)}
+Extensions = {c.Extension: c for c in Codecs.values() if c.Extension}
+
+
+def get_codec(spec):
+    """Returns Codec object for the specification, which can be:
+        None or False - no compression
+        True - gzip with default level
+        "<name>[:<level>[:<threads>]]" string
+        Codec object - returned as is
+    """
+    if isinstance(spec, Codec):
+        return spec
+    if spec is None or spec is False:
+        return NoCompression()
+    if spec is True:
+        return GzipCodec()
+    words = spec.split(":")
+    name = words[0]
+    if name not in Codecs:
+        raise ValueError("Unknown compression codec: %s" % (name,))
+    level = int(words[1]) if len(words) > 1 and words[1] else None
+    threads = int(words[2]) if len(words) > 2 and words[2] else 1
+    return Codecs[name](level, threads)
+
+def codec_for_path(path):
+    """Returns Codec object to be used to read the file based on the file name extension
+    """
+    ext = os.path.splitext(path)[1]
+    return Extensions.get(ext, NoCompression)()
+
+def open_compressed(path, mode="rb", codec=None):
+    """Opens a file, which may be compressed. If ``codec`` is None, the codec is chosen by the file name extension.
+    See ``Codec.open`` for the mode values.
+    """
+    codec = codec_for_path(path) if codec is None else get_codec(codec)
+    return codec.open(path, mode)
+
+def compressed_path(path, codec):
+    """Adds codec file name extension to the path unless it already has it
+    """
+    codec = get_codec(codec)
+    if codec.Extension and not path.endswith(codec.Extension):
+        path += codec.Extension
+    return path
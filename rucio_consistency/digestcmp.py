@@ -0,0 +1,214 @@
+"""Comparison engine working with fixed-size digests of the items in NumPy arrays instead of Python sets of strings.
+
+Each item of a partition is represented by a 64-bit key, the built-in ``hash`` of the item as bytes, and a 32-bit check value,
+CRC32 of the item. The set operations are done on the sorted arrays of keys with ``searchsorted``. A partition kept in memory takes
+16 bytes per item: the key, the check value and the record number, instead of 150-200 bytes per item for a Python set of strings.
+The strings are read again only for the items in the results.
+
+Two different items may have the same key. Such keys are found either within a list, as the same key with different check values,
+or between the lists, as matching keys with different check values. The items with these keys are compared as strings, so the
+results are exact unless two different items have both the same key and the same check value, which has the probability of about
+n**2/2**96 for n items.
+
+The keys are produced by ``hash``, which is randomized per process, so the digests can only be compared within the same process.
+The partitions to be compared are always processed by a single process, see ``cmplib.cmp3_generator``.
+
+The engine requires ``numpy``. Use ``available()`` to check if it can be used.
+"""
+
+from zlib import crc32
+from .cmplib import cmp3, cmp5, cmp2
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def available():
+    return np is not None
+
+def _check_available():
+    if np is None:
+        raise ValueError("The digest comparison engine requires numpy, which is not installed")
+
+
+def _digests(batch):
+    # keys and check values of the items of a batch
+    n = len(batch)
+    return np.fromiter(map(hash, batch), dtype=np.int64, count=n), np.fromiter(map(crc32, batch), dtype=np.uint32, count=n)
+
+def _mark(digests, keys, checks, found, conflicts):
+    # marks the unique keys of the digests found among the keys with the same check values, and collects the conflicting keys
+    unique = digests.Unique
+    if not len(unique) or not len(keys):
+        return
+    i = np.searchsorted(unique, keys)
+    i[i >= len(unique)] = 0
+    same_key = unique[i] == keys
+    same_check = digests.Checks[i] == checks
+    found[i[same_key & same_check]] = True
+    conflict = same_key & ~same_check
+    if conflict.any():
+        conflicts.append(keys[conflict])
+
+def _flagged(parts):
+    return np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+def _items_with_keys(source, keys):
+    # reads the partition again and returns the items with the keys
+    out = []
+    for batch in source():
+        batch_keys, _ = _digests(batch)
+        out += [batch[i] for i in np.flatnonzero(np.isin(batch_keys, keys)).tolist()]
+    return out
+
+
+class _Digests(object):
+
+    # sorted unique keys of the items of a partition, their check values and positions of the first records with the key
+
+    def __init__(self, source):
+        self.Source = source            # callable returning a new generator of batches of items as bytes
+        keys, checks = [], []
+        for batch in source():
+            k, c = _digests(batch)
+            keys.append(k)
+            checks.append(c)
+        keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64)
+        checks = np.concatenate(checks) if checks else np.zeros(0, dtype=np.uint32)
+        order = np.argsort(keys, kind="stable")
+        keys, checks = keys[order], checks[order]
+        first = np.ones(len(keys), dtype=bool)
+        same = keys[1:] == keys[:-1]
+        first[1:] = ~same
+        self.Ambiguous = keys[1:][same & (checks[1:] != checks[:-1])]      # keys of different items
+        self.Unique = keys[first]
+        self.Checks = checks[first]
+        self.Positions = order[first].astype(np.uint32 if len(order) < 2**32 else np.int64)
+
+    def __len__(self):
+        return len(self.Unique)
+
+    def match(self, other):
+        """Matches the unique keys against the other list. Returns tuple (found, conflicts): boolean mask of the unique keys of
+        the other list, which are in this list with the same check values, and list of arrays of the keys present in both lists
+        with different check values
+        """
+        found = np.zeros(len(other.Unique), dtype=bool)
+        conflicts = []
+        _mark(other, self.Unique, self.Checks, found, conflicts)
+        return found, conflicts
+
+    def pick(self, mask, flagged):
+        """Reads the partition again and returns list of the items for the unique keys selected by the mask, except the flagged keys
+        """
+        positions = np.sort(self.Positions[mask & ~np.isin(self.Unique, flagged)])
+        out = []
+        if not len(positions):
+            return out
+        start = 0
+        for batch in self.Source():
+            end = start + len(batch)
+            lo, hi = np.searchsorted(positions, start), np.searchsorted(positions, end)
+            out += [batch[p - start] for p in positions[lo:hi].tolist()]
+            start = end
+            if hi >= len(positions):
+                break
+        return out
+
+
+def _scan(source, lists):
+    # reads the partition from the source and matches its items against the lists without keeping the digests in memory.
+    # returns list of boolean masks of the unique keys of the lists found in the partition and list of arrays of the conflicting keys
+    found = [np.zeros(len(lst.Unique), dtype=bool) for lst in lists]
+    conflicts = []
+    for batch in source():
+        keys, checks = _digests(batch)
+        order = np.argsort(keys)                # searchsorted is much faster for sorted keys
+        keys, checks = keys[order], checks[order]
+        for lst, mask in zip(lists, found):
+            _mark(lst, keys, checks, mask, conflicts)
+    return found, conflicts
+
+def digest_cmp3(a_source, r_source, b_source, stream=None):
+    """Performs the 3-way comparison of the partitions, see ``cmplib.cmp3``. Digests of ``a`` and ``r`` are kept in memory,
+    and ``b`` is matched against them as it is read.
+
+    Parameters
+    ----------
+    a_source, r_source, b_source : callable
+        Each call returns a new generator of batches (lists) of items as bytes read from the partition, e.g.
+        ``lambda: read_partition(path)``. ``a`` and ``r`` are read twice: once to compute the digests and once to get the
+        items in the results, so each call must yield the items in the same order. ``b`` is read once, unless there are keys
+        to be resolved by comparing the strings
+    stream : str or None
+        "d" to compute only the dark items, "m" - only the missing items, None - both
+
+    Returns
+    -------
+    tuple (d, m)
+        dark and missing items as lists of bytes
+    """
+    _check_available()
+    a, r = _Digests(a_source), _Digests(r_source)
+    r_in_a, conflicts = a.match(r)
+    a_in_r, _ = r.match(a)
+    (r_in_b, a_in_b), b_conflicts = _scan(b_source, [r, a])
+    flagged = _flagged([a.Ambiguous, r.Ambiguous] + conflicts + b_conflicts)
+
+    d = r.pick(~r_in_a & ~r_in_b, flagged) if stream != 'm' else []
+    m = a.pick(a_in_b & ~a_in_r, flagged) if stream != 'd' else []
+    if len(flagged):
+        # resolve the flagged keys by comparing the strings
+        flagged_d, flagged_m = cmp3(*(_items_with_keys(source, flagged) for source in (a_source, r_source, b_source)))
+        d = d + flagged_d if stream != 'm' else []
+        m = m + flagged_m if stream != 'd' else []
+    return d, m
+
+def digest_cmp5(a_m_source, a_d_source, r_source, b_m_source, b_d_source):
+    """Performs the 5-way comparison of the partitions, see ``cmplib.cmp5``. Digests of ``a_m`` and ``r`` are kept in memory,
+    and the other partitions are matched against them as they are read.
+
+    Parameters
+    ----------
+    a_m_source, a_d_source, r_source, b_m_source, b_d_source : callable
+        See ``digest_cmp3``. ``a_m`` and ``r`` are read twice, the other partitions are read once, unless there are keys to be
+        resolved by comparing the strings
+
+    Returns
+    -------
+    tuple (d, m, expected)
+        dark and missing items as lists of bytes, and the number of items in both ``a_m`` and ``b_m``
+    """
+    _check_available()
+    a_m, r = _Digests(a_m_source), _Digests(r_source)
+    a_in_r, conflicts = r.match(a_m)
+    (a_in_b,), b_conflicts = _scan(b_m_source, [a_m])
+    (r_in_ad,), ad_conflicts = _scan(a_d_source, [r])
+    (r_in_bd,), bd_conflicts = _scan(b_d_source, [r])
+    flagged = _flagged([a_m.Ambiguous, r.Ambiguous] + conflicts + b_conflicts + ad_conflicts + bd_conflicts)
+
+    expected = int(np.count_nonzero(a_in_b & ~np.isin(a_m.Unique, flagged)))
+    d = r.pick(~r_in_ad & ~r_in_bd, flagged)
+    m = a_m.pick(a_in_b & ~a_in_r, flagged)
+    if len(flagged):
+        # resolve the flagged keys by comparing the strings
+        sources = (a_m_source, a_d_source, r_source, b_m_source, b_d_source)
+        flagged_d, flagged_m, flagged_expected = cmp5(*(_items_with_keys(source, flagged) for source in sources))
+        d += flagged_d
+        m += flagged_m
+        expected += flagged_expected
+    return d, m, expected
+
+def digest_intersection_count(a_source, b_source):
+    """Counts distinct items present in both partitions, see ``digest_cmp3`` for the parameters
+    """
+    _check_available()
+    a = _Digests(a_source)
+    (a_in_b,), conflicts = _scan(b_source, [a])
+    flagged = _flagged([a.Ambiguous] + conflicts)
+    n = int(np.count_nonzero(a_in_b & ~np.isin(a.Unique, flagged)))
+    if len(flagged):
+        n += len(cmp2(_items_with_keys(a_source, flagged), _items_with_keys(b_source, flagged))[0])
+    return n
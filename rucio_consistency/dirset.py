@@ -0,0 +1,170 @@
+"""Compact in-memory set of path-like items, e.g. LFNs, which share a relatively small number of directories.
+
+A Python set of strings stores each item as a separate object of about 40 bytes plus the item length, plus the hash table entry.
+Most of the bytes of the items of a partition are the directory parts, repeated for every file in the directory. ``DirDictSet``
+keeps each distinct directory once, in a dictionary, and stores each item as the pair (directory id, file name) in arrays: the file
+names are concatenated in a single ``bytearray``, and the directory ids, file name offsets and hashes of the items are kept in ``array``
+objects. The items are found with an open-addressing hash table, also stored in an ``array``. This takes about 30 bytes per item
+plus the length of the file name, several times less than a set of strings for typical LFNs, at the expense of slower operations,
+which are implemented in Python.
+
+``DirDictSet`` implements the subset of the ``set`` interface used by the comparison functions in ``cmplib``. The items are either
+all bytes or all str, str items are stored UTF-8 encoded.
+"""
+
+from array import array
+
+_Empty = -1
+_Deleted = -2
+_MinSize = 8
+
+
+class DirDictSet(object):
+    """Set of path-like items with the directory parts stored once, see the module documentation.
+
+    Parameters
+    ----------
+    items : iterable or None
+        Initial items
+    """
+
+    def __init__(self, items=None):
+        self.DirIds = {}                        # {directory: directory id}
+        self.Dirs = []                          # directory by id, with the trailing "/"
+        self.Names = bytearray()                # file names of the records, concatenated
+        self.Offsets = array("Q", [0])          # Offsets[k]:Offsets[k+1] is the file name of the record k
+        self.DirOf = array("I")                 # directory id of the record
+        self.Hashes = array("q")                # hash of the item of the record
+        self.Alive = bytearray()                # 0 for removed records
+        self.Table = array("i", [_Empty]) * _MinSize      # record number or _Empty or _Deleted
+        self.Count = 0                          # number of items in the set
+        self.Used = 0                           # number of the table slots which are not _Empty
+        self.Text = None                        # True if the items are str, None until the first item is added
+        if items is not None:
+            self.update(items)
+
+    def __len__(self):
+        return self.Count
+
+    def __iter__(self):
+        names, offsets, dirs, dir_of, alive = self.Names, self.Offsets, self.Dirs, self.DirOf, self.Alive
+        for k in range(len(alive)):
+            if alive[k]:
+                item = dirs[dir_of[k]] + names[offsets[k]:offsets[k+1]]
+                yield item.decode("utf-8") if self.Text else item
+
+    def _encode(self, item):
+        if self.Text is None:
+            self.Text = isinstance(item, str)
+        return item.encode("utf-8") if self.Text else item
+
+    def _find(self, item):
+        # returns (slot, record number or _Empty, hash, directory id or None, file name) for the item as bytes.
+        # If the item is not in the set, slot is where it can be added
+        i = item.rfind(b"/") + 1
+        dir_id = self.DirIds.get(item[:i])
+        name = item[i:]
+        h = hash(item)
+        table = self.Table
+        mask = len(table) - 1
+        slot = h & mask
+        free = None
+        if dir_id is not None:
+            hashes, dir_of, offsets, names = self.Hashes, self.DirOf, self.Offsets, self.Names
+            while True:
+                k = table[slot]
+                if k == _Empty:
+                    break
+                if k == _Deleted:
+                    if free is None:
+                        free = slot
+                elif hashes[k] == h and dir_of[k] == dir_id and names[offsets[k]:offsets[k+1]] == name:
+                    return slot, k, h, dir_id, name
+                slot = (slot + 1) & mask
+        else:
+            # the directory is new, so the item is not in the set
+            while table[slot] >= 0:
+                slot = (slot + 1) & mask
+        return (slot if free is None else free), _Empty, h, dir_id, name
+
+    def _resize(self):
+        # rebuilds the hash table for the current number of items, dropping the deleted slots
+        size = _MinSize
+        while size <= self.Count * 2:
+            size *= 2
+        table = array("i", [_Empty]) * size
+        mask = size - 1
+        hashes, alive = self.Hashes, self.Alive
+        for k in range(len(alive)):
+            if alive[k]:
+                slot = hashes[k] & mask
+                while table[slot] != _Empty:
+                    slot = (slot + 1) & mask
+                table[slot] = k
+        self.Table = table
+        self.Used = self.Count
+
+    def _add(self, item):
+        slot, k, h, dir_id, name = self._find(item)
+        if k != _Empty:
+            return
+        if dir_id is None:
+            prefix = item[:len(item)-len(name)]
+            dir_id = self.DirIds[prefix] = len(self.Dirs)
+            self.Dirs.append(prefix)
+        if self.Table[slot] == _Empty:
+            self.Used += 1
+        self.Table[slot] = len(self.Alive)
+        self.Names += name
+        self.Offsets.append(len(self.Names))
+        self.DirOf.append(dir_id)
+        self.Hashes.append(h)
+        self.Alive.append(1)
+        self.Count += 1
+        if self.Used * 3 > len(self.Table) * 2:
+            self._resize()
+
+    def _remove(self, item):
+        # returns True if the item was in the set
+        slot, k, _, _, _ = self._find(item)
+        if k == _Empty:
+            return False
+        self.Table[slot] = _Deleted
+        self.Alive[k] = 0
+        self.Count -= 1
+        return True
+
+    def add(self, item):
+        self._add(self._encode(item))
+
+    def update(self, items):
+        add, encode = self._add, self._encode
+        for item in items:
+            add(encode(item))
+
+    def remove(self, item):
+        if not self._remove(self._encode(item)):
+            raise KeyError(item)
+
+    def discard(self, item):
+        self._remove(self._encode(item))
+
+    def difference_update(self, items):
+        if not self.Count:
+            return
+        remove, encode = self._remove, self._encode
+        for item in items:
+            remove(encode(item))
+
+    def __contains__(self, item):
+        if not self.Count:
+            return False
+        return self._find(self._encode(item))[1] != _Empty
+
+    def intersection(self, items):
+        """Returns ``set`` of the items found in this set
+        """
+        if not self.Count:
+            return set()
+        find, encode = self._find, self._encode
+        return set(item for item in items if find(encode(item))[1] != _Empty)
@@ -0,0 +1,253 @@
+"""Sorted, front-coded format for partition files.
+
+Items of a partition are sorted and each item is stored as the length of the prefix it shares with the previous item plus
+the remaining suffix. LFNs in a partition share long directory prefixes, so the suffixes are typically a small fraction of
+the items, and the sorted order lets the lists be compared by merging.
+
+File layout::
+
+    header (32 bytes):
+        magic           4s      b"RCEF"
+        version         uint8
+        hash id         uint8   see binfmt.HashIDs
+        reserved        2 bytes
+        partition index uint32
+        nparts          uint32
+        record count    uint64
+        reserved        8 bytes
+
+    blocks of records, each block:
+        count           uint32  number of records in the block
+        restart interval uint32 every restart interval-th record, starting with the first one, is stored in full
+        data length     uint64  length of the suffixes section in bytes
+        restarts        uint32 * ceil(count / restart interval), offsets of the restart records in the suffixes section
+        prefix lengths  count * uint16, length of the prefix shared with the previous record, 0 for the restart records
+        suffixes        utf-8 encoded suffixes joined with b"\\n"
+
+All integers are little-endian. Blocks are independent of each other: the first record of each block is a restart record.
+The restart index makes it possible to find an item in a block by binary search over the restart records, decoding
+at most one restart interval of records.
+"""
+
+import struct, sys, zlib
+from array import array
+from bisect import bisect_right
+from .binfmt import HashIDs, HashNames
+from .hashes import content_hash
+
+Magic = b"RCEF"
+FormatVersion = 1
+RestartInterval = 16
+BlockSize = 4096                # records per block
+MaxPrefix = 0xFFFF
+
+_Header = struct.Struct("<4sBB2xIIQ8x")
+_BlockHead = struct.Struct("<IIQ")
+
+HeaderSize = _Header.size
+
+
+def _array(typecode, data=b""):
+    a = array(typecode)
+    a.frombytes(data)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a
+
+def _to_little(a):
+    if sys.byteorder != "little":
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+def _suffix_at(data, offset):
+    end = data.find(b"\n", offset)
+    return data[offset:] if end < 0 else data[offset:end]
+
+def is_frontcoded(f):
+    """Returns True if the buffered binary file object is positioned at the beginning of a front-coded partition file.
+    The file position is not changed.
+    """
+    return f.peek(len(Magic))[:len(Magic)] == Magic
+
+def common_prefix_length(a, b, limit=MaxPrefix):
+    """Returns length of the common prefix of two bytes objects, but not more than ``limit``
+    """
+    n = min(len(a), len(b), limit)
+    if a[:n] == b[:n]:
+        return n
+    lo, hi = 0, n               # a[:lo] == b[:lo], a[:hi] != b[:hi]
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+def encode_block(items, restart_interval=RestartInterval):
+    """Encodes sorted list of items as bytes into a block, including the block head
+    """
+    restarts = array("I")
+    prefixes = array("H")
+    suffixes = []
+    offset = 0
+    prev = b""
+    for i, item in enumerate(items):
+        if i % restart_interval:
+            p = common_prefix_length(prev, item)
+        else:
+            p = 0
+            restarts.append(offset)
+        suffix = item[p:]
+        prefixes.append(p)
+        suffixes.append(suffix)
+        offset += len(suffix) + 1
+        prev = item
+    data = b"\n".join(suffixes)
+    return _BlockHead.pack(len(items), restart_interval, len(data)) + _to_little(restarts) + _to_little(prefixes) + data
+
+def decode_block(prefixes, data):
+    """Returns list of items as bytes decoded from the prefix lengths array and the suffixes section of a block
+    """
+    items = []
+    append = items.append
+    prev = b""
+    for p, s in zip(prefixes, data.split(b"\n")):
+        prev = prev[:p] + s if p else s
+        append(prev)
+    return items
+
+
+class FrontCodedWriter(object):
+    """Writes sorted items into a binary file object. Unlike ``binfmt.BinaryWriter``, the number of records is known before
+    the file is written, so the header never needs to be updated.
+    """
+
+    def __init__(self, f, index=0, nparts=1, hash_name="adler32", count=0):
+        self.F = f
+        self.Index = index
+        self.NParts = nparts
+        self.HashName = hash_name
+        self.Count = 0
+        self.Checksum = 0                       # CRC32 of everything after the header
+        self.Digest = content_hash()            # digest of everything after the header
+        self.F.write(_Header.pack(Magic, FormatVersion, HashIDs[hash_name], index, nparts, count))
+
+    def write_items(self, items, block_size=BlockSize):
+        # items: sorted list of bytes
+        for i in range(0, len(items), block_size):
+            block = encode_block(items[i:i+block_size])
+            self.F.write(block)
+            self.Checksum = zlib.crc32(block, self.Checksum)
+            self.Digest.update(block)
+        self.Count += len(items)
+
+    def close(self):
+        if self.F is not None:
+            self.F.close()
+            self.F = None
+
+
+class FrontCodedReader(object):
+    """Reads a front-coded partition file. Items are decoded block by block in sorted order, so the file can be streamed
+    without loading it into memory. Also provides ``readline`` so that it can be used in place of a text file object.
+    """
+
+    def __init__(self, f):
+        self.F = f
+        self.read_header()
+        self.Lines = None
+
+    def read_header(self):
+        data = self.F.read(HeaderSize)
+        if len(data) < HeaderSize:
+            raise ValueError("Truncated front-coded partition file header")
+        magic, version, hash_id, self.Index, self.NParts, self.Count = _Header.unpack(data)
+        if magic != Magic:
+            raise ValueError("Not a front-coded partition file")
+        if version != FormatVersion:
+            raise ValueError("Unsupported front-coded partition format version: %d" % (version,))
+        if hash_id not in HashNames:
+            raise ValueError("Unknown hash id in front-coded partition file: %d" % (hash_id,))
+        self.HashName = HashNames[hash_id]
+
+    def _read(self, n):
+        data = self.F.read(n)
+        while len(data) < n:
+            more = self.F.read(n - len(data))
+            if not more:
+                raise ValueError("Truncated block in front-coded partition file")
+            data += more
+        return data
+
+    def blocks(self):
+        """Generator yielding (restart interval, restarts, prefixes, data) tuples for each block, where restarts is array("I") of the
+        restart record offsets, prefixes is array("H") of the prefix lengths and data is the suffixes joined with b"\\n"
+        """
+        while True:
+            head = self.F.read(_BlockHead.size)
+            if not head:
+                break
+            if len(head) < _BlockHead.size:
+                head += self._read(_BlockHead.size - len(head))
+            count, interval, nbytes = _BlockHead.unpack(head)
+            nrestarts = (count + interval - 1) // interval
+            restarts = _array("I", self._read(nrestarts*4))
+            prefixes = _array("H", self._read(count*2))
+            yield interval, restarts, prefixes, self._read(nbytes)
+
+    def byte_batches(self):
+        """Generator yielding lists of items as bytes, one list per block
+        """
+        for _, _, prefixes, data in self.blocks():
+            yield decode_block(prefixes, data)
+
+    def batches(self):
+        """Generator yielding lists of items as str, one list per block
+        """
+        for batch in self.byte_batches():
+            yield [item.decode("utf-8") for item in batch]
+
+    def items(self):
+        """Generator yielding items as str in sorted order
+        """
+        for batch in self.batches():
+            yield from batch
+
+    def find(self, item):
+        """Reads the file from the current position looking for the item. Only the restart records are decoded in the blocks, which
+        can not contain the item. Returns True if the item is found
+        """
+        if isinstance(item, str):
+            item = item.encode("utf-8")
+        for interval, restarts, prefixes, data in self.blocks():
+            heads = [_suffix_at(data, r) for r in restarts]
+            k = bisect_right(heads, item) - 1
+            if k < 0:
+                return False            # the item is less than the first item of the block
+            start = restarts[k]
+            end = restarts[k+1] - 1 if k + 1 < len(restarts) else len(data)
+            if item in decode_block(prefixes[k*interval:(k+1)*interval], data[start:end]):
+                return True
+            if k + 1 < len(restarts):
+                return False            # the item is between two restart records of this block
+        return False
+
+    def readline(self):
+        if self.Lines is None:
+            self.Lines = self.items()
+        try:
+            return next(self.Lines) + "\n"
+        except StopIteration:
+            return ""
+
+    def seek(self, offset, whence=0):
+        # only rewinding to the beginning is supported
+        assert offset == 0 and whence == 0, "FrontCodedReader can only be rewound to the beginning"
+        self.F.seek(0, 0)
+        self.read_header()
+        self.Lines = None
+
+    def close(self):
+        self.F.close()
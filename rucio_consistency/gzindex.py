@@ -0,0 +1,307 @@
+"""Access point index for gzip-compressed partition files, so that a large partition can be read by several workers in parallel.
+
+A deflate stream can be decompressed only from the beginning, unless the decompressor is primed with the state at an arbitrary bit
+offset, which Python ``zlib`` module does not support. Instead, the indexed file is written as a sequence of independent gzip
+members, each starting at a line boundary. Concatenated members form a standard gzip file, readable by any gzip tool, and
+decompression can start at the beginning of any member. The index lists the access points: compressed and uncompressed offsets
+of the members. It is stored as a sidecar file <partition file without .gz>.gzi::
+
+    header (32 bytes):
+        magic               4s      b"RCGI"
+        version             uint8
+        reserved            3 bytes
+        npoints             uint64
+        compressed size     uint64  size of the indexed file, used to detect stale indexes
+        uncompressed size   uint64
+    access points       npoints * (uint64 compressed offset, uint64 uncompressed offset)
+"""
+
+import gzip, io, os, struct, sys, zlib
+from array import array
+
+Magic = b"RCGI"
+FormatVersion = 1
+Suffix = ".gzi"
+ChunkSize = 4*1024*1024         # minimum uncompressed size of a member between access points
+
+_Header = struct.Struct("<4sB3xQQQ")
+
+
+def index_path(path):
+    """Returns path of the index file for the gzip file: prefix.00001.gz -> prefix.00001.gzi
+    """
+    if path.endswith(".gz"):
+        path = path[:-3]
+    return path + Suffix
+
+
+class GzipIndex(object):
+
+    def __init__(self, points=None, compressed_size=0, uncompressed_size=0):
+        self.Points = points if points is not None else array("Q")     # flat array: coff0, uoff0, coff1, uoff1, ...
+        self.CompressedSize = compressed_size
+        self.UncompressedSize = uncompressed_size
+
+    def __len__(self):
+        return len(self.Points) // 2
+
+    def add_point(self, coffset, uoffset):
+        self.Points.append(coffset)
+        self.Points.append(uoffset)
+
+    def point(self, i):
+        return self.Points[2*i], self.Points[2*i+1]
+
+    def is_valid_for(self, path):
+        """Returns True if the index describes the current version of the file
+        """
+        return os.path.isfile(path) and os.path.getsize(path) == self.CompressedSize
+
+    def split(self, n):
+        """Splits the file into up to ``n`` ranges of about equal uncompressed size, starting and ending at the access points.
+
+        Returns
+        -------
+        list of tuples (start, end)
+            compressed offsets of the ranges
+        """
+        npoints = len(self)
+        if npoints == 0:
+            return [(0, self.CompressedSize)]
+        ranges = []
+        start = 0                               # index of the access point starting the current range
+        for k in range(1, n):
+            target = self.UncompressedSize * k / n
+            i = start + 1
+            while i < npoints and self.point(i)[1] < target:
+                i += 1
+            if i < npoints:
+                ranges.append((self.point(start)[0], self.point(i)[0]))
+                start = i
+        ranges.append((self.point(start)[0], self.CompressedSize))
+        return ranges
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        points = self.Points
+        if sys.byteorder != "little":
+            points = array("Q", points)
+            points.byteswap()
+        with open(tmp, "wb") as f:
+            f.write(_Header.pack(Magic, FormatVersion, len(self), self.CompressedSize, self.UncompressedSize))
+            f.write(points.tobytes())
+        os.rename(tmp, path)
+
+    @staticmethod
+    def load(path):
+        """Loads the index from the file. Returns None if the file does not exist
+        """
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < _Header.size:
+            raise ValueError("Truncated gzip index file %s" % (path,))
+        magic, version, npoints, csize, usize = _Header.unpack(data[:_Header.size])
+        if magic != Magic:
+            raise ValueError("Not a gzip index file: %s" % (path,))
+        if version != FormatVersion:
+            raise ValueError("Unsupported gzip index format version %d in %s" % (version, path))
+        if len(data) != _Header.size + npoints*16:
+            raise ValueError("Gzip index file %s has wrong size" % (path,))
+        points = array("Q")
+        points.frombytes(data[_Header.size:])
+        if sys.byteorder != "little":
+            points.byteswap()
+        return GzipIndex(points, csize, usize)
+
+    @staticmethod
+    def build(path, chunk_size=ChunkSize, level=6, rewrite=False):
+        """Builds the index for an existing gzip file in one pass over the file. Members of the file starting at line boundaries
+        are used as the access points. If the file does not have enough such members, e.g. it was written by gzip as a single member,
+        and ``rewrite`` is True, the file is rewritten in place as a sequence of members with the same uncompressed contents.
+        Otherwise, such a file is left unchanged and is not indexed.
+
+        Parameters
+        ----------
+        path : str
+            Path of the gzip file
+        chunk_size : int
+            Minimum uncompressed size of data between access points
+        level : int
+            Compression level used if the file has to be rewritten
+        rewrite : boolean
+            Whether the file can be rewritten if it does not have enough access points
+
+        Returns
+        -------
+        tuple (GzipIndex, boolean)
+            the index, which is also saved in the index file, or None if the file was not indexed, and whether the file was rewritten
+        """
+        index = GzipIndex()
+        max_gap = 0
+        with open(path, "rb") as f:
+            coffset = uoffset = 0               # offsets of the next member
+            last_u = None                       # uncompressed offset of the last access point
+            ends_with_newline = True
+            data = b""
+            while True:
+                if not data:
+                    data = f.read(1024*1024)
+                    if not data:
+                        break
+                if ends_with_newline and (last_u is None or uoffset - last_u >= chunk_size):
+                    max_gap = max(max_gap, uoffset - (last_u or 0))
+                    index.add_point(coffset, uoffset)
+                    last_u = uoffset
+                d = zlib.decompressobj(31)
+                while True:
+                    out = d.decompress(data)
+                    if out:
+                        uoffset += len(out)
+                        ends_with_newline = out.endswith(b"\n")
+                    if d.eof:
+                        data = d.unused_data
+                        break
+                    data = f.read(1024*1024)
+                    if not data:
+                        raise ValueError("Truncated gzip member in %s" % (path,))
+                coffset = f.tell() - len(data)
+            max_gap = max(max_gap, uoffset - (last_u or 0))
+        index.CompressedSize = coffset
+        index.UncompressedSize = uoffset
+        rewritten = False
+        if max_gap > 2*chunk_size:
+            if not rewrite:
+                return None, False
+            index = _rechunk(path, chunk_size, level)
+            rewritten = True
+        index.save(index_path(path))
+        return index, rewritten
+
+
+def _rechunk(path, chunk_size, level):
+    # rewrites the gzip file as a sequence of members of about chunk_size bytes of uncompressed data, starting at line boundaries
+    # members are cut between writes, so the data is read in pieces not larger than chunk_size
+    tmp = path + ".tmp"
+    read_size = min(chunk_size, 1024*1024)
+    with open(path, "rb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="rb") as inp:
+            out = IndexedGzipWriter(open(tmp, "wb"), level, None, chunk_size)
+            tail = b""
+            data = inp.read(read_size)
+            while data:
+                data = tail + data
+                cut = data.rfind(b"\n") + 1
+                tail = data[cut:]
+                if cut:
+                    out.write(data[:cut])
+                data = inp.read(read_size)
+            if tail:
+                out.write(tail)
+            out.close()
+    os.rename(tmp, path)
+    return out.Index
+
+
+def iter_range(path, start, end, batch_size=1024*1024):
+    """Generator yielding lists of lines as bytes, decompressed from the members of the gzip file between the compressed offsets
+    ``start`` and ``end``, which must be the access points from the index or the end of the file
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        d = zlib.decompressobj(31)
+        tail = b""
+        while remaining > 0:
+            data = f.read(min(remaining, batch_size))
+            if not data:
+                raise ValueError("Unexpected end of gzip file %s" % (path,))
+            remaining -= len(data)
+            chunks = []
+            while data:
+                chunks.append(d.decompress(data))
+                if d.eof:
+                    data = d.unused_data
+                    d = zlib.decompressobj(31)
+                else:
+                    data = b""
+            chunk = tail + b"".join(chunks)
+            cut = chunk.rfind(b"\n") + 1
+            tail = chunk[cut:]
+            if cut:
+                yield chunk[:cut].splitlines()
+        if tail.strip():
+            yield [tail.strip()]
+
+
+class IndexedGzipWriter(io.RawIOBase):
+    """Writable binary file object producing multi-member gzip file with the access point index. A new member is started
+    after at least ``chunk_size`` bytes of uncompressed data are written to the current one. Members are cut only between ``write``
+    calls, so if each ``write`` call receives complete lines, each member starts at a line boundary.
+    When the file is opened in append mode, the existing index is extended if it is valid for the file.
+    The index is saved into ``index_file`` when the writer is closed, unless ``index_file`` is None.
+    """
+
+    def __init__(self, f, level=9, index_file=None, chunk_size=ChunkSize, append=False):
+        io.RawIOBase.__init__(self)
+        self.F = f
+        self.Level = level
+        self.IndexFile = index_file
+        self.ChunkSize = chunk_size
+        self.Compressor = None
+        self.MemberSize = 0
+        self.Index = GzipIndex()
+        self.COffset = self.UOffset = 0
+        self.Empty = not append
+        if append:
+            size = f.seek(0, 2)
+            index = GzipIndex.load(index_file) if index_file else None
+            if index is not None and index.CompressedSize == size:
+                self.Index = index
+                self.COffset, self.UOffset = size, index.UncompressedSize
+            else:
+                self.Index = None                   # the file can not be indexed
+                if index_file is not None and os.path.isfile(index_file):
+                    os.remove(index_file)
+
+    def writable(self):
+        return True
+
+    def _emit(self, data):
+        self.F.write(data)
+        self.COffset += len(data)
+
+    def end_member(self):
+        if self.Compressor is not None:
+            self._emit(self.Compressor.flush())
+            self.Compressor = None
+
+    def write(self, data):
+        if not data:
+            return 0
+        if self.Compressor is None:
+            if self.Index is not None:
+                self.Index.add_point(self.COffset, self.UOffset)
+            self.Compressor = zlib.compressobj(self.Level, zlib.DEFLATED, 31)
+            self.MemberSize = 0
+        self._emit(self.Compressor.compress(data))
+        self.UOffset += len(data)
+        self.MemberSize += len(data)
+        self.Empty = False
+        if self.MemberSize >= self.ChunkSize:
+            self.end_member()
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            if self.Empty:
+                self._emit(zlib.compressobj(self.Level, zlib.DEFLATED, 31).flush())     # empty member
+            self.end_member()
+            self.F.close()
+            if self.Index is not None:
+                self.Index.CompressedSize = self.COffset
+                self.Index.UncompressedSize = self.UOffset
+                if self.IndexFile is not None:
+                    self.Index.save(self.IndexFile)
+        io.RawIOBase.close(self)
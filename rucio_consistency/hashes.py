@@ -0,0 +1,52 @@
+"""Hash functions used to assign items to partitions. The partition index of an item is hash(item) modulo number of partitions,
+where the hash is computed on the UTF-8 encoded item.
+
+    adler32     - default, compatible with lists created by earlier versions. Fast, but spreads short or similar strings poorly
+    crc32       - 32-bit CRC, about as fast as Adler32 with better distribution
+    blake2b64   - 64-bit BLAKE2b digest, slower but uniformly distributed
+"""
+
+from zlib import adler32, crc32
+from hashlib import blake2b
+
+def blake2b64(data):
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), "little")
+
+SubpartitionSalt = b"rce-subpartition"
+
+def subpartition_hash(data):
+    """Secondary hash used to split a partition into sub-partitions. It is salted, so that it is independent of the partition hash,
+    including blake2b64
+    """
+    return int.from_bytes(blake2b(data, digest_size=8, salt=SubpartitionSalt).digest(), "little")
+
+def content_hash():
+    """Returns new hash object for the content digest of a partition file, 256-bit BLAKE2b. Unlike the CRC32 checksum, which only
+    detects corruption, the digest identifies the contents, e.g. for reusing cached comparison results, see ``rescache``
+    """
+    return blake2b(digest_size=32)
+
+def digest_string(h):
+    return "blake2b:" + h.hexdigest()
+
+DefaultHash = "adler32"
+
+HashFunctions = {
+    "adler32":      adler32,
+    "crc32":        crc32,
+    "blake2b64":    blake2b64
+}
+
+HashWidths = {          # bytes
+    "adler32":      4,
+    "crc32":        4,
+    "blake2b64":    8
+}
+
+def get_hash(name):
+    """Returns the hash function by name
+    """
+    try:
+        return HashFunctions[name]
+    except KeyError:
+        raise ValueError("Unknown partition hash: %s. Supported hashes: %s" % (name, ", ".join(sorted(HashFunctions))))
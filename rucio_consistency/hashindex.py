@@ -0,0 +1,181 @@
+"""On-disk hash index for point lookups in partitioned lists without reading the partition files.
+
+The index of a partition maps 64-bit BLAKE2b digests of the items (see ``hashes.blake2b64``) to the record numbers of the items
+in the partition file, which is the line number for text files. It is an open addressing hash table with linear probing,
+stored as a sidecar file <partition file without compression extension>.hidx::
+
+    header (48 bytes):
+        magic           4s      b"RCHX"
+        version         uint8
+        reserved        3 bytes
+        nslots          uint64
+        count           uint64  number of items in the index
+        file size       uint64  size of the indexed partition file, used to detect stale indexes
+        file mtime      uint64  modification time of the indexed partition file, ns
+        reserved        8 bytes
+    digests         nslots * uint64
+    records         nslots * uint64, EmptySlot for empty slots
+
+The slot of an item is digest modulo nslots. The file is memory-mapped when loaded, so a lookup touches only a few pages.
+
+Lookups are probabilistic. The index stores only the digests, not the items, so membership is decided from the 64-bit digest
+alone and the item is not compared with the record in the partition file. An item not in the partition is reported as found
+if its digest coincides with the digest of an item in the partition, with probability of about count/2**64 per lookup.
+The record number tells the position of the item among the records of the partition, e.g. to get its values from the columns
+(see ``columns``), but not its byte offset, so finding the record in the partition file itself still requires reading the file
+up to the record.
+"""
+
+import mmap, os, struct, sys
+from array import array
+from .hashes import blake2b64
+
+Magic = b"RCHX"
+FormatVersion = 1
+Suffix = ".hidx"
+LoadFactor = 0.7
+EmptySlot = 0xFFFFFFFFFFFFFFFF
+
+_Header = struct.Struct("<4sB3xQQQQ8x")
+_Slot = struct.Struct("<Q")
+
+
+def digest(item):
+    if isinstance(item, str):
+        item = item.encode("utf-8")
+    return blake2b64(item)
+
+def file_signature(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+class HashIndex(object):
+
+    def __init__(self, nslots, count=0, digests=None, records=None, signature=(0, 0)):
+        self.NSlots = nslots
+        self.Count = count
+        self.Digests = digests if digests is not None else array("Q", bytes(8*nslots))
+        self.Records = records if records is not None else array("Q", [EmptySlot])*nslots
+        self.Signature = signature
+        self.MMap = None
+
+    @staticmethod
+    def from_digests(digests, signature=(0, 0)):
+        """Builds the index in memory
+
+        Parameters
+        ----------
+        digests : sequence of int
+            Digests of the items (see ``digest``) in the order of the records in the partition file
+        signature : tuple (size, mtime_ns)
+            Signature of the indexed file, see ``file_signature``
+        """
+        nslots = max(int(len(digests) / LoadFactor) + 1, 8)
+        index = HashIndex(nslots, signature=signature)
+        table, records = index.Digests, index.Records
+        n = 0
+        for record, d in enumerate(digests):
+            i = d % nslots
+            while records[i] != EmptySlot and table[i] != d:
+                i += 1
+                if i == nslots:
+                    i = 0
+            if records[i] == EmptySlot:         # otherwise it is a duplicate item, the first record is kept
+                table[i] = d
+                records[i] = record
+                n += 1
+        index.Count = n
+        return index
+
+    def lookup_digest(self, d):
+        """Returns the record number of the item with the digest, or None if the item is not in the index
+        """
+        nslots = self.NSlots
+        digests, records = self.Digests, self.Records
+        i = d % nslots
+        while True:
+            r = records[i]
+            if r == EmptySlot:
+                return None
+            if digests[i] == d:
+                return r
+            i += 1
+            if i == nslots:
+                i = 0
+
+    def lookup(self, item):
+        """Returns the record number of the item (str or bytes), or None if the item is not in the index.
+        The answer is based on the digest of the item only, see the module documentation
+        """
+        return self.lookup_digest(digest(item))
+
+    def __contains__(self, item):
+        return self.lookup(item) is not None
+
+    def is_valid_for(self, path):
+        """Returns True if the index was built for the current version of the file
+        """
+        return os.path.isfile(path) and file_signature(path) == self.Signature
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        digests, records = self.Digests, self.Records
+        if sys.byteorder != "little":
+            digests, records = array("Q", digests), array("Q", records)
+            digests.byteswap()
+            records.byteswap()
+        with open(tmp, "wb") as f:
+            f.write(_Header.pack(Magic, FormatVersion, self.NSlots, self.Count, *self.Signature))
+            f.write(digests.tobytes())
+            f.write(records.tobytes())
+        os.rename(tmp, path)
+
+    @staticmethod
+    def load(path):
+        """Loads the index from the file. Returns None if the file does not exist
+        """
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            header = f.read(_Header.size)
+            if len(header) < _Header.size:
+                raise ValueError("Truncated hash index file %s" % (path,))
+            magic, version, nslots, count, size, mtime = _Header.unpack(header)
+            if magic != Magic:
+                raise ValueError("Not a hash index file: %s" % (path,))
+            if version != FormatVersion:
+                raise ValueError("Unsupported hash index format version %d in %s" % (version, path))
+            if os.fstat(f.fileno()).st_size != _Header.size + 16*nslots:
+                raise ValueError("Hash index file %s has wrong size" % (path,))
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if sys.byteorder == "little":
+            view = memoryview(m)
+            digests = view[_Header.size:_Header.size + 8*nslots].cast("Q")
+            records = view[_Header.size + 8*nslots:].cast("Q")
+        else:
+            digests = _SlotView(m, _Header.size)
+            records = _SlotView(m, _Header.size + 8*nslots)
+        index = HashIndex(nslots, count, digests, records, (size, mtime))
+        index.MMap = m
+        return index
+
+    def close(self):
+        if self.MMap is not None:
+            for view in (self.Digests, self.Records):
+                if isinstance(view, memoryview):
+                    view.release()
+            self.MMap.close()
+            self.Digests = self.Records = self.MMap = None
+
+
+class _SlotView(object):
+
+    # read-only little-endian uint64 array view of the mmap on big-endian platforms
+
+    def __init__(self, m, offset):
+        self.M = m
+        self.Offset = offset
+
+    def __getitem__(self, i):
+        return _Slot.unpack_from(self.M, self.Offset + 8*i)[0]
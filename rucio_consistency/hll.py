@@ -0,0 +1,226 @@
+"""HyperLogLog sketches for estimating the number of distinct items in partitioned lists, and choosing the number of partitions
+for a given memory budget.
+
+The writer of a partitioned list can keep a sketch of the items and save it as <prefix>.hll. Sketches of different lists can be merged
+to estimate the number of distinct items in the union of the lists, e.g. the database dump and the site scan to be compared, so
+that the number of partitions for the next run can be chosen before the lists are produced.
+
+Sketch file layout::
+
+    header (32 bytes):
+        magic           4s      b"RCHL"
+        version         uint8
+        precision       uint8
+        reserved        2 bytes
+        count           uint64  number of items added, including duplicates
+        total bytes     uint64  total length of the items added
+        reserved        8 bytes
+    registers       2**precision bytes
+"""
+
+import math, os, re, struct
+from .hashes import blake2b64
+
+Magic = b"RCHL"
+FormatVersion = 1
+Suffix = ".hll"
+DefaultPrecision = 14           # 16384 registers, about 0.8% standard error
+
+_Header = struct.Struct("<4sBB2xQQ8x")
+
+ItemOverhead = 100              # approximate memory used by an item in a Python set in addition to the item length, bytes
+
+AutoNPartsOptions = ["auto-nparts", "mem-budget=", "sketches="]        # getopt long options used by nparts_from_options
+
+AutoNPartsUsage = """--auto-nparts --mem-budget <size> --sketches <prefix or .hll file>,...
+    - choose the number of partitions so that comparing one partition fits the memory budget (e.g. 4G), using the
+      item count estimates saved by previous runs of all the lists to be compared, rounded up to a power of 2.
+      A HyperLogLog sketch of the output is always saved as <output prefix>.hll
+"""
+
+
+class HyperLogLog(object):
+
+    def __init__(self, precision=DefaultPrecision, registers=None, count=0, total_bytes=0):
+        if not 4 <= precision <= 18:
+            raise ValueError("HyperLogLog precision must be between 4 and 18")
+        self.Precision = precision
+        self.M = 1 << precision
+        self.Registers = bytearray(self.M) if registers is None else bytearray(registers)
+        self.Count = count
+        self.TotalBytes = total_bytes
+
+    def add_digest(self, d, length=0):
+        """Adds an item by its 64-bit digest, see ``hashes.blake2b64``. ``length`` is the item length, used to track the average item size
+        """
+        p = self.Precision
+        i = d >> (64 - p)
+        rank = (64 - p) - (d & ((1 << (64 - p)) - 1)).bit_length() + 1
+        if rank > self.Registers[i]:
+            self.Registers[i] = rank
+        self.Count += 1
+        self.TotalBytes += length
+
+    def add(self, item):
+        if isinstance(item, str):
+            item = item.encode("utf-8")
+        self.add_digest(blake2b64(item), len(item))
+
+    def merge(self, other):
+        """Merges another sketch into this one. The result estimates the number of distinct items in the union of the two sets
+        """
+        if other.Precision != self.Precision:
+            raise ValueError("Can not merge HyperLogLog sketches with different precisions: %d and %d" % (self.Precision, other.Precision))
+        self.Registers = bytearray(max(a, b) for a, b in zip(self.Registers, other.Registers))
+        self.Count += other.Count
+        self.TotalBytes += other.TotalBytes
+        return self
+
+    def estimate(self):
+        """Returns estimated number of distinct items added
+        """
+        m = self.M
+        alpha = 0.7213/(1 + 1.079/m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        e = alpha * m * m / sum(2.0**-r for r in self.Registers)
+        zeros = self.Registers.count(0)
+        if e <= 2.5 * m and zeros:
+            e = m * math.log(m / zeros)         # linear counting for small cardinalities
+        return int(round(e))
+
+    def average_size(self):
+        """Returns average item length in bytes
+        """
+        return self.TotalBytes / self.Count if self.Count else 0.0
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(_Header.pack(Magic, FormatVersion, self.Precision, self.Count, self.TotalBytes))
+            f.write(self.Registers)
+        os.rename(tmp, path)
+
+    @staticmethod
+    def load(path):
+        """Loads the sketch from the file. Returns None if the file does not exist
+        """
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < _Header.size:
+            raise ValueError("Truncated HyperLogLog sketch file %s" % (path,))
+        magic, version, precision, count, total_bytes = _Header.unpack(data[:_Header.size])
+        if magic != Magic:
+            raise ValueError("Not a HyperLogLog sketch file: %s" % (path,))
+        if version != FormatVersion:
+            raise ValueError("Unsupported HyperLogLog sketch format version %d in %s" % (version, path))
+        if len(data) != _Header.size + (1 << precision):
+            raise ValueError("HyperLogLog sketch file %s has wrong size" % (path,))
+        return HyperLogLog(precision, data[_Header.size:], count, total_bytes)
+
+
+def sketch_path(prefix):
+    return prefix + Suffix
+
+def load_sketches(paths):
+    """Loads and merges sketches from the files. Each path can be either a sketch file or a partitioned list prefix.
+    Returns the merged sketch.
+
+    Raises
+    ------
+    ValueError
+        if a sketch is not found
+    """
+    merged = None
+    for path in paths:
+        sketch = HyperLogLog.load(path) if path.endswith(Suffix) else HyperLogLog.load(sketch_path(path))
+        if sketch is None:
+            raise ValueError("HyperLogLog sketch not found for %s" % (path,))
+        merged = sketch if merged is None else merged.merge(sketch)
+    return merged
+
+def parse_size(text):
+    """Parses memory size specification like "512M", "4G", "1.5GB" or number of bytes. Returns number of bytes
+    """
+    m = re.match(r"^\s*(\d+(?:\.\d*)?)\s*([kmgt]?)i?b?\s*$", text, re.I)
+    if m is None:
+        raise ValueError("Invalid memory size: %s" % (text,))
+    number, unit = m.groups()
+    return int(float(number) * 1024**"_kmgt".index(unit.lower() or "_"))
+
+def nparts_for_budget(distinct, average_size, mem_budget):
+    """Returns the number of partitions such that comparing one partition of the lists fits the memory budget.
+    The comparison keeps about as many items in memory as there are distinct items in one partition of the union of the
+    lists being compared. The number is rounded up to a power of two, so that independent tools sizing their lists from
+    slightly different estimates still tend to agree, and lists produced with different numbers of partitions can be brought
+    to the same number with ``rce_repartition`` (see ``part.splittable_nparts``).
+
+    Parameters
+    ----------
+    distinct : int
+        Estimated number of distinct items in the union of the lists
+    average_size : float
+        Average item length in bytes
+    mem_budget : int
+        Memory budget in bytes
+    """
+    n = max(1, int(math.ceil(distinct * (average_size + ItemOverhead) / mem_budget)))
+    return 1 << (n - 1).bit_length()
+
+def auto_nparts(paths, mem_budget):
+    """Chooses the number of partitions for the memory budget using the sketches of the lists produced by a previous run.
+
+    Parameters
+    ----------
+    paths : list of str
+        Sketch files or partitioned list prefixes, see ``load_sketches``. These should be all the lists to be compared with each other,
+        e.g. the database dump and the site scan, so that each of them is produced with the same number of partitions
+    mem_budget : int
+        Memory budget in bytes
+
+    Returns
+    -------
+    tuple (nparts, distinct)
+        the number of partitions and the estimated number of distinct items
+
+    Raises
+    ------
+    ValueError
+        if a sketch is not found
+    """
+    sketch = load_sketches(paths)
+    distinct = sketch.estimate()
+    return nparts_for_budget(distinct, sketch.average_size(), mem_budget), distinct
+
+def nparts_from_options(opts):
+    """Chooses the number of partitions for a script producing a partitioned list, if the script was run with ``--auto-nparts``.
+    The script gets the options with ``AutoNPartsOptions`` added to its getopt long options and includes ``auto_nparts_usage()``
+    in its usage text.
+
+    Parameters
+    ----------
+    opts : dict
+        Options of the script parsed by getopt
+
+    Returns
+    -------
+    int or None
+        the number of partitions chosen with ``auto_nparts``, or None if ``--auto-nparts`` was not used
+
+    Raises
+    ------
+    ValueError
+        if ``--mem-budget`` or ``--sketches`` is missing or the number of partitions can not be chosen, e.g. a sketch is not found
+    """
+    if "--auto-nparts" not in opts:
+        return None
+    if "--mem-budget" not in opts or "--sketches" not in opts:
+        raise ValueError("--mem-budget and --sketches are required with --auto-nparts")
+    nparts, distinct = auto_nparts(opts["--sketches"].split(","), parse_size(opts["--mem-budget"]))
+    print("Estimated number of distinct items: %d, number of partitions: %d" % (distinct, nparts))
+    return nparts
+
+def auto_nparts_usage(indent="    "):
+    """Returns the usage text of the options used by ``nparts_from_options`` with each line indented
+    """
+    return "".join(indent + line + "\n" for line in AutoNPartsUsage.splitlines())
@@ -0,0 +1,163 @@
+import json, os, os.path, time, zlib
+from .binfmt import HeaderSize, is_binary
+from .frontcode import is_frontcoded
+from .compression import open_compressed
+from .hashes import content_hash, digest_string
+from . import columns
+
+class ManifestError(ValueError):
+    pass
+
+def _read_contents(path):
+    # generator of the uncompressed contents of the partition file in chunks, without the header of binary and front-coded files,
+    # which the writer may update after the contents are written
+    with open_compressed(path, "rb") as f:
+        if is_binary(f) or is_frontcoded(f):
+            f.read(HeaderSize)
+        data = f.read(1024*1024)
+        while data:
+            yield data
+            data = f.read(1024*1024)
+
+def content_checksum(path):
+    """Computes CRC32 checksum of the uncompressed contents of a partition file, see ``content_digest``
+    """
+    checksum = 0
+    for data in _read_contents(path):
+        checksum = zlib.crc32(data, checksum)
+    return "crc32:%08x" % (checksum,)
+
+def content_digest(path):
+    """Computes the content digest of the uncompressed contents of a partition file, see ``hashes.content_hash``.
+    For binary and front-coded files, the header is not included
+    """
+    h = content_hash()
+    for data in _read_contents(path):
+        h.update(data)
+    return digest_string(h)
+
+class Manifest(object):
+    """Describes a partitioned list: number of partitions, the hash scheme used to assign items to partitions, and
+    item count, file size, content checksum and content digest for each partition. Stored as JSON in <prefix>.manifest
+    """
+
+    Version = 1
+    Suffix = ".manifest"
+
+    def __init__(self, nparts, hash_name="adler32", format="text", compressed=False, partitions=None, created=None):
+        self.NParts = nparts
+        self.HashName = hash_name
+        self.Format = format
+        self.Compressed = compressed           # False or codec specification
+        self.Partitions = partitions or []         # [{"file":..., "count":..., "size":..., "checksum":..., ["digest":...], ["bloom":...], ["gzindex":...], ["columns":{name:file}]}, ...]
+        self.Created = created
+        self.Dir = None
+        self.Prefix = None                  # prefix of the list the manifest was loaded for
+
+    @staticmethod
+    def path(prefix):
+        return prefix + Manifest.Suffix
+
+    @property
+    def counts(self):
+        return [p["count"] for p in self.Partitions]
+
+    @property
+    def sizes(self):
+        return [p["size"] for p in self.Partitions]
+
+    @property
+    def total_count(self):
+        return sum(self.counts)
+
+    def files(self):
+        """Returns ordered list of paths of partition files
+        """
+        return [os.path.join(self.Dir or "", p["file"]) for p in self.Partitions]
+
+    def as_jsonable(self):
+        return {
+            "version": self.Version,
+            "nparts": self.NParts,
+            "hash": self.HashName,
+            "format": self.Format,
+            "compressed": self.Compressed,
+            "created": self.Created,
+            "count": self.total_count,
+            "partitions": self.Partitions
+        }
+
+    def save(self, prefix):
+        self.Created = self.Created or time.time()
+        path = self.path(prefix)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(json.dumps(self.as_jsonable(), indent=2))
+        os.rename(tmp, path)            # make sure a partially written manifest is never seen by readers
+
+    @staticmethod
+    def load(prefix):
+        """Loads the manifest for the list with the prefix. Returns None if the manifest does not exist
+        """
+        path = Manifest.path(prefix)
+        if not os.path.isfile(path):
+            return None
+        try:
+            data = json.load(open(path, "r"))
+        except ValueError as e:
+            raise ManifestError("Can not parse manifest %s: %s" % (path, e))
+        if data.get("version") != Manifest.Version:
+            raise ManifestError("Unsupported manifest version in %s: %s" % (path, data.get("version")))
+        m = Manifest(data["nparts"], data.get("hash", "adler32"), data.get("format", "text"), data.get("compressed", False),
+                data["partitions"], data.get("created"))
+        m.Dir = os.path.dirname(path)
+        m.Prefix = prefix
+        return m
+
+    @staticmethod
+    def remove(prefix):
+        try:    os.remove(Manifest.path(prefix))
+        except FileNotFoundError:   pass
+
+    def validate(self, deep=False):
+        """Checks that all the partition files exist and have expected sizes. If ``deep`` is True, also verifies content checksums and digests,
+        which requires reading all the files.
+
+        Raises
+        ------
+        ManifestError
+            if any inconsistency is found
+        """
+        errors = []
+        if len(self.Partitions) != self.NParts:
+            errors.append("manifest lists %d partitions, expected %d" % (len(self.Partitions), self.NParts))
+        for p, path in zip(self.Partitions, self.files()):
+            if not os.path.isfile(path):
+                errors.append("%s: file not found" % (path,))
+                continue
+            if "bloom" in p and not os.path.isfile(os.path.join(self.Dir or "", p["bloom"])):
+                errors.append("%s: Bloom filter file %s not found" % (path, p["bloom"]))
+            if "gzindex" in p and not os.path.isfile(os.path.join(self.Dir or "", p["gzindex"])):
+                errors.append("%s: gzip index file %s not found" % (path, p["gzindex"]))
+            for name, column_file in p.get("columns", {}).items():
+                column_path = os.path.join(self.Dir or "", column_file)
+                if not os.path.isfile(column_path):
+                    errors.append("%s: column %s file %s not found" % (path, name, column_file))
+                elif os.path.getsize(column_path) != columns.HeaderSize + 8*p["count"]:
+                    errors.append("%s: column %s file %s has %d bytes, expected %d" % (path, name, column_file,
+                        os.path.getsize(column_path), columns.HeaderSize + 8*p["count"]))
+            size = os.path.getsize(path)
+            if size != p["size"]:
+                errors.append("%s: size %d, expected %d" % (path, size, p["size"]))
+            elif deep:
+                checksum, h = 0, content_hash()
+                for data in _read_contents(path):
+                    checksum = zlib.crc32(data, checksum)
+                    h.update(data)
+                checksum = "crc32:%08x" % (checksum,)
+                if checksum != p["checksum"]:
+                    errors.append("%s: checksum %s, expected %s" % (path, checksum, p["checksum"]))
+                elif "digest" in p and digest_string(h) != p["digest"]:
+                    errors.append("%s: digest %s, expected %s" % (path, digest_string(h), p["digest"]))
+        if errors:
+            raise ManifestError("Partitioned list validation failed: " + "; ".join(errors))
@@ -0,0 +1,185 @@
+"""Merge-join comparison engine with bounded memory.
+
+The items of each partition are read in sorted order and the lists are compared in one synchronized pass, holding only the current
+item of each list in memory. Partitions written in the "sorted" format (see ``frontcode``) are read in sorted order as they are.
+Other partitions are sorted externally: the items are read in runs of up to ``run_size`` bytes, each run is sorted in memory and
+written to a temporary file, and the runs are merged. Temporary files are created in the directory given by the TMPDIR environment
+variable (see ``tempfile``) and removed when the partition has been read.
+
+Memory used by the comparison does not depend on the partition size: it is about one run of items for each unsorted partition
+being sorted, plus the file buffers of the runs being merged.
+"""
+
+import heapq, os, tempfile
+from itertools import groupby
+
+RunSize = 64*1024*1024          # bytes of items sorted in memory at a time
+MergeWidth = 64                 # maximum number of runs merged at a time
+ItemOverhead = 50               # approximate memory used by an item in a list in addition to the item length, bytes
+
+
+def _write_run(items, tmp_dir):
+    fd, path = tempfile.mkstemp(suffix=".run", dir=tmp_dir)
+    with os.fdopen(fd, "wb") as f:
+        for i in range(0, len(items), 10000):
+            f.write(b"\n".join(items[i:i+10000]) + b"\n")
+    return path
+
+def _read_run(path):
+    with open(path, "rb", buffering=256*1024) as f:
+        for line in f:
+            yield line[:-1]
+
+def _merge_runs(paths, tmp_dir):
+    # merges the runs into one and removes them
+    fd, merged = tempfile.mkstemp(suffix=".run", dir=tmp_dir)
+    with os.fdopen(fd, "wb", buffering=256*1024) as f:
+        for item in heapq.merge(*map(_read_run, paths)):
+            f.write(item + b"\n")
+    for path in paths:
+        os.remove(path)
+    return merged
+
+def external_sort(batches, run_size=RunSize, tmp_dir=None):
+    """Generator yielding the items from the batches in sorted order, using bounded memory.
+
+    Parameters
+    ----------
+    batches : iterable of lists of bytes
+        e.g. produced by ``part.read_chunk``
+    run_size : int
+        Approximate amount of memory to use for sorting, bytes. If all the items fit, they are sorted in memory
+    tmp_dir : str or None
+        Directory for the temporary files, default: see ``tempfile.gettempdir``
+    """
+    runs = []
+    items = []
+    size = 0
+    try:
+        for batch in batches:
+            items += batch
+            size += sum(map(len, batch)) + ItemOverhead * len(batch)
+            if size >= run_size:
+                items.sort()
+                runs.append(_write_run(items, tmp_dir))
+                items = []
+                size = 0
+                if len(runs) >= MergeWidth:
+                    runs = [_merge_runs(runs, tmp_dir)]
+        items.sort()
+        if not runs:
+            yield from items
+        else:
+            yield from heapq.merge(items, *map(_read_run, runs))
+    finally:
+        for path in runs:
+            try:    os.remove(path)
+            except FileNotFoundError:   pass
+
+def _unique(items):
+    # removes consecutive duplicates from a sorted stream
+    prev = None
+    for item in items:
+        if item != prev:
+            yield item
+            prev = item
+
+def sorted_items(batches, is_sorted=False, run_size=RunSize, tmp_dir=None):
+    """Returns generator of unique items from the batches in sorted order. If ``is_sorted`` is True, the batches are assumed
+    to be sorted already, e.g. read from a partition in "sorted" format. Otherwise, the items are sorted with ``external_sort``
+    """
+    if is_sorted:
+        items = (item for batch in batches for item in batch)
+    else:
+        items = external_sort(batches, run_size, tmp_dir)
+    return _unique(items)
+
+def merge_cmp3(a, r, b, stream=None):
+    """Performs the 3-way comparison (see ``cmplib.cmp3``) of sorted streams of unique items in one pass.
+
+    Parameters
+    ----------
+    a, r, b : iterables of bytes
+        Items in sorted order without duplicates, see ``sorted_items``
+    stream : str or None
+        "d" to produce only the dark items, "m" - only the missing items, None - both
+
+    Returns
+    -------
+    generator of tuples (stream, item)
+        ``stream`` is "d" or "m". The items are produced in sorted order
+    """
+    a, r, b = iter(a), iter(r), iter(b)
+    want_d, want_m = stream != 'm', stream != 'd'
+    x, y, z = next(a, None), next(r, None), next(b, None)
+    while True:
+        # stop as soon as the remaining items can not produce any output
+        more_d = want_d and y is not None
+        more_m = want_m and x is not None and z is not None
+        if not (more_d or more_m):
+            break
+        m = y
+        if x is not None and (m is None or x < m):
+            m = x
+        if z is not None and (m is None or z < m):
+            m = z
+        in_a, in_b = x == m, z == m
+        if y == m:
+            if not in_a and not in_b and want_d:
+                yield 'd', m
+            y = next(r, None)
+        elif in_a and in_b and want_m:
+            yield 'm', m
+        if in_a:
+            x = next(a, None)
+        if in_b:
+            z = next(b, None)
+
+def _tagged(items, bit):
+    for item in items:
+        yield item, bit
+
+def merge_cmp5(a_m, a_d, r, b_m, b_d):
+    """Performs the 5-way comparison (see ``cmplib.cmp5``) of sorted streams of unique items in one pass.
+
+    Parameters
+    ----------
+    a_m, a_d, r, b_m, b_d : iterables of bytes
+        Items in sorted order without duplicates, see ``sorted_items``
+
+    Returns
+    -------
+    tuple (d, m, expected)
+        dark and missing items as lists of bytes in sorted order, and the number of items in both ``a_m`` and ``b_m``
+    """
+    d, m, expected = [], [], 0
+    streams = [_tagged(items, 1 << k) for k, items in enumerate((a_m, a_d, r, b_m, b_d))]
+    for item, group in groupby(heapq.merge(*streams), key=lambda x: x[0]):
+        present = 0
+        for _, bit in group:
+            present |= bit
+        if present & 4:
+            # in r
+            if not present & 18:
+                d.append(item)
+        elif present & 9 == 9:
+            m.append(item)
+        if present & 9 == 9:
+            expected += 1
+    return d, m, expected
+
+def merge_intersection_count(a, b):
+    """Counts items present in both sorted streams of unique items
+    """
+    a, b = iter(a), iter(b)
+    x, y = next(a, None), next(b, None)
+    n = 0
+    while x is not None and y is not None:
+        if x == y:
+            n += 1
+            x, y = next(a, None), next(b, None)
+        elif x < y:
+            x = next(a, None)
+        else:
+            y = next(b, None)
+    return n
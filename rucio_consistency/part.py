@@ -1,35 +1,681 @@
-from zlib import adler32
-import gzip, glob
+from zlib import crc32
+import glob, io, math, mmap, os, os.path, queue, threading
+from array import array
+from itertools import chain
+from collections import OrderedDict
 from .py3 import to_bytes, PY3
+from .binfmt import BinaryReader, BinaryWriter, is_binary
+from .frontcode import FrontCodedReader, FrontCodedWriter, is_frontcoded
+from .manifest import Manifest, ManifestError
+from .compression import get_codec, codec_for_path, compressed_path, NoCompression, GzipCodec, Extensions
+from .hashes import get_hash, DefaultHash, HashWidths, content_hash, digest_string
+from . import bloom, hll, gzindex, hashindex, columns
 
 
-def part(nparts, path):
+def part(nparts, path, hash_name=DefaultHash):
         if nparts <= 1: return 0
         if PY3:    path = to_bytes(path)
         #print("part(", nparts, path,"): adler:", adler32(path))
-        return adler32(path) % nparts
+        return get_hash(hash_name)(path) % nparts
+
+def partition_skew(counts):
+    """Computes statistics of the partition sizes. The peak memory needed to compare partitioned lists is determined by the largest
+    partition, so the ratio of the largest partition size to the mean is a measure of how well the items are spread.
+    
+    Parameters
+    ----------
+    counts : list of int
+        Item counts per partition
+    
+    Returns
+    -------
+    dict
+        {"nparts":..., "min":..., "max":..., "mean":..., "stddev":..., "max_mean":...}
+    """
+    n = len(counts)
+    mean = sum(counts)/n if n else 0.0
+    stddev = math.sqrt(sum((c - mean)**2 for c in counts)/n) if n else 0.0
+    return {
+        "nparts":   n,
+        "min":      min(counts) if n else 0,
+        "max":      max(counts) if n else 0,
+        "mean":     mean,
+        "stddev":   stddev,
+        "max_mean": max(counts)/mean if mean else 1.0
+    }
+
+def is_power_of_two(n):
+    return n > 0 and (n & (n-1)) == 0
+
+def splittable_nparts(n):
+    """Returns the smallest power of two >= n. A list with power-of-two number of partitions can be repeatedly split or merged
+    without rehashing: since items are assigned to partitions by taking hash modulo nparts, partition i of a list with N partitions
+    splits into partitions i and i+N of a list with 2N partitions, and partitions i and i+N/2 merge into partition i.
+    """
+    m = 1
+    while m < n:
+        m *= 2
+    return m
+
+def partition_file_names(prefix, nparts, compressed=False):
+    ext = get_codec(compressed).Extension
+    return ["%s.%05d%s" % (prefix, i, ext) for i in range(nparts)]
+
+def sidecar_path(path, suffix):
+    """Returns path of a sidecar file for the partition file: the partition file path without the compression extension,
+    followed by the suffix, e.g. prefix.00001.gz -> prefix.00001.bloom
+    """
+    base, ext = os.path.splitext(path)
+    if ext not in Extensions:
+        base = path
+    return base + suffix
+
+SpillSuffix = ".unsorted"           # temporary file with the items of a sorted partition spilled before the partition is sorted
+
+SidecarSuffixes = (Manifest.Suffix, bloom.Suffix, hll.Suffix, gzindex.Suffix, hashindex.Suffix, columns.Suffix, SpillSuffix)
+
+def _open_reader(path):
+    # opens a partition file for reading, detecting its format
+    raw = codec_for_path(path).open_read(path)
+    if is_binary(raw):
+        return BinaryReader(raw, path)
+    elif is_frontcoded(raw):
+        return FrontCodedReader(raw)
+    else:
+        return io.TextIOWrapper(raw)
+
+def _read_items(f):
+    if isinstance(f, (BinaryReader, FrontCodedReader)):
+        yield from f.items()
+    else:
+        for l in f:
+            yield l.strip()
+
+def _read_batches(f, batch_size=1024*1024):
+    # yields lists of stripped items. For text files, batch_size is the approximate number of characters per batch
+    if isinstance(f, (BinaryReader, FrontCodedReader)):
+        yield from f.batches()
+    else:
+        lines = f.readlines(batch_size)
+        while lines:
+            yield [l.strip() for l in lines]
+            lines = f.readlines(batch_size)
+
+DefaultBatchSize = 1024*1024
+ChunkReaders = 4                # threads reading chunks of an indexed gzip partition, see read_partition
+
+def _mmap_batches(path, batch_size):
+    # yields lists of lines of an uncompressed text file as bytes. The file is memory-mapped and split into
+    # chunks of about batch_size bytes at line boundaries
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            start, n = 0, len(m)
+            while start < n:
+                end = n
+                if start + batch_size < n:
+                    end = m.find(b"\n", start + batch_size) + 1 or n
+                yield m[start:end].splitlines()
+                start = end
+
+def _stream_batches(f, batch_size):
+    # yields lists of lines as bytes, read from binary file object in chunks of batch_size bytes
+    tail = b""
+    chunk = f.read(batch_size)
+    while chunk:
+        chunk = tail + chunk
+        cut = chunk.rfind(b"\n") + 1
+        tail = chunk[cut:]
+        if cut:
+            yield chunk[:cut].splitlines()
+        chunk = f.read(batch_size)
+    if tail.strip():
+        yield [tail.strip()]
+
+def _read_byte_batches(f, path, batch_size=DefaultBatchSize):
+    # yields lists of items as bytes. Uncompressed text files are memory-mapped
+    if isinstance(f, (BinaryReader, FrontCodedReader)):
+        yield from f.byte_batches()
+    elif isinstance(codec_for_path(path), NoCompression):
+        yield from _mmap_batches(path, batch_size)
+    else:
+        yield from _stream_batches(f.buffer, batch_size)
+
+def _read_records(f, hash_name=DefaultHash):
+    if isinstance(f, BinaryReader):
+        if f.HashName != hash_name:
+            raise ValueError("Binary partition file uses %s hash, expected %s" % (f.HashName, hash_name))
+        yield from f.records()
+    elif isinstance(f, FrontCodedReader):
+        if f.HashName != hash_name:
+            raise ValueError("Front-coded partition file uses %s hash, expected %s" % (f.HashName, hash_name))
+        hash_function = get_hash(hash_name)
+        for batch in f.byte_batches():
+            for b in batch:
+                yield hash_function(b), b
+    else:
+        hash_function = get_hash(hash_name)
+        for l in f:
+            b = to_bytes(l.strip())
+            yield hash_function(b), b
+
+def read_chunk(chunk, batch_size=DefaultBatchSize):
+    """Generator yielding lists of items as bytes from a chunk of a partition file, see ``PartitionedList.chunks``.
+    Can be used in a worker process.
+    
+    Parameters
+    ----------
+    chunk : tuple (path, start, end)
+        start and end are compressed offsets of the access points of an indexed gzip partition file, or None to read the whole file
+    batch_size : int
+        Approximate size of a batch in bytes
+    """
+    path, start, end = chunk
+    if start is None:
+        f = _open_reader(path)
+        try:
+            yield from _read_byte_batches(f, path, batch_size)
+        finally:
+            f.close()
+    else:
+        yield from gzindex.iter_range(path, start, end, batch_size)
+
+def read_chunks(chunks, depth=2, batch_size=DefaultBatchSize):
+    """Generator yielding lists of items as bytes from several chunks of a partition file, see ``PartitionedList.chunks``.
+    Each chunk is read in its own background thread into a bounded queue, so that the chunks of an indexed gzip partition
+    are decompressed in parallel. Batches are taken from the chunks in round-robin order, which differs from the order of
+    the items in the file, but is the same every time the same chunks are read.
+    
+    Parameters
+    ----------
+    chunks : list of tuples (path, start, end)
+        Chunks of the partition file
+    depth : int
+        Number of batches queued by each reading thread
+    batch_size : int
+        Approximate size of a batch in bytes
+    """
+    if len(chunks) == 1:
+        yield from read_chunk(chunks[0], batch_size)
+        return
+    readers = [_ReadAhead(read_chunk(chunk, batch_size), depth) for chunk in chunks]
+    try:
+        active = [reader.batches() for reader in readers]
+        while active:
+            remaining = []
+            for batches in active:
+                batch = next(batches, None)
+                if batch is not None:
+                    yield batch
+                    remaining.append(batches)
+            active = remaining
+    finally:
+        for reader in readers:
+            reader.stop()
+
+def read_partition(path, batch_size=DefaultBatchSize, readers=ChunkReaders):
+    """Generator yielding lists of items as bytes from a partition file. Gzip-compressed text partition files with
+    valid access point index (see ``gzindex``) are split into up to ``readers`` chunks read in parallel with ``read_chunks``.
+    Other files are read sequentially. Can be used in a worker process.
+    
+    Parameters
+    ----------
+    path : str
+        Path of the partition file
+    batch_size : int
+        Approximate size of a batch in bytes
+    readers : int
+        Maximum number of threads reading chunks of an indexed partition file
+    """
+    return read_chunks(_Partition(path).chunks(readers), batch_size=batch_size)
+
+def _count_chunk(chunk):
+    return sum(len(batch) for batch in read_chunk(chunk))
+
+class _ReadAhead(object):
+    
+    # Reads batches of items from the generator in a background thread into a bounded queue, so that reading and
+    # decompressing the file overlaps with processing of the items by the consumer. zlib and the other decompressors
+    # release the GIL while inflating, so the reading thread runs concurrently with the consumer.
+    
+    End = object()
+    
+    def __init__(self, batches, depth):
+        self.Queue = queue.Queue(depth)
+        self.Stop = False
+        self.Thread = threading.Thread(target=self.run, args=(batches,), daemon=True)
+        self.Thread.start()
         
+    def put(self, x):
+        while not self.Stop:
+            try:    
+                self.Queue.put(x, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+        
+    def run(self, batches):
+        try:
+            for batch in batches:
+                if not self.put(batch):
+                    return
+        except Exception as e:
+            self.put(e)
+        self.put(self.End)
+        
+    def batches(self):
+        while True:
+            batch = self.Queue.get()
+            if batch is self.End:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+            
+    def stop(self):
+        self.Stop = True
+        self.Thread.join()
+
 class _Partition(object):
     
-    def __init__(self, f, path):
-        self.F = f
+    # The partition file is opened on first use and closed when it has been read to the end, so that only the partitions
+    # being read at the moment hold open files, regardless of the number of partitions in the list
+    
+    def __init__(self, path, readahead=0, hash_name=DefaultHash):
+        self.File = None
         self.Path = path
+        self.HashName = hash_name
+        self.Items = None
+        self.Batches = None             # batches generator of the read-ahead reader
+        self.BytesMode = False
+        self.ReadAheadDepth = readahead
+        self.ReadAhead = None
+        
+    @property
+    def F(self):
+        if self.File is None:
+            self.File = _open_reader(self.Path)
+        return self.File
+        
+    def _closing(self, gen):
+        # closes the file after the generator is exhausted
+        yield from gen
+        self.close_file()
+        
+    def start(self, bytes_mode=False, batch_size=None):
+        """Starts reading the partition ahead in a background thread, if the read-ahead is enabled. Otherwise does nothing.
+        Called automatically when the iteration starts, but can be called earlier so that reading of the partition
+        overlaps with processing of other data.
+        
+        Parameters
+        ----------
+        bytes_mode : boolean
+            If True, the partition will be read with ``iter_batches``, otherwise - iterated as str items
+        batch_size : int or None
+            Approximate size of a batch in bytes for ``iter_batches``
+        """
+        if self.ReadAheadDepth and self.Items is None and self.Batches is None:
+            if bytes_mode:
+                batches = read_partition(self.Path, batch_size or DefaultBatchSize)
+            else:
+                batches = _read_batches(self.F)
+            self.ReadAhead = _ReadAhead(batches, self.ReadAheadDepth)
+            self.Batches = self._closing(self.ReadAhead.batches())
+            self.BytesMode = bytes_mode
         
     def __iter__(self):
         return self
         
     def __next__(self):
-        l = self.F.readline()
-        if not l:
-            raise StopIteration
-        return l.strip()
+        if self.Items is None:
+            self.Items = self.items()
+        return next(self.Items)
+        
+    def items(self):
+        """Returns generator of the items as str. The partition must not be iterated in any other way at the same time.
+        """
+        self.start()
+        if self.Batches is None:
+            return self._closing(_read_items(self.F))
+        elif self.BytesMode:
+            raise ValueError("The partition is being read in bytes mode, use iter_batches()")
+        return chain.from_iterable(self.Batches)
+        
+    def iter_batches(self, size=None):
+        """Returns generator of batches of items. Each batch is a list of items as bytes. Uncompressed text files are memory-mapped
+        and split into batches without decoding individual lines, binary files are split block by block. Comparing batches of bytes
+        avoids per-item decoding and lets sets be built with ``set.update`` on whole batches. Gzip-compressed partition files with
+        valid access point index are decompressed by several threads in parallel (see ``read_partition``), so the batches do not
+        follow the order of the items in the file. The partition must not be iterated in the regular way at the same time.
+        
+        Parameters
+        ----------
+        size : int or None
+            Approximate size of a batch in bytes for text files, default 1MB. Batches of binary files correspond to the blocks in the file
+        """
+        self.start(True, size)
+        if self.Batches is None:
+            return read_partition(self.Path, size or DefaultBatchSize)
+        elif not self.BytesMode:
+            raise ValueError("The partition is being iterated as str items")
+        return self.Batches
         
+    def records(self):
+        """Generator yielding (hash, item) tuples, where item is bytes and hash is the full (not reduced modulo number of partitions) partition
+        hash of the item. For binary partition files, stored hashes are returned without recomputing them.
+        Records are always read in the calling thread.
+        """
+        return self._closing(_read_records(self.F, self.HashName))
+
+    def chunks(self, n):
+        """Splits the partition into up to ``n`` chunks, which can be read independently, e.g. by worker processes, with ``read_chunk``.
+        Only gzip-compressed text partition files with valid access point index (see ``gzindex``) can be split. Otherwise, the whole file
+        is returned as a single chunk.
+        
+        Returns
+        -------
+        list of tuples (path, start, end)
+        """
+        if n > 1 and self.Path.endswith(GzipCodec.Extension):
+            index = gzindex.GzipIndex.load(gzindex.index_path(self.Path))
+            if index is not None and index.is_valid_for(self.Path):
+                return [(self.Path, start, end) for start, end in index.split(n)]
+        return [(self.Path, None, None)]
+
+    def stop(self):
+        if self.ReadAhead is not None:
+            self.ReadAhead.stop()
+            self.ReadAhead = None
+
+    def close_file(self):
+        if self.File is not None:
+            self.File.close()
+            self.File = None
+
     def rewind(self):
-        self.F.seek(0,0)
+        self.stop()
+        if self.File is not None:
+            self.File.seek(0,0)
+        self.Items = self.Batches = None
+        self.BytesMode = False
+        
+    def close(self):
+        self.stop()
+        self.close_file()
+        
+class _FilePool(object):
+    
+    # Limits the number of partition files open for writing at the same time. When the limit is reached, the least recently
+    # used file is closed. It is reopened in append mode next time its writer has data to write. For compressed files,
+    # each reopening starts a new gzip member (zstd or lz4 frame), and the concatenated members are read as a single stream.
+    
+    def __init__(self, max_open):
+        self.MaxOpen = max_open
+        self.Open = OrderedDict()           # writer -> None, least recently used first
+        
+    def acquire(self, writer):
+        if writer in self.Open:
+            self.Open.move_to_end(writer)
+        else:
+            while len(self.Open) >= self.MaxOpen:
+                w, _ = self.Open.popitem(last=False)
+                w.release()
+            writer.reopen()
+            self.Open[writer] = None
+            
+    def discard(self, writer):
+        self.Open.pop(writer, None)
+
+class _PartitionWriter(object):
+    
+    # Accumulates items for a single partition file and writes them in large chunks.
+    # If pool is not None, the file is opened only when there is data to write, see _FilePool
+    # If build_index is True, the gzip file is written with the access point index, see gzindex
+    
+    def __init__(self, path, codec, pool=None, build_index=False):
+        self.F = None
+        self.Path = path
+        self.Codec = codec
+        self.Pool = pool
+        self.Opened = False         # whether the file has been created
+        self.Buffer = []
+        self.BufferedBytes = 0
+        self.Count = 0
+        self.Checksum = 0           # CRC32 of the uncompressed contents
+        self.Digest = content_hash()    # digest of the uncompressed contents
+        self.Digests = None         # array("Q") of item digests for the Bloom filter, if it is to be built
+        self.BloomFile = None
+        self.BuildIndex = build_index
+        self.Columns = []           # ColumnWriter objects
+        self.ColumnBuffers = []     # array("q") of buffered values for each column
+        if pool is None:
+            self.reopen()
+        
+    def reopen(self):
+        self.F = self.Codec.open_write(self.Path, append=self.Opened, index=self.BuildIndex)
+        self.Opened = True
+        
+    def release(self):
+        self.F.close()
+        self.F = None
+        
+    def file(self):
+        if self.Pool is not None:
+            self.Pool.acquire(self)
+        return self.F
+        
+    def add(self, line):
+        # line is expected to be stripped and to end with "\n"
+        self.Buffer.append(line)
+        self.BufferedBytes += len(line)
+        if self.Digests is not None:
+            self.Digests.append(bloom.digest(line[:-1]))
+        
+    def add_record(self, h, item):
+        # item is bytes
+        self.add(item.decode("utf-8") + "\n")
+
+    def init_columns(self, names):
+        self.Columns = [columns.ColumnWriter(columns.column_path(self.Path, name), name) for name in names]
+        self.ColumnBuffers = [array(columns.TypeCode) for _ in names]
+
+    def add_values(self, values):
+        # values of the columns for the last added item, None or missing trailing values are stored as columns.Missing
+        values = values or ()
+        for k, buf in enumerate(self.ColumnBuffers):
+            v = values[k] if k < len(values) else None
+            buf.append(columns.Missing if v is None else v)
+
+    def build_bloom(self, fp_rate):
+        # called after the writer is closed
+        if self.Digests is not None:
+            self.BloomFile = sidecar_path(self.Path, bloom.Suffix)
+            bloom.BloomFilter.from_digests(self.Digests, fp_rate).save(self.BloomFile)
+            self.Digests = None
+        
+    def write(self, chunks):
+        data = "".join(chunks).encode("utf-8")
+        self.Checksum = crc32(data, self.Checksum)
+        self.Digest.update(data)
+        self.file().write(data)
+
+    def count(self):
+        # number of items added so far, including the buffered ones
+        return self.Count + len(self.Buffer)
+
+    def flush(self):
+        if self.Buffer:
+            self.write(self.Buffer)
+            self.Count += len(self.Buffer)
+            self.Buffer = []
+            self.BufferedBytes = 0
+            for c, buf in zip(self.Columns, self.ColumnBuffers):
+                c.append(buf)
+            self.ColumnBuffers = [array(columns.TypeCode) for _ in self.Columns]
+            
+    def close(self):
+        self.flush()
+        f = self.file()         # creates the file if nothing was written to it
+        if self.Pool is not None:
+            self.Pool.discard(self)
+        f.close()
+        self.F = None
+        
+    def info(self):
+        # partition description for the manifest, valid after the writer is closed
+        info = {
+            "file":     os.path.basename(self.Path),
+            "count":    self.Count,
+            "size":     os.path.getsize(self.Path),
+            "checksum": "crc32:%08x" % (self.Checksum,),
+            "digest":   digest_string(self.Digest)
+        }
+        if self.BloomFile is not None:
+            info["bloom"] = os.path.basename(self.BloomFile)
+        if self.BuildIndex and os.path.isfile(gzindex.index_path(self.Path)):
+            info["gzindex"] = os.path.basename(gzindex.index_path(self.Path))
+        if self.Columns:
+            info["columns"] = {c.Name: os.path.basename(c.Path) for c in self.Columns}
+        return info
+
+class _BinaryPartitionWriter(_PartitionWriter):
+    
+    # Buffer contains items as bytes, Hashes - corresponding partition hashes, F is a BinaryWriter
+    
+    def __init__(self, path, codec, index, nparts, pool=None, hash_name=DefaultHash):
+        self.Index = index
+        self.NParts = nparts
+        self.HashName = hash_name
+        self.HashType = "I" if HashWidths[hash_name] == 4 else "Q"
+        self.Binary = None          # BinaryWriter, kept while the file is closed by the pool
+        _PartitionWriter.__init__(self, path, codec, pool)
+        self.Hashes = array(self.HashType)
+        
+    def reopen(self):
+        f = self.Codec.open_write(self.Path, append=self.Opened)
+        if self.Binary is None:
+            self.Binary = BinaryWriter(f, self.Index, self.NParts, self.HashName, update_count=isinstance(self.Codec, NoCompression))
+        else:
+            self.Binary.F = f
+        self.F = self.Binary
+        self.Opened = True
+        
+    def release(self):
+        self.Binary.F.close()
+        self.Binary.F = self.F = None
+        
+    def add(self, item, h):
+        self.Buffer.append(item)
+        self.Hashes.append(h)
+        self.BufferedBytes += len(item)
+        if self.Digests is not None:
+            self.Digests.append(bloom.digest(item))
+        
+    def add_record(self, h, item):
+        self.add(item, h)
+
+    def write(self, chunks):
+        f = self.file()
+        f.write_block(chunks, self.Hashes)
+        self.Checksum = f.Checksum
+        self.Digest = f.Digest
+        self.Hashes = array(self.HashType)
+        
+    def close(self):
+        self.flush()
+        self.file()
+        if self.Pool is not None:
+            self.Pool.discard(self)
+            if self.Binary.UpdateCount:
+                # the file was open in append mode, where the header can not be overwritten
+                self.Binary.F.close()
+                self.Binary.F = open(self.Path, "r+b")
+        self.Binary.close()
+        self.F = None
+
+class _SortedPartitionWriter(_PartitionWriter):
+    
+    # Buffer contains items as bytes. The items are sorted and written to the partition file when the writer is closed.
+    # Until then, flushed items are appended to the uncompressed spill file <path>.unsorted, which is read back, sorted in memory
+    # and removed on close. Writers are closed one after another, so only one partition at a time is held in memory.
+    # The files are open only while they are written, so the writer does not use the file pool.
+    
+    def __init__(self, path, codec, index, nparts, pool=None, hash_name=DefaultHash):
+        self.Index = index
+        self.NParts = nparts
+        self.HashName = hash_name
+        self.SpillPath = path + SpillSuffix
+        self.Spilled = 0
+        _PartitionWriter.__init__(self, path, codec, pool)
+        try:    os.remove(self.SpillPath)
+        except FileNotFoundError:   pass
+        
+    def reopen(self):
+        pass
+        
+    def add(self, item, h=None):
+        self.Buffer.append(item)
+        self.BufferedBytes += len(item)
+        if self.Digests is not None:
+            self.Digests.append(bloom.digest(item))
         
+    def add_record(self, h, item):
+        self.add(item, h)
+
+    def write(self, chunks):
+        with open(self.SpillPath, "ab") as f:
+            f.write(b"\n".join(chunks) + b"\n")
+        self.Spilled += len(chunks)
+
+    def count(self):
+        return self.Count + self.Spilled + len(self.Buffer)
+
+    def flush(self):
+        if self.Buffer:
+            self.write(self.Buffer)
+            self.Buffer = []
+            self.BufferedBytes = 0
+        
+    def close(self):
+        items = self.Buffer
+        self.Buffer = []
+        if self.Spilled:
+            with open(self.SpillPath, "rb") as f:
+                items = f.read().split(b"\n")[:-1] + items
+            os.remove(self.SpillPath)
+        items.sort()
+        writer = FrontCodedWriter(self.Codec.open_write(self.Path), self.Index, self.NParts, self.HashName, len(items))
+        writer.write_items(items)
+        writer.close()
+        self.Count = len(items)
+        self.Checksum = writer.Checksum
+        self.Digest = writer.Digest
+        self.Spilled = 0
+
+def _create_writer(path, index, nparts, compressed=False, format="text", pool=None, hash_name=DefaultHash, gzip_index=False):
+    codec = get_codec(compressed)
+    if format == "binary":
+        return _BinaryPartitionWriter(path, codec, index, nparts, pool, hash_name)
+    elif format == "sorted":
+        return _SortedPartitionWriter(path, codec, index, nparts, pool, hash_name)
+    elif format == "text":
+        return _PartitionWriter(path, codec, pool, gzip_index and isinstance(codec, GzipCodec))
+    else:
+        raise ValueError("Unknown partitioned list format: %s" % (format,))
+
 class PartitionedList(object):
     
-    def __init__(self, mode, filenames, compressed=False):
+    DefaultBufferSize = 16*1024*1024        # characters (or bytes for binary format) buffered in memory across all partitions before flushing
+    
+    DefaultReadAhead = 4                    # batches of items queued by each read-ahead reader
+    
+    MaxOpenFiles = 256                      # default limit on the number of partition files open for writing at the same time
+    MinChunkSize = 16*1024                  # minimum average amount of data per partition written at once when the open files are limited
+    
+    def __init__(self, mode, filenames, compressed=False, buffer_size=None, format="text", prefix=None, manifest=None, readahead=0,
+                bloom_fp=None, max_open=None, hash_name=None, sketch=False, gzip_index=False, column_names=None):
         """Initializes the PartitionedList object.
         
         Parameters
@@ -38,45 +684,153 @@ class PartitionedList(object):
             "w" for write and "r" for read-only
         filenames : list
             Ordered list of file paths for the partition
-        compressed : boolean
-            Whether the files will be compressed with gzip. Used with "w" only. Existing files will be opened as gzip-compressed if they have the
-            .gz extension
+        compressed : boolean, str or Codec
+            Whether and how the files will be compressed: True for gzip, or codec specification, e.g. "gzip:6:4" or "zstd", see ``compression.get_codec``.
+            Used with "w" only. Existing files are decompressed according to their file name extensions (.gz, .zst, .lz4)
+        buffer_size : int or None
+            Approximate number of characters to accumulate in memory across all partitions before writing them out. Used with "w" only.
+            If None, ``PartitionedList.DefaultBufferSize`` is used. 0 means write each item immediately.
+        format : str
+            "text" (default) - newline-separated items, "binary" - length-prefixed blocks of newline-separated items with stored partition hashes (see ``binfmt``),
+            or "sorted" - sorted front-coded items (see ``frontcode``). Sorted partitions are held in memory one at a time when the list is closed.
+            Used with "w" only. When reading, the format of each file is detected automatically.
+        prefix : str or None
+            Used with "w" only. If specified, the manifest <prefix>.manifest will be written when the list is closed
+        manifest : Manifest or None
+            Used with "r" only. The manifest loaded for the list, if any
+        readahead : int
+            Used with "r" only. If not 0, each partition is read and decompressed by a background thread, which keeps up to
+            ``readahead`` batches of items (about 1MB each) in a queue ahead of the consumer
+        bloom_fp : float or None
+            Used with "w" only. If specified, a Bloom filter with this false positive rate is built for each partition when the list is
+            closed and stored in the sidecar file <partition file>.bloom. The item digests are kept in memory until then, 8 bytes per item
+        max_open : int or None
+            Used with "w" only. Maximum number of partition files to keep open at the same time. If None, ``PartitionedList.MaxOpenFiles``
+            is used. If the number of partitions is greater than this limit, the partition files are opened only when buffered data is
+            written out, and the least recently used files are closed and later reopened in append mode. In this case the default buffer
+            size is increased to ``PartitionedList.MinChunkSize`` per partition, so that each file receives large enough chunks of data.
+        hash_name : str or None
+            Used with "w" only. Hash function used to assign items to partitions: "adler32" (default), "crc32" or "blake2b64", see ``hashes``.
+            When reading, the hash is taken from the manifest or from the binary partition file headers
+        sketch : boolean
+            Used with "w" only. If True, a HyperLogLog sketch of the items is kept while they are added (see ``hll``), and saved as
+            <prefix>.hll when the list is closed
+        gzip_index : boolean
+            Used with "w" only. If True and the list is written in text format with gzip compression, each partition file is written as
+            a sequence of independent gzip members and the access point index is stored in the sidecar file <partition file without .gz>.gzi,
+            so that the partition can be read in chunks by several workers, see ``chunks`` and ``gzindex``. The files are compressed
+            by a single thread in this case
+        column_names : list of str or None
+            Used with "w" only. Names of the numeric columns stored with the items, e.g. ["size", "mtime"]. The values are passed to ``add``
+            and ``add_many`` and written into the sidecar files <partition file without compression extension>.<name>.col aligned with
+            the records of the partition files, see ``columns``. Not supported for "sorted" format
         
         Notes
         -----
-            It is recommended to use ``open`` and ``create`` static methods instead of the constructor
+            It is recommended to use ``open`` and ``create`` static methods instead of the constructor.
+            
+            When reading, each partition file is opened when the partition is first read and closed when it has been read to the end,
+            so that only the partitions being read hold open files.
         """
         self.Mode = mode
         self.FileNames = filenames
-        self.Files = []
         self.NParts = len(filenames)
         self.Compressed = compressed
+        self.Writers = []
+        self.MaxOpen = max_open or self.MaxOpenFiles
+        self.Pool = _FilePool(self.MaxOpen) if mode == "w" and self.NParts > self.MaxOpen else None
+        if buffer_size is None:
+            buffer_size = self.DefaultBufferSize
+            if self.Pool is not None:
+                buffer_size = max(buffer_size, self.NParts * self.MinChunkSize)
+        self.BufferSize = buffer_size
+        self.Buffered = 0
+        
+        self.Format = format
+        self.HashName = hash_name or (manifest.HashName if manifest is not None else DefaultHash)
+        self.HashFunction = get_hash(self.HashName)
+        self.Prefix = prefix
+        self.Manifest = manifest
+        self.Closed = False
+        self.ReadAhead = readahead
+        self.Partitions = None                  # list of _Partition objects, created on first use
+        self.BloomFP = bloom_fp
+        self.Blooms = {}                        # partition index -> loaded BloomFilter or None
+        self.HashIndexes = {}                   # partition index -> loaded HashIndex or None
+        self.Sketch = hll.HyperLogLog() if sketch and mode == "w" else None
+        self.ColumnNames = list(column_names or [])
         
         if mode == "w":
-            self.Files = [open(fn, "w") if not compressed else gzip.open(fn, "wt") for fn in self.FileNames]
+            if prefix is not None:
+                Manifest.remove(prefix)         # stale manifest from a previous run must not describe the new files
+                try:    os.remove(hll.sketch_path(prefix))
+                except FileNotFoundError:   pass
+            for fn in self.FileNames:
+                for stale in [sidecar_path(fn, bloom.Suffix), gzindex.index_path(fn), sidecar_path(fn, hashindex.Suffix)] \
+                            + glob.glob(columns.column_path(fn, "*")):
+                    try:    os.remove(stale)
+                    except FileNotFoundError:   pass
+            self.Writers = [_create_writer(fn, i, self.NParts, compressed, format, self.Pool, self.HashName, gzip_index) 
+                        for i, fn in enumerate(self.FileNames)]
+            if bloom_fp:
+                for w in self.Writers:
+                    w.Digests = array("Q")
+            if self.ColumnNames:
+                if format == "sorted":
+                    raise ValueError("Columns are not supported for sorted partitioned lists")
+                for w in self.Writers:
+                    w.init_columns(self.ColumnNames)
+        elif manifest is not None:
+            self.Format = manifest.Format
+            if manifest.Partitions:
+                self.ColumnNames = list(manifest.Partitions[0].get("columns", {}))
         else:
-            self.Files = [open(fn, "r") if not fn.endswith(".gz") else gzip.open(fn, "rt") for fn in self.FileNames]
+            formats = set()
+            for fn in self.FileNames:
+                f = _open_reader(fn)
+                if isinstance(f, BinaryReader):
+                    formats.add("binary")
+                    self.HashName = f.HashName
+                elif isinstance(f, FrontCodedReader):
+                    formats.add("sorted")
+                    self.HashName = f.HashName
+                else:
+                    formats.add("text")
+                f.close()
+            self.Format = formats.pop() if len(formats) == 1 else ("text" if not formats else "mixed")
+            if self.FileNames:
+                self.ColumnNames = sorted(columns.load_column(path)[0] for path in glob.glob(columns.column_path(self.FileNames[0], "*")))
+            self.HashFunction = get_hash(self.HashName)
             
         self.NWritten = 0
             
     @staticmethod
-    def open(prefix=None, files=None):
+    def open(prefix=None, files=None, readahead=0):
         """Static method to open an existing partitioned list
         
         Parameters
         ----------
         prefix : str
-            Open files matching pattern: <prefix>*
+            Open files listed in <prefix>.manifest if it exists, otherwise files matching pattern: <prefix>.*
         files : list
             Ordered list of file paths for the partition
+        readahead : int
+            Number of batches of items to read ahead in a background thread for each partition being read, 0 - no read-ahead.
+            See the constructor
         """
         # open existing set
+        manifest = None
         if files is None:
-            files = sorted(glob.glob(f"{prefix}.*"))
-        return PartitionedList("r", files)
+            manifest = Manifest.load(prefix)
+            if manifest is not None:
+                files = manifest.files()
+            else:
+                files = sorted(path for path in glob.glob(f"{prefix}.*") if not path.endswith(SidecarSuffixes))
+        return PartitionedList("r", files, manifest=manifest, readahead=readahead)
         
     @staticmethod
-    def create(nparts, prefix, compressed=False):
+    def create(nparts, prefix, compressed=False, buffer_size=None, format="text", bloom_fp=None, max_open=None, hash_name=None,
+                sketch=False, gzip_index=False, column_names=None):
         """Static method to create a new partitioned list
         
         Parameters
@@ -85,43 +839,332 @@ class PartitionedList(object):
             Number of partitions to create. Each partition will be stored in a separate file.
         prefix : str
             Files will be created as <prefix>.00000, <prefix>.00001, ...
-        compressed : boolean
-            Whether to compress the partition files
+        compressed : boolean, str or Codec
+            Whether and how to compress the partition files, see the constructor
+        buffer_size : int or None
+            Approximate number of characters to buffer in memory before writing, see the constructor
+        format : str
+            "text", "binary" or "sorted", see the constructor
+        bloom_fp : float or None
+            False positive rate of Bloom filters to build for the partitions, None - do not build Bloom filters. See the constructor
+        max_open : int or None
+            Maximum number of partition files open at the same time, see the constructor
+        hash_name : str or None
+            Hash function used to assign items to partitions, default "adler32". See the constructor
+        sketch : boolean
+            Whether to keep HyperLogLog sketch of the items and save it as <prefix>.hll, see the constructor
+        gzip_index : boolean
+            Whether to write gzip partition files with the access point index, see the constructor
+        column_names : list of str or None
+            Names of the numeric columns stored with the items, see the constructor
         """
         # create new set
-        gz = ".gz" if compressed else ""
-        files = ["%s.%05d%s" % (prefix, i, gz) for i in range(nparts)]
-        return PartitionedList("w", files, compressed)
+        files = partition_file_names(prefix, nparts, compressed)
+        return PartitionedList("w", files, compressed, buffer_size=buffer_size, format=format, prefix=prefix, bloom_fp=bloom_fp,
+                    max_open=max_open, hash_name=hash_name, sketch=sketch, gzip_index=gzip_index, column_names=column_names)
         
     @staticmethod
-    def create_file(path, compressed=False):
+    def create_file(path, compressed=False, buffer_size=None, format="text", bloom_fp=None):
         # create a single file set
-        if compressed and not path.endswith(".gz"):
-            path = path + ".gz"
-        return PartitionedList("w", [path], compressed)
+        path = compressed_path(path, compressed)
+        return PartitionedList("w", [path], compressed, buffer_size=buffer_size, format=format, bloom_fp=bloom_fp)
         
-    def add(self, item):
+    def add(self, item, values=None):
         """Adds an item to the partitioned list by appending it to corresponding partition file. The partition file is chosen by computing
-        Adler32 checksum as an unsigned (positive) integer on the item and then taking modulo by the number of partitions in the list of the 
-        integer result.
+        the partition hash (Adler32 checksum by default) as an unsigned (positive) integer on the item and then taking modulo by the number
+        of partitions in the list of the integer result.
         
         Parameters
         ----------
         item : str or bytes
             The item to add to the list
+        values : tuple or None
+            Values of the columns for the item, in the order of the column names, see the constructor. None or missing values
+            are stored as ``columns.Missing``
         """
         if self.Mode != "w":    raise ValueError("The list is not open for writing")
         item = item.strip()
-        i = part(self.NParts, item)
-        #print(item, "%", self.NParts, "->", i)
-        item = item+"\n"
-        self.Files[i].write(item)
+        if self.Sketch is not None:
+            self.Sketch.add(item)
+        if self.Format != "text":
+            item = to_bytes(item)
+            h = self.HashFunction(item)
+            w = self.Writers[0 if self.NParts <= 1 else h % self.NParts]
+            w.add(item, h)
+        else:
+            i = part(self.NParts, item, self.HashName)
+            #print(item, "%", self.NParts, "->", i)
+            item = item+"\n"
+            w = self.Writers[i]
+            w.add(item)
+        if self.ColumnNames:
+            w.add_values(values)
         self.NWritten += 1
+        self.Buffered += len(item)
+        if self.Buffered > self.BufferSize:
+            self.flush()
+
+    def add_many(self, items, values=None):
+        """Adds multiple items to the list. The items are grouped by partition in memory and written out in large chunks
+        when the amount of buffered data exceeds the buffer size. The resulting files are identical to those produced by calling
+        ``add`` for each item in the same order.
+        
+        Parameters
+        ----------
+        items : iterable of str
+            The items to add to the list
+        values : iterable of tuples or None
+            Values of the columns for each item, see ``add``
+            
+        Returns
+        -------
+        int
+            Number of items added
+        """
+        if self.Mode != "w":    raise ValueError("The list is not open for writing")
+        nparts = self.NParts
+        writers = self.Writers
+        buffer_size = self.BufferSize
+        buffered = self.Buffered
+        binary = self.Format == "binary"
+        text = self.Format == "text"
+        with_bloom = bool(self.BloomFP)
+        sketch = self.Sketch
+        with_digest = with_bloom or sketch is not None
+        digest = bloom.digest
+        hash_function = self.HashFunction
+        values = iter(values) if values is not None else None
+        with_columns = bool(self.ColumnNames)
+        n = 0
+        for item in items:
+            item = item.strip()
+            b = to_bytes(item)
+            if binary:
+                line = b
+                h = hash_function(line)
+                w = writers[0] if nparts <= 1 else writers[h % nparts]
+                w.Hashes.append(h)
+            elif not text:
+                line = b
+                w = writers[0] if nparts <= 1 else writers[hash_function(b) % nparts]
+            else:
+                line = item + "\n"
+                w = writers[0] if nparts <= 1 else writers[hash_function(b) % nparts]
+            if with_digest:
+                d = digest(b)
+                if with_bloom:
+                    w.Digests.append(d)
+                if sketch is not None:
+                    sketch.add_digest(d, len(b))
+            w.Buffer.append(line)
+            w.BufferedBytes += len(line)
+            if with_columns:
+                w.add_values(next(values) if values is not None else None)
+            buffered += len(line)
+            n += 1
+            if buffered > buffer_size:
+                self.Buffered = buffered
+                self.flush()
+                buffered = 0
+        self.Buffered = buffered
+        self.NWritten += n
+        return n
+        
+    def flush(self):
+        """Writes all buffered items to the partition files
+        """
+        for w in self.Writers:
+            w.flush()
+        self.Buffered = 0
         
     def files(self):
         """Returns ordered list of paths for the partition files
         """
-        return self.Files
+        return self.FileNames
+        
+    def counts(self):
+        """Returns list of item counts per partition if they are known from the manifest, otherwise None
+        """
+        if self.Mode == "w":
+            return [w.count() for w in self.Writers]
+        return self.Manifest.counts if self.Manifest is not None else None
+
+    def skew(self):
+        """Returns partition size statistics, see ``partition_skew``, or None if the partition sizes are not known
+        """
+        counts = self.counts()
+        return partition_skew(counts) if counts is not None else None
+
+    def validate(self, deep=False):
+        """Validates the list against its manifest: checks that all partition files exist and have the recorded sizes, so that
+        truncated or missing partitions are detected before the list is read. If ``deep`` is True, also verifies content checksums.
+        
+        Returns
+        -------
+        boolean
+            True if the list was validated, False if the list has no manifest
+        
+        Raises
+        ------
+        ManifestError
+            if the list is inconsistent with the manifest
+        """
+        if self.Manifest is None:
+            return False
+        if self.Manifest.NParts != self.NParts:
+            raise ManifestError("Number of partition files (%d) does not match the manifest (%d)" % (self.NParts, self.Manifest.NParts))
+        self.Manifest.validate(deep)
+        return True
+        
+    def bloom(self, i):
+        """Returns Bloom filter (``bloom.BloomFilter``) for the partition ``i``, or None if the partition has no Bloom filter.
+        The filter is loaded once and memory-mapped.
+        """
+        if i not in self.Blooms:
+            self.Blooms[i] = bloom.BloomFilter.load(sidecar_path(self.FileNames[i], bloom.Suffix))
+        return self.Blooms[i]
+
+    def might_contain(self, item):
+        """Checks whether the item may be in the list using the Bloom filter of the partition the item belongs to, without reading the
+        partition file.
+        
+        Parameters
+        ----------
+        item : str or bytes
+        
+        Returns
+        -------
+        boolean
+            False if the item is definitely not in the list, True if it may be in the list
+            
+        Raises
+        ------
+        ValueError
+            if the partition has no Bloom filter
+        """
+        item = to_bytes(item.strip())
+        i = part(self.NParts, item, self.HashName)
+        f = self.bloom(i)
+        if f is None:
+            raise ValueError("Partition %s has no Bloom filter" % (self.FileNames[i],))
+        return f.might_contain(item)
+
+    def hash_index(self, i):
+        """Returns hash index (``hashindex.HashIndex``) for the partition ``i``, or None if the partition has no index or the index
+        is stale. The index is loaded once and memory-mapped.
+        """
+        if i not in self.HashIndexes:
+            path = self.FileNames[i]
+            index = hashindex.HashIndex.load(sidecar_path(path, hashindex.Suffix))
+            if index is not None and not index.is_valid_for(path):
+                index.close()
+                index = None
+            self.HashIndexes[i] = index
+        return self.HashIndexes[i]
+
+    def build_hash_index(self, force=False):
+        """Builds the hash index for each partition, which does not have a valid index yet, see ``hashindex``. The partition files are
+        read once, one at a time.
+        
+        Parameters
+        ----------
+        force : boolean
+            Rebuild existing valid indexes too
+        
+        Returns
+        -------
+        int
+            Number of partitions indexed
+        """
+        assert self.Mode == "r"
+        n = 0
+        for i, path in enumerate(self.FileNames):
+            if not force and self.hash_index(i) is not None:
+                continue
+            index = self.HashIndexes.pop(i, None)
+            if index is not None:
+                index.close()
+            digests = array("Q")
+            signature = hashindex.file_signature(path)
+            for batch in read_chunk((path, None, None)):
+                digests.extend(map(hashindex.digest, batch))
+            hashindex.HashIndex.from_digests(digests, signature).save(sidecar_path(path, hashindex.Suffix))
+            n += 1
+        return n
+
+    def locate(self, items):
+        """Finds the items in the list using the hash indexes of the partitions, without reading the partition files.
+        The items are matched by their 64-bit digests only, so an item not in the list is reported as found with probability
+        of about 2**-64 times the number of items in its partition, see ``hashindex``.
+        
+        Parameters
+        ----------
+        items : iterable of str or bytes
+        
+        Returns
+        -------
+        generator of tuples (item, partition, record)
+            ``partition`` is the index of the partition the item belongs to. ``record`` is the record number of the item in the partition file
+            (the line number for text files, starting from 0), or None if the item is not in the list
+            
+        Raises
+        ------
+        ValueError
+            if a partition has no valid hash index, see ``build_hash_index``
+        """
+        for item in items:
+            b = to_bytes(item.strip())
+            i = part(self.NParts, b, self.HashName)
+            index = self.hash_index(i)
+            if index is None:
+                raise ValueError("Partition %s has no valid hash index" % (self.FileNames[i],))
+            yield item, i, index.lookup(b)
+
+    def column(self, name, i):
+        """Returns values of the column for the partition ``i`` as array("q") aligned with the records of the partition file.
+        Missing values are ``columns.Missing``.
+
+        Raises
+        ------
+        ValueError
+            if the partition has no such column
+        """
+        loaded = columns.load_column(columns.column_path(self.FileNames[i], name))
+        if loaded is None:
+            raise ValueError("Partition %s has no column %s" % (self.FileNames[i], name))
+        return loaded[1]
+
+    def column_sum(self, name):
+        """Returns sum of the known values of the column over all partitions, e.g. total size of the files in the list
+        """
+        return sum(sum(v for v in self.column(name, i) if v != columns.Missing) for i in range(self.NParts))
+
+    def column_values(self, items, name):
+        """Looks up values of the column for the items using the hash indexes, see ``locate``. The column of a partition is read
+        only if one of the items belongs to the partition.
+
+        Returns
+        -------
+        generator of tuples (item, value)
+            ``value`` is None if the item is not in the list or its value is missing
+        """
+        loaded = {}
+        for item, i, record in self.locate(items):
+            value = None
+            if record is not None:
+                if i not in loaded:
+                    loaded[i] = self.column(name, i)
+                value = loaded[i][record]
+                if value == columns.Missing:
+                    value = None
+            yield item, value
+
+    def write_manifest(self):
+        codec = get_codec(self.Compressed)
+        manifest = Manifest(self.NParts, self.HashName, self.Format, False if isinstance(codec, NoCompression) else str(codec), 
+                [w.info() for w in self.Writers])
+        manifest.save(self.Prefix)
+        self.Manifest = manifest
         
     @property
     def partitions(self):
@@ -132,17 +1175,115 @@ class PartitionedList(object):
                     ...
 
         """
-        return [_Partition(f, path) for f, path in zip(self.Files, self.FileNames)]
+        if self.Partitions is None:
+            self.Partitions = [_Partition(path, self.ReadAhead, self.HashName) for path in self.FileNames]
+        return self.Partitions
         
     def items(self):
-        """Generator yielding all the items in the list.
+        """Generator yielding all the items in the list. With read-ahead enabled, reading of the next partition starts
+        when the iteration over the current one begins.
+        """
+        assert self.Mode == "r"
+        partitions = self.partitions
+        for i, p in enumerate(partitions):
+            p.start()
+            if i + 1 < len(partitions):
+                partitions[i+1].start()
+            yield from p.items()
+            
+    def iter_batches(self, size=None):
+        """Generator yielding batches of items of all the partitions. Each batch is a list of items as bytes. See ``_Partition.iter_batches``.
+        """
+        assert self.Mode == "r"
+        partitions = self.partitions
+        for i, p in enumerate(partitions):
+            p.start(True, size)
+            if i + 1 < len(partitions):
+                partitions[i+1].start(True, size)
+            yield from p.iter_batches(size)
+
+    def records(self):
+        """Generator yielding (hash, item) tuples for all the items in the list. See ``_Partition.records``.
+        """
+        assert self.Mode == "r"
+        for p in self.partitions:
+            yield from p.records()
+
+    def chunks(self, n):
+        """Returns list of chunks of the partition files, which can be read independently with ``read_chunk``. Each partition is split
+        into up to ``n`` chunks if it has the gzip access point index, otherwise it is a single chunk. See ``_Partition.chunks``.
+        """
+        assert self.Mode == "r"
+        return [chunk for p in self.partitions for chunk in p.chunks(n)]
+
+    def map_chunks(self, function, workers=None):
+        """Applies the function to the chunks of the partition files in parallel worker processes. Large indexed partitions are
+        split into chunks so that they are processed by several workers, see ``chunks``.
+        
+        Parameters
+        ----------
+        function : callable
+            Module level function receiving a chunk (see ``read_chunk``) and returning a picklable result
+        workers : int or None
+            Number of worker processes, default: number of CPUs
+            
+        Returns
+        -------
+        list
+            Results in the order of the chunks
+        """
+        import multiprocessing
+        workers = workers or multiprocessing.cpu_count()
+        chunks = self.chunks(workers)
+        if workers <= 1 or len(chunks) <= 1:
+            return [function(chunk) for chunk in chunks]
+        with multiprocessing.Pool(min(workers, len(chunks))) as pool:
+            return pool.map(function, chunks, chunksize=1)
+
+    def count(self, workers=None):
+        """Counts the items in the list by reading the partition files in parallel, see ``map_chunks``
+        """
+        return sum(self.map_chunks(_count_chunk, workers))
+
+    def build_gzip_index(self, chunk_size=gzindex.ChunkSize, rewrite=False):
+        """Builds the access point index for each gzip-compressed text partition file which does not have a valid index yet, in one pass
+        over the file. Files without enough access points are rewritten in place only if ``rewrite`` is True, otherwise they are
+        not indexed, see ``gzindex.GzipIndex.build``. If the list has a manifest, it is updated.
+        
+        Parameters
+        ----------
+        chunk_size : int
+            Minimum uncompressed size of data between access points
+        rewrite : boolean
+            Whether partition files without enough access points can be rewritten
+
+        Returns
+        -------
+        tuple (int, list)
+            Number of partition files indexed and list of paths of the partition files not indexed because they would have to be rewritten
         """
         assert self.Mode == "r"
-        for f in self.Files:
-            l = f.readline()
-            while l:
-                yield l.strip()
-                l = f.readline()
+        if self.Format != "text":
+            raise ValueError("Only text partitioned lists can be indexed")
+        n = 0
+        skipped = []
+        for i, path in enumerate(self.FileNames):
+            if not path.endswith(GzipCodec.Extension):
+                continue
+            index = gzindex.GzipIndex.load(gzindex.index_path(path))
+            if index is None or not index.is_valid_for(path):
+                index, _ = gzindex.GzipIndex.build(path, chunk_size, rewrite=rewrite)
+                if index is None:
+                    skipped.append(path)
+                    continue
+                n += 1
+            if self.Manifest is not None:
+                info = self.Manifest.Partitions[i]
+                info["size"] = os.path.getsize(path)
+                info["gzindex"] = os.path.basename(gzindex.index_path(path))
+        if n and self.Manifest is not None:
+            self.Manifest.save(self.Manifest.Prefix)
+        return n, skipped
                 
     def __iter__(self):
         """Iterator for the list. This allows the PartitionedList object to be used as:
@@ -156,13 +1297,128 @@ class PartitionedList(object):
     def close(self):
         """Closes the list. It is important to call this method for a list open for writing.
         """
-        [f.close() for f in self.Files]
+        if self.Closed:
+            return
+        for w in self.Writers:
+            w.close()
+        for p in self.Partitions or []:
+            p.close()
+        for f in chain(self.Blooms.values(), self.HashIndexes.values()):
+            if f is not None:
+                f.close()
+        self.Blooms = {}
+        self.HashIndexes = {}
+        self.Closed = True
+        if self.Mode == "w":
+            for w in self.Writers:
+                w.build_bloom(self.BloomFP)
+            if self.Prefix is not None:
+                if self.Sketch is not None:
+                    self.Sketch.save(hll.sketch_path(self.Prefix))
+                self.write_manifest()
 
     def __del__(self):
         """The destructor will call close()
         """
         self.close()
 
+def _repartition_task(params):
+    # reads the input partition files and distributes their records over the output partitions with the given indices
+    in_files, out_files, out_indices, nparts, compressed, format, buffer_size, hash_name = params
+    pool = None
+    if len(out_indices) > PartitionedList.MaxOpenFiles:
+        pool = _FilePool(PartitionedList.MaxOpenFiles)
+        buffer_size = max(buffer_size, len(out_indices) * PartitionedList.MinChunkSize)
+    writers = {j: _create_writer(out_files[j], j, nparts, compressed, format, pool, hash_name) for j in out_indices}
+    buffered = 0
+    for path in in_files:
+        f = _open_reader(path)
+        for h, item in _read_records(f, hash_name):
+            w = writers.get(h % nparts)
+            if w is None:
+                raise ValueError("Item %s in %s does not belong to the output partitions %s. The input list is not partitioned consistently" % (
+                    item, path, sorted(out_indices)))
+            w.add_record(h, item)
+            buffered += len(item)
+            if buffered > buffer_size:
+                for w in writers.values():
+                    w.flush()
+                buffered = 0
+        f.close()
+    for w in writers.values():
+        w.close()
+    return [(j, w.info()) for j, w in writers.items()]
+
+def repartition(in_list, out_prefix, nparts, workers=None, compressed=None, format=None, buffer_size=None):
+    """Creates a new partitioned list with a different number of partitions from an existing list, without recomputing partition
+    hashes for binary inputs. Each input file is read only once. The new number of partitions must be a multiple or a divisor of the
+    current number of partitions. When the number of partitions grows, each input partition is split into its own set of output
+    partitions, and when it shrinks, each output partition is merged from its own set of input partitions, so the work is done
+    in parallel, one task per input (or output) partition.
+    
+    Parameters
+    ----------
+    in_list : PartitionedList
+        The input list, open for reading
+    out_prefix : str
+        Prefix for the output list
+    nparts : int
+        Number of partitions in the output list
+    workers : int or None
+        Number of worker processes. If None, the number of CPUs is used
+    compressed : boolean, str, Codec or None
+        Whether and how to compress the output, see ``compression.get_codec``. If None, the output will be compressed the same way as the input
+    format : str or None
+        Output format, "text", "binary" or "sorted". If None, the input format is used
+    buffer_size : int or None
+        Amount of data to buffer in memory by each worker before writing it out
+    
+    Returns
+    -------
+    Manifest
+        Manifest of the created list
+    """
+    import multiprocessing
+    
+    n_in = in_list.NParts
+    if nparts % n_in != 0 and n_in % nparts != 0:
+        raise ValueError("New number of partitions (%d) must be a multiple or a divisor of the current number of partitions (%d)" % (nparts, n_in))
+    if compressed is None:
+        compressed = codec_for_path(in_list.FileNames[0]) if in_list.FileNames else False
+    if format is None:
+        format = in_list.Format if in_list.Format in ("binary", "sorted") else "text"
+    buffer_size = buffer_size or PartitionedList.DefaultBufferSize
+    
+    out_files = partition_file_names(out_prefix, nparts, compressed)
+    Manifest.remove(out_prefix)
+    if nparts >= n_in:
+        # split input partition i into i, i+n_in, i+2*n_in, ...
+        tasks = [([in_list.FileNames[i]], out_files, list(range(i, nparts, n_in)), nparts, compressed, format, buffer_size, in_list.HashName) 
+                    for i in range(n_in)]
+    else:
+        # merge input partitions j, j+nparts, j+2*nparts, ... into j
+        tasks = [([in_list.FileNames[i] for i in range(j, n_in, nparts)], out_files, [j], nparts, compressed, format, buffer_size, in_list.HashName) 
+                    for j in range(nparts)]
+    
+    workers = workers or multiprocessing.cpu_count()
+    infos = [None]*nparts
+    if workers <= 1 or len(tasks) <= 1:
+        results = map(_repartition_task, tasks)
+    else:
+        pool = multiprocessing.Pool(min(workers, len(tasks)))
+        results = pool.imap_unordered(_repartition_task, tasks)
+    for result in results:
+        for j, info in result:
+            infos[j] = info
+    if workers > 1 and len(tasks) > 1:
+        pool.close()
+        pool.join()
+
+    codec = get_codec(compressed)
+    manifest = Manifest(nparts, in_list.HashName, format, False if isinstance(codec, NoCompression) else str(codec), infos)
+    manifest.save(out_prefix)
+    return manifest
+
 if __name__ == "__main__":
     import sys, glob
     prefix = sys.argv[1]
@@ -0,0 +1,199 @@
+"""Cache of the comparison results of individual partitions, so that a repeated comparison only compares the partitions whose inputs
+have changed.
+
+Results are keyed by the kind of the comparison and the contents of the input partitions: the 256-bit BLAKE2b content digest of
+each partition from the manifest of the list, or computed from the partition file for lists without manifests or written by older
+versions (see ``manifest.content_digest``). The CRC32 checksum, also recorded in the manifest, is only meant to detect corruption and
+is not used: a changed partition matching an old result would silently reuse a stale list of dark or missing items. Computing the
+digests means reading and decompressing every partition file of such a list once more before the comparison starts, so the cache is
+most useful with lists written with manifests. The comparison engine and the paths of the files are not part of the key, so the
+results can be reused after the lists are moved, or by a comparison with another engine.
+
+Each result is stored in the cache directory as a file <key>.res::
+
+    header (16 bytes):
+        magic           4s      b"RCRS"
+        version         uint8
+        reserved        3 bytes
+        payload size    uint64, little-endian
+    payload         zlib-compressed JSON of the result
+
+The total size of the cache is limited: the cache keeps a running total of the size of the result files, counted once when the first
+result is stored, and when a new result brings it over the limit, the least recently used results are removed until the total size
+is within 90% of the limit, so that the directory is not listed again for each of the next results. Damaged result files are removed
+and treated as missing.
+"""
+
+import hashlib, json, os, struct, tempfile, zlib
+from .manifest import content_digest
+
+Magic = b"RCRS"
+FormatVersion = 1
+Suffix = ".res"
+DefaultMaxSize = 10*1024*1024*1024      # bytes
+EvictTo = 0.9                           # when the cache is over the limit, results are removed down to this fraction of the limit
+
+_Header = struct.Struct("<4sB3xQ")
+
+
+def partition_digests(lst):
+    """Returns list of the content digests of the partitions of the list, one per partition.
+    The digests are taken from the manifest. Partitions without a recorded digest, and all partitions of a list without
+    a manifest, are read in full to compute the digest, which costs about as much as reading the list for the comparison
+    """
+    if lst.Manifest is not None:
+        return [p.get("digest") or content_digest(path) for p, path in zip(lst.Manifest.Partitions, lst.FileNames)]
+    return [content_digest(path) for path in lst.FileNames]
+
+
+class ResultCache(object):
+    """Stores the results of partition comparisons in a local directory.
+
+    Parameters
+    ----------
+    directory : str
+        Cache directory, created if it does not exist
+    max_size : int or None
+        Maximum total size of the stored results, bytes. None - unlimited
+    """
+
+    def __init__(self, directory, max_size=DefaultMaxSize):
+        os.makedirs(directory, exist_ok=True)
+        self.Dir = directory
+        self.MaxSize = max_size
+        self.Size = None            # running total size of the stored results, counted when the first result is stored
+
+    @staticmethod
+    def key(*parts):
+        """Returns the key for the JSON-serializable parts, e.g. the kind of the comparison and the checksums of the inputs
+        """
+        return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def partition_keys(self, kind, lists, variants=(None,)):
+        """Returns list of keys for each partition of the lists: one key per variant of the comparison, e.g. the output stream.
+        See ``partition_digests``
+        """
+        return [[self.key(kind, variant, list(digests)) for variant in variants]
+                for digests in zip(*(partition_digests(lst) for lst in lists))]
+
+    def path(self, key):
+        return os.path.join(self.Dir, key + Suffix)
+
+    def get(self, key):
+        """Returns the stored result or None if it is not in the cache
+        """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            if len(data) < _Header.size:
+                raise ValueError("truncated")
+            magic, version, size = _Header.unpack(data[:_Header.size])
+            if magic != Magic or version != FormatVersion or len(data) != _Header.size + size:
+                raise ValueError("invalid header")
+            result = json.loads(zlib.decompress(data[_Header.size:]).decode("utf-8"))
+        except (ValueError, zlib.error):
+            self._remove(path)
+            return None
+        try:    os.utime(path)          # mark as recently used
+        except OSError: pass
+        return result
+
+    def put(self, key, result):
+        """Stores the JSON-serializable result and removes the least recently used results if the cache is over the size limit.
+        The cache directory is listed only when the running total of the result sizes goes over the limit, see ``evict``
+        """
+        payload = zlib.compress(json.dumps(result).encode("utf-8"))
+        path = self.path(key)
+        if self.Size is None:
+            self.Size = self.size()
+        try:    self.Size -= os.path.getsize(path)        # replaced
+        except OSError: pass
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.Dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_Header.pack(Magic, FormatVersion, len(payload)))
+                f.write(payload)
+            os.replace(tmp, path)
+        except Exception:
+            self._remove(tmp)
+            raise
+        self.Size += _Header.size + len(payload)
+        if self.MaxSize is not None and self.Size > self.MaxSize:
+            self.evict(int(self.MaxSize * EvictTo))
+
+    def size(self):
+        """Returns total size of the stored results, bytes
+        """
+        return sum(size for _, _, size in self._entries())
+
+    def evict(self, max_size=None):
+        """Removes the least recently used results until the total size is within ``max_size``, default - the cache size limit
+        """
+        max_size = self.MaxSize if max_size is None else max_size
+        if max_size is None:
+            return
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= max_size:
+                break
+            self._remove(path)
+            total -= size
+        self.Size = total
+
+    def _entries(self):
+        # (last use time, path, size) for the stored results
+        entries = []
+        for name in os.listdir(self.Dir):
+            if name.endswith(Suffix):
+                path = os.path.join(self.Dir, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue                # removed by another process
+                entries.append((st.st_mtime, path, st.st_size))
+        return entries
+
+    @staticmethod
+    def _remove(path):
+        try:    os.remove(path)
+        except FileNotFoundError:   pass
+
+
+def cached_results(cache, keys, tasks, run, partition_stats=None):
+    """Generator of the results of the partition comparison tasks, taking the results of the partitions with unchanged inputs
+    from the cache and storing the results of the other partitions in it.
+
+    Parameters
+    ----------
+    cache : ResultCache
+    keys : list
+        Keys for each partition, see ``ResultCache.partition_keys``. The result is looked up with each of the keys in order
+        and stored with the first one
+    tasks : list
+        Tasks, the first element of each task is the partition index
+    run : callable
+        Receives list of the tasks to run and returns iterable of the results, tuples (<partition index>, ...)
+    partition_stats : dict or None
+        If given, ``partition_stats[i]["cached"]`` is set to True for the partitions found in the cache
+    """
+    todo = []
+    for task in tasks:
+        i = task[0]
+        for key in keys[i]:
+            result = cache.get(key)
+            if result is not None:
+                break
+        if result is None:
+            todo.append(task)
+            continue
+        if partition_stats is not None:
+            partition_stats.setdefault(i, {})["cached"] = True
+        yield (i,) + tuple(result)
+    for result in run(todo):
+        cache.put(keys[result[0]][0], result[1:])
+        yield result
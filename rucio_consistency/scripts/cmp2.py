@@ -1,23 +1,103 @@
 import sys, glob, time, os
 
-from rucio_consistency import PartitionedList, Stats
+from rucio_consistency import PartitionedList, Stats, cmp2_generator, ManifestError
+from rucio_consistency.setexpr import SetExpression, evaluate_generator
+from rucio_consistency.hll import parse_size
 
 Version = "1.0"
 
 Usage = """
-%(cmd)s [-z] [-s <stats file> [-S <stats key>]]    (join|minus|xor|or) <A prefix> <B prefix> <output prefix>
-%(cmd)s [-z] [-s <stats file> [-S <stats key>]] -f (join|minus|xor|or) <A file> <B file> <output file>
+%(cmd)s [-z|-Z <codec>[:<level>[:<threads>]]] [-j <N> [--mem-budget <size>]] [-s <stats file> [-S <stats key>]]    (join|minus|xor|or) <A prefix> <B prefix> <output prefix>
+%(cmd)s [-z|-Z <codec>[:<level>[:<threads>]]] [-s <stats file> [-S <stats key>]] -f (join|minus|xor|or) <A file> <B file> <output file>
+%(cmd)s [-z|-Z <codec>[:<level>[:<threads>]]] [-j <N> [--mem-budget <size>]] [-s <stats file> [-S <stats key>]] -e <expression> <name>=<prefix> [...] <output prefix>
+
+    -j <N>     - process up to N partitions in parallel worker processes
+    --mem-budget <size> - with -j, limit the estimated memory of the partitions processed at the same time, e.g. 16G
+    -e <expression> - evaluate set-algebra expression over the partitioned lists bound to the names, e.g. "(A & B) - R" A=... B=... R=...
+                 Operators: "-" (difference), "&" (intersection), "^" (symmetric difference), "|" (union), in the order of decreasing
+                 precedence. Each partition of each list is read once. Can not be used with -f
 """
 
+def evaluate(expression, args, opts, t0):
+    stats_file = opts.get("-s")
+    stats_key = opts.get("-S", "setexpr")
+    compress = opts.get("-Z") or ("-z" in opts)
+    workers = int(opts.get("-j", 1))
+    mem_budget = parse_size(opts["--mem-budget"]) if "--mem-budget" in opts else None
+    partition_stats = {}
+
+    expression = SetExpression(expression)
+    *bindings, out_spec = args
+    prefixes = {}
+    for binding in bindings:
+        name, _, prefix = binding.partition("=")
+        if not prefix:
+            print("Invalid list specification: %s, expected <name>=<prefix>" % (binding,))
+            sys.exit(2)
+        prefixes[name] = prefix
+    missing = [name for name in expression.Names if name not in prefixes]
+    if missing:
+        print("Lists are not specified for: %s" % (", ".join(missing),))
+        sys.exit(2)
+
+    lists = {name: PartitionedList.open(prefix=prefixes[name]) for name in expression.Names}
+    nparts = set(lst.NParts for lst in lists.values())
+    if len(nparts) > 1:
+        print("Inconsistent number of parts: %s" % (", ".join("%s:%d" % (prefixes[name], lst.NParts) for name, lst in lists.items()),))
+        sys.exit(1)
+    try:
+        items = evaluate_generator(expression, lists, workers=workers, mem_budget=mem_budget, partition_stats=partition_stats)
+    except ManifestError as e:
+        print(e)
+        sys.exit(1)
+    out_list = PartitionedList.create(nparts.pop(), out_spec, compress)
+
+    stats = my_stats = None
+    if stats_file is not None:
+        stats = Stats(stats_file)
+        my_stats = {
+            "version": Version,
+            "elapsed": None,
+            "start_time": t0,
+            "end_time": None,
+            "expression": str(expression),
+            "prefixes": {name: prefixes[name] for name in lists},
+            "out_prefix": out_spec,
+            "list_files": None,
+            "out_list_files": 0,
+            "status": "started"
+        }
+        stats[stats_key] = my_stats
+
+    out_list.add_many(items)
+    out_list.close()
+
+    t1 = time.time()
+    if stats is not None:
+        my_stats.update({
+            "elapsed": t1-t0,
+            "end_time": t1,
+            "list_files": {name: sum(ps[name] for ps in partition_stats.values()) for name in lists},
+            "out_list_files": sum(ps["out"] for ps in partition_stats.values()),
+            "partitions": [dict(partition=i, **partition_stats[i]) for i in sorted(partition_stats)],
+            "status": "done"
+        })
+        stats[stats_key] = my_stats
+
 def main():
     import getopt
 
     t0 = time.time()
 
-    opts, args = getopt.getopt(sys.argv[1:], "s:S:zf")
+    opts, args = getopt.getopt(sys.argv[1:], "s:S:zZ:fj:e:", ["mem-budget="])
     opts = dict(opts)
-    
 
+    if "-e" in opts and "-f" in opts:
+        print("-e can not be used with -f")
+        sys.exit(2)
+
+    if "-e" in opts and len(args) >= 2:
+        return evaluate(opts["-e"], args, opts, t0)
 
     if len(args) < 4:
         cmd = sys.argv[0].rsplit("/", 1)[-1]
@@ -28,8 +108,11 @@ def main():
 
     stats_file = opts.get("-s")
     stats_key = opts.get("-S", "join")
-    compress = "-z" in opts
+    compress = opts.get("-Z") or ("-z" in opts)
     single_file = "-f" in opts
+    workers = int(opts.get("-j", 1))
+    mem_budget = parse_size(opts["--mem-budget"]) if "--mem-budget" in opts else None
+    partition_stats = {}
 
     my_stats = stats = None
 
@@ -38,14 +121,23 @@ def main():
     if single_file:
         a_list = PartitionedList.open(files=[a_spec])
         b_list = PartitionedList.open(files=[b_spec])
-        out_list = PartitionedList.create_file(out_spec)
     else:
         a_list = PartitionedList.open(prefix=a_spec)
         b_list = PartitionedList.open(prefix=b_spec)
         if a_list.NParts != b_list.NParts:
             print("Inconsistent number of parts: %s:%d: %s:%d" % (a_spec, a_list.NParts, b_spec, b_list.NParts))
             sys.exit(1)
-        out_list = PartitionedList.create(a_list.NParts, out_spec)
+
+    try:
+        items = cmp2_generator(a_list, b_list, op, workers=workers, mem_budget=mem_budget, partition_stats=partition_stats)
+    except ManifestError as e:
+        print(e)
+        sys.exit(1)
+
+    if single_file:
+        out_list = PartitionedList.create_file(out_spec, compress)
+    else:
+        out_list = PartitionedList.create(a_list.NParts, out_spec, compress)
         
     if stats_file is not None:
         stats = Stats(stats_file)
@@ -75,38 +167,12 @@ def main():
         }
         stats[stats_key] = my_stats
 
-    n_a_files = 0
-    n_b_files = 0
-    n_out_files = 0
-    
-    for pa, pb in zip(a_list.parts(), b_list.parts()):
-        b_set = set(pb)
-        n_b_files += len(b_set)
-        for f in pa:
-            n_a_files += 1
-            if op == "and":
-                if f in b_set:
-                    out_list.add(f)
-                    n_out_files += 1
-            elif op == "minus":
-                if not f in b_set:
-                    out_list.add(f)
-                    n_out_files += 1
-            elif op == "xor":
-                if f in b_set:
-                    b_set.remove(f)
-                else:
-                    out_list.add(f)
-                    n_out_files += 1
-            elif op == "or":
-                if f in b_set:
-                    b_set.remove(f)
-                out_list.add(f)
-                n_out_files += 1                
-        if op in ("or", "xor"):
-            for f in b_set:
-                out_list.add(f)
-                n_out_files += 1
+    out_list.add_many(items)
+    out_list.close()
+
+    n_a_files = sum(ps["a"] for ps in partition_stats.values())
+    n_b_files = sum(ps["b"] for ps in partition_stats.values())
+    n_out_files = sum(ps["out"] for ps in partition_stats.values())
                 
     t1 = time.time()
     
@@ -116,7 +182,8 @@ def main():
             "end_time": t1,
             "a_list_files": n_a_files,
             "b_list_files": n_b_files,
-            "join_list_files": join_list_files,
+            "join_list_files": n_out_files,
+            "partitions": [dict(partition=i, **partition_stats[i]) for i in sorted(partition_stats)],
             "status": "done"
         })
         stats[stats_key] = my_stats
@@ -1,12 +1,36 @@
-import random, string, sys, glob, time, gzip, os
+import random, string, sys, glob, time, os
 
-from rucio_consistency import PartitionedList, cmp3_generator, Stats
+from rucio_consistency import PartitionedList, cmp3_generator, AbortGuard, ComparisonAborted, Stats, validate_lists, ManifestError
+from rucio_consistency.compression import open_compressed, compressed_path
+from rucio_consistency.hll import parse_size
+from rucio_consistency.rescache import ResultCache, DefaultMaxSize
+from rucio_consistency.cmplib import sample_partitions, sample_estimate, aborted_stats
 
 Version = "1.1"
 
 Usage = """
-%s [-z] [-s <stats file> [-S <stats key>]] <b prefix> <r prefix> <a prefix> <dark output> <missing output>
-"""
+%%s [-z|-Z <codec>[:<level>[:<threads>]]] [-R <depth>] [-j <N>] [--mem-budget <size>] [--engine <engine>] [--cache <dir> [--cache-size <size>]] [--max-dark <fraction>] [--max-missing <fraction>] [--estimate <K>] [-s <stats file> [-S <stats key>]] <b prefix> <r prefix> <a prefix> <dark output> <missing output>
+
+    -R <depth> - read input partitions ahead in background threads, keeping up to <depth> batches of items per partition,
+                 0 - disable read-ahead, default: %d
+    -j <N>     - compare up to N partitions in parallel worker processes
+    --mem-budget <size> - memory budget, e.g. 16G. Partitions estimated to need more memory are split into sub-partitions
+                 in $TMPDIR and compared one at a time. With -j, also limits the partitions compared at the same time
+    --engine (set|dirset|digest|merge[:<run size>]) - comparison engine: "set" (default) - Python sets of items, 
+                 "dirset" - sets with the directory parts of the items stored once, uses several times less memory, but slower,
+                 "digest" - NumPy arrays of item digests, uses several times less memory, requires numpy,
+                 "merge" - merge sorted streams of items, uses about 3 x <run size> of memory (default 64M) regardless
+                 of the partition size, sorting partitions not in sorted format with temporary files in $TMPDIR
+    --cache <dir> - keep the results of each partition in the directory and reuse them when the comparison is repeated
+                 with partitions of the same contents, so that only the partitions with changed inputs are compared
+    --cache-size <size> - maximum size of the cache, least recently used results are removed, default: %s
+    --max-dark <fraction>, --max-missing <fraction> - abort the comparison as soon as the fraction of dark items among the scanned
+                 items, or of missing items among the items of the DB dump after the scan, is confidently above the limit, e.g. 0.1.
+                 The fractions are estimated after each compared partition. The stats status is set to "aborted"
+    --estimate <K> - compare only K partitions chosen at random and extrapolate the numbers of dark and missing items to all
+                 the partitions, with 95%% confidence intervals, which are stored in the stats as "estimate". The output files
+                 contain only the items found in the sampled partitions. The stats status is set to "estimated"
+""" % (PartitionedList.DefaultReadAhead, "%dG" % (DefaultMaxSize//(1024*1024*1024),))
 
 
 def getMemory():
@@ -27,7 +51,7 @@ def main():
 
         t0 = time.time()
 
-        opts, args = getopt.getopt(sys.argv[1:], "s:S:z")
+        opts, args = getopt.getopt(sys.argv[1:], "s:S:zZ:R:j:", ["mem-budget=", "engine=", "cache=", "cache-size=", "max-dark=", "max-missing=", "estimate="])
         opts = dict(opts)
 
         if len(args) < 5:
@@ -37,16 +61,29 @@ def main():
             print(Usage % (cmd,))
             sys.exit(2)
 
-        compress = "-z" in opts
+        compress = opts.get("-Z") or ("-z" in opts)
+        readahead = int(opts.get("-R", PartitionedList.DefaultReadAhead))
         stats_file = opts.get("-s")
         stats_key = opts.get("-S", "cmp3")
         stats = Stats(stats_file) if stats_file else None
+        workers = int(opts.get("-j", 1))
+        mem_budget = parse_size(opts["--mem-budget"]) if "--mem-budget" in opts else None
+        partition_stats = {}
+        engine = opts.get("--engine", "set")
+        cache = None
+        if "--cache" in opts:
+            cache = ResultCache(opts["--cache"], parse_size(opts["--cache-size"]) if "--cache-size" in opts else DefaultMaxSize)
+        guard = None
+        if "--max-dark" in opts or "--max-missing" in opts:
+            guard = AbortGuard(float(opts["--max-dark"]) if "--max-dark" in opts else None,
+                               float(opts["--max-missing"]) if "--max-missing" in opts else None)
 
         b_prefix, r_prefix, a_prefix, out_dark, out_missing = args
 
-        a_list = PartitionedList.open(a_prefix)
-        r_list = PartitionedList.open(r_prefix)
-        b_list = PartitionedList.open(b_prefix)
+        a_list = PartitionedList.open(a_prefix, readahead=readahead)
+        r_list = PartitionedList.open(r_prefix, readahead=readahead)
+        b_list = PartitionedList.open(b_prefix, readahead=readahead)
+        partitions = sample_partitions(r_list.NParts, int(opts["--estimate"])) if "--estimate" in opts else None
 
         my_stats= {
                 "version": Version,
@@ -77,28 +114,50 @@ def main():
         if stats is not None:
             stats[stats_key] = my_stats
 
-        if compress:
-            if not out_dark.endswith(".gz"):    out_dark += ".gz"
-            if not out_missing.endswith(".gz"):    out_missing += ".gz"
-            fd = gzip.open(out_dark, "wt")
-            fm = gzip.open(out_missing, "wt")
-        else:
-            fd = open(out_dark, "w")
-            fm = open(out_missing, "w")
+        try:
+            validate_lists(a_list, r_list, b_list)
+        except ManifestError as e:
+            print(e)
+            my_stats.update({
+                "status": "failed",
+                "error": str(e),
+                "end_time": time.time()
+            })
+            if stats is not None:
+                stats[stats_key] = my_stats
+            sys.exit(1)
+
+        out_dark = compressed_path(out_dark, compress)
+        out_missing = compressed_path(out_missing, compress)
+        fd = open_compressed(out_dark, "wt", compress)
+        fm = open_compressed(out_missing, "wt", compress)
 
-        diffs = cmp3_generator(a_list, r_list, b_list)
+        diffs = cmp3_generator(a_list, r_list, b_list, batches=True, workers=workers, mem_budget=mem_budget, partition_stats=partition_stats,
+                    engine=engine, cache=cache, guard=guard, partitions=partitions)
         nm = nd = 0
-        for t, path in diffs:
-            if t == 'd':
-                fd.write(path)
-                nd += 1
-            else:
-                fm.write(path)
-                nm += 1
-        fd.close()
-        fm.close()
+        try:
+            for t, path in diffs:
+                if t == 'd':
+                    fd.write(path + "\n")
+                    nd += 1
+                else:
+                    fm.write(path + "\n")
+                    nm += 1
+        except ComparisonAborted as e:
+            print(e)
+            my_stats.update(aborted_stats(e, partition_stats, nd, nm), end_time=time.time())
+            if stats is not None:
+                stats[stats_key] = my_stats
+            sys.exit(1)
+        finally:
+            fd.close()
+            fm.close()
 
         print("Found %d dark and %d missing replicas" % (nd, nm))
+        status = "done"
+        if partitions is not None:
+            status = "estimated" if len(partitions) < r_list.NParts else "done"
+            my_stats["estimate"] = sample_estimate(partition_stats, partitions, r_list.NParts, ("dark", "missing"))
         t1 = time.time()
         
         my_stats.update({
@@ -106,9 +165,11 @@ def main():
                 "end_time": t1,
                 "missing": nm,
                 "dark": nd,
-                "status": "done",
+                "status": status,
                 "missing_list_file": out_missing,
-                "dark_list_file": out_dark
+                "dark_list_file": out_dark,
+                "cached_partitions": sum(1 for ps in partition_stats.values() if ps.get("cached")),
+                "partitions": [dict(partition=i, **partition_stats[i]) for i in sorted(partition_stats)]
             })
                 
         if stats is not None:
@@ -0,0 +1,74 @@
+import sys, os, time, getopt, random, tempfile, uuid
+
+from rucio_consistency.compression import get_codec, Codecs
+
+Usage = """
+%(cmd)s [options] [<codec spec> ...]
+    -n <N lines>    - number of generated LFN-like lines, default 1000000
+    -i <file>       - use lines from the file instead of generated ones
+    -d <directory>  - directory for temporary files, default: system temporary directory
+
+    <codec spec> is <codec>[:<level>[:<threads>]], e.g. gzip:6:4. Default: set of available codecs with typical settings
+"""
+
+def generate_lfns(n):
+    # generates lines looking like CMS LFNs, with many shared directory prefixes
+    rnd = random.Random(0)
+    campaigns = ["RunIISummer20UL%d" % (y,) for y in (16, 17, 18)] + ["Run3Summer22", "Run3Summer23"]
+    tiers = ["MINIAODSIM", "NANOAODSIM", "AODSIM", "GEN-SIM"]
+    datasets = ["Sample%03d_TuneCP5_13TeV-pythia8" % (i,) for i in range(200)]
+    lines = []
+    while len(lines) < n:
+        directory = "/store/mc/%s/%s/%s/106X_v%d-v%d/%d" % (rnd.choice(campaigns), rnd.choice(datasets), rnd.choice(tiers),
+                rnd.randint(1, 20), rnd.randint(1, 3), rnd.randint(10000, 99999))
+        for _ in range(rnd.randint(1, 200)):
+            lines.append("%s/%s.root\n" % (directory, str(uuid.UUID(int=rnd.getrandbits(128))).upper()))
+    return lines[:n]
+
+def bench(codec, data, tmpdir):
+    path = os.path.join(tmpdir, "codec_bench" + codec.Extension)
+    chunk = 1024*1024
+    t0 = time.time()
+    f = codec.open_write(path)
+    for i in range(0, len(data), chunk):
+        f.write(data[i:i+chunk])
+    f.close()
+    t1 = time.time()
+    f = codec.open_read(path)
+    while f.read(chunk):
+        pass
+    f.close()
+    t2 = time.time()
+    size = os.path.getsize(path)
+    os.remove(path)
+    return t1 - t0, t2 - t1, size
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], "n:i:d:h")
+    opts = dict(opts)
+    if "-h" in opts:
+        cmd = sys.argv[0].rsplit("/", 1)[-1]
+        print(Usage % {"cmd":cmd})
+        sys.exit(2)
+
+    if "-i" in opts:
+        data = open(opts["-i"], "rb").read()
+    else:
+        data = "".join(generate_lfns(int(opts.get("-n", 1000000)))).encode("utf-8")
+    tmpdir = opts.get("-d", tempfile.gettempdir())
+
+    threads = os.cpu_count() or 1
+    specs = args or (["none", "gzip:1", "gzip:6", "gzip:9", "gzip:6:%d" % (threads,)]
+            + (["zstd:3", "zstd:3:%d" % (threads,), "zstd:9"] if Codecs["zstd"].Available else [])
+            + (["lz4"] if Codecs["lz4"].Available else []))
+
+    mb = len(data)/1024/1024
+    print("Input: %.1f MB" % (mb,))
+    print("%-14s %12s %12s %8s" % ("codec", "write MB/s", "read MB/s", "ratio"))
+    for spec in specs:
+        codec = get_codec(spec)
+        tw, tr, size = bench(codec, data, tmpdir)
+        print("%-14s %12.1f %12.1f %8.2f" % (spec, mb/tw, mb/tr, len(data)/size))
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,8 @@ from sqlalchemy.types import TypeDecorator, CHAR, String
 from sqlalchemy.exc import ArgumentError
 
 from rucio_consistency import PartitionedList, DBConfig, CEConfiguration, Stats
+from rucio_consistency.part import splittable_nparts
+from rucio_consistency.hll import AutoNPartsOptions, nparts_from_options, auto_nparts_usage
 
 Version = "2.0"
 
@@ -28,7 +30,14 @@ Usage = """
         use "*" for state to send all the files to the output set ( -f *:/path )
     -l -- include more columns, otherwise physical path only, automatically on if -a is used
     -z -- produce gzipped output
-    -s <stats file> -- write stats into JSON file
+    -Z <codec>[:<level>[:<threads>]] - compress output with the codec: gzip, zstd or lz4, e.g. gzip:6:4
+    -b -- produce output in binary format
+    -O -- produce output sorted and front-coded
+    -I -- with gzip compression, write the output with access point index, so that partitions can be read in parallel
+    -P -- round the number of partitions up to a power of 2
+    -B <fp rate> -- build Bloom filters for the output partitions with the false positive rate, e.g. 0.01
+    -H <hash> -- hash function used to assign files to partitions: adler32 (default), crc32 or blake2b64
+""" + auto_nparts_usage() + """    -s <stats file> -- write stats into JSON file
        -S <key> -- add dump stats to stats under the key
     -r <file>   -- file counts per root and store in the file as JSON structure with file counts
     -m <N files> -- stop after N files
@@ -87,7 +96,7 @@ class GUID(TypeDecorator):
             return str(uuid.UUID(value)).replace('-', '').lower()
 
 def main():
-    opts, args = getopt.getopt(sys.argv[1:], "f:c:ln:vd:s:S:zm:r:")
+    opts, args = getopt.getopt(sys.argv[1:], "f:c:ln:vd:s:S:zZ:m:r:bOIPB:H:", AutoNPartsOptions)
 
     filters = {}
     all_states = set()
@@ -109,7 +118,10 @@ def main():
     verbose = "-v" in opts
     long_output = "-l" in opts
     out_prefix = opts.get("-o")
-    zout = "-z" in opts
+    zout = opts.get("-Z") or ("-z" in opts)
+    out_format = "binary" if "-b" in opts else ("sorted" if "-O" in opts else "text")
+    bloom_fp = float(opts["-B"]) if "-B" in opts else None
+    hash_name = opts.get("-H")
     stats_file = opts.get("-s")
     stats_key = opts.get("-S", "db_dump")
     stop_after = int(opts.get("-m", 0)) or None
@@ -167,6 +179,13 @@ def main():
                 nparts = int(opts["-n"])
         else:
                 nparts = config.NPartitions
+        try:
+                nparts = nparts_from_options(opts) or nparts
+        except ValueError as e:
+                print("Number of partitions can not be chosen automatically:", e, file=sys.stderr)
+                sys.exit(2)
+        if "-P" in opts:
+                nparts = splittable_nparts(nparts)
 
         subdir = config.DBDumpPathRoot
         if not subdir.endswith("/"):    subdir = subdir + "/"
@@ -196,7 +215,8 @@ def main():
         batch = 100000
 
         outputs = {
-            states:PartitionedList.create(nparts, prefix, zout) for states, prefix in filters.items()
+            states:PartitionedList.create(nparts, prefix, zout, format=out_format, bloom_fp=bloom_fp, hash_name=hash_name, sketch=True,
+                        gzip_index="-I" in opts) for states, prefix in filters.items()
         }
 
         all_replicas = '*' in all_states
@@ -287,7 +307,9 @@ def main():
                 "ignored_files":ignored_files,
                 "elapsed":t1-t0,
                 "directories":len(dirs),
-                "ignore_list":ignore_list
+                "ignore_list":ignore_list,
+                "partition_skew":{prefix:outputs[states].skew() for states, prefix in filters.items()},
+                "distinct_estimate":{prefix:outputs[states].Sketch.estimate() for states, prefix in filters.items()}
             })
         if root_file_counts_out is not None:
             root_file_counts_out.write(json.dumps(root_file_counts, indent=4, sort_keys=True))
@@ -0,0 +1,43 @@
+import sys, time, getopt
+
+from rucio_consistency import PartitionedList
+from rucio_consistency.hll import parse_size
+from rucio_consistency.gzindex import ChunkSize
+
+Usage = """
+%(cmd)s [options] <prefix> ...
+    Builds gzip access point indexes for the partitions of existing gzip-compressed text partitioned lists, so that large partitions
+    can be read by several threads or workers in parallel. Partition files without enough access points, e.g. written by gzip
+    as a single member, are not indexed unless -w is used.
+    -w                  - rewrite partition files without enough access points in place, as sequences of gzip members
+                          with the same contents
+    -c <chunk size>     - minimum amount of uncompressed data between access points, e.g. 8M, default: %(chunk)dM
+    -n <workers>        - count the items using the index with the number of worker processes and print the count
+"""
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], "wc:n:")
+    opts = dict(opts)
+    if not args:
+        cmd = sys.argv[0].rsplit("/", 1)[-1]
+        if cmd.endswith(".py"):
+            cmd = "python " + cmd
+        print(Usage % {"cmd":cmd, "chunk":ChunkSize//1024//1024})
+        sys.exit(2)
+
+    chunk_size = parse_size(opts["-c"]) if "-c" in opts else ChunkSize
+    for prefix in args:
+        t0 = time.time()
+        lst = PartitionedList.open(prefix)
+        lst.validate()
+        n, skipped = lst.build_gzip_index(chunk_size, rewrite="-w" in opts)
+        print("%s: %d of %d partition files indexed in %.1fs" % (prefix, n, lst.NParts, time.time() - t0))
+        for path in skipped:
+            print("%s: not enough access points, not indexed (use -w to rewrite the file)" % (path,), file=sys.stderr)
+        if "-n" in opts:
+            t0 = time.time()
+            count = PartitionedList.open(prefix).count(int(opts["-n"]))
+            print("%s: %d items counted in %.1fs" % (prefix, count, time.time() - t0))
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 from rucio_consistency import PartitionedList, CEConfiguration
+from rucio_consistency.part import splittable_nparts
+from rucio_consistency.hll import AutoNPartsOptions, nparts_from_options, auto_nparts_usage
 import sys, getopt, re, gzip
 try:
     import tqdm
@@ -16,11 +18,18 @@ Optional:
             -r <rse> - RSE name - to use RSE-specific configuration, ignored if -c is not used
             -n <nparts> - override the value from the <config file>
             -z - use gzip compression for output
-"""
+            -Z <codec>[:<level>[:<threads>]] - compress output with the codec: gzip, zstd or lz4, e.g. gzip:6:4
+            -b - write output in binary format
+            -O - write output sorted and front-coded
+            -I - with gzip compression, write the output with access point index, so that partitions can be read in parallel
+            -P - round the number of partitions up to a power of 2, so that the list can be split or merged with rce_repartition
+            -B <fp rate> - build Bloom filters for the output partitions with the false positive rate, e.g. 0.01
+            -H <hash> - hash function used to assign items to partitions: adler32 (default), crc32 or blake2b64
+""" + auto_nparts_usage(" "*12)
 
 
 def main():
-    opts, args = getopt.getopt(sys.argv[1:], "n:o:c:qr:z")
+    opts, args = getopt.getopt(sys.argv[1:], "n:o:c:qr:zZ:bOIPB:H:", AutoNPartsOptions)
     opts = dict(opts)
     if not args or not ("-o" in opts):
         cmd = sys.argv[0].rsplit("/", 1)[-1]
@@ -39,47 +48,65 @@ def main():
         config = CEConfiguration(cfg)[rse]
         ignore_list = config.IgnoreList
         nparts = config.NPartitions
-    zout = "-z" in opts
-    nparts = int(opts.get("-n", nparts))
+    zout = opts.get("-Z") or ("-z" in opts)
+    out_format = "binary" if "-b" in opts else ("sorted" if "-O" in opts else "text")
+    bloom_fp = float(opts["-B"]) if "-B" in opts else None
+    hash_name = opts.get("-H")
+    if "-n" in opts:
+        nparts = int(opts["-n"])
+    try:
+        nparts = nparts_from_options(opts) or nparts
+    except ValueError as e:
+        print("Number of partitions can not be chosen automatically:", e, file=sys.stderr)
+        sys.exit(2)
     
     if nparts is None:
         print("N parts must be specified either with -n or via the -c <config> and -r <rse>")
         print(Usage)
         sys.exit(2)
+    if "-P" in opts:
+        nparts = splittable_nparts(nparts)
     
     in_lst = PartitionedList.open(files=args)
-    out_lst = PartitionedList.create(nparts, out_prefix, zout)
+    out_lst = PartitionedList.create(nparts, out_prefix, zout, format=out_format, bloom_fp=bloom_fp, hash_name=hash_name, sketch=True,
+                    gzip_index="-I" in opts)
 
     #print("ignore list:", ignore_list)
     
-    for path in in_lst:
-        if starts_with and not path.startswith(starts_with):    continue
-        for ignore_path in ignore_list:
-            #print(f"checking path {path} for ignore path {ignore_path}")
-            if path.startswith(ignore_path):
-                ignore=True
-                break
-        else:
-            ignore=False
-        if ignore: continue
-        if filter_in is not None and not filter_in.search(path): continue
-        if remove_prefix is not None:
-            if not path.startswith(remove_prefix):
-                sys.stderr.write(f"Path {path} does not begin with prefix {remove_prefix}\n")
-                sys.exit(1)
-            path = path[len(remove_prefix):]
-        if add_prefix:
-            path = add_prefix + path
-        if rewrite_match is not None:
-            if not rewrite_match.search(path):
-                sys.stderr.write(f"Path rewrite pattern did not find a match in path {path}\n")
-                sys.exit(1)
-            path = rewrite_match.sub(rewrite_out, path)
-        #print("path:", type(path), path)
-        out_lst.add(path)
+    def paths():
+        for path in in_lst:
+            if starts_with and not path.startswith(starts_with):    continue
+            for ignore_path in ignore_list:
+                #print(f"checking path {path} for ignore path {ignore_path}")
+                if path.startswith(ignore_path):
+                    ignore=True
+                    break
+            else:
+                ignore=False
+            if ignore: continue
+            if filter_in is not None and not filter_in.search(path): continue
+            if remove_prefix is not None:
+                if not path.startswith(remove_prefix):
+                    sys.stderr.write(f"Path {path} does not begin with prefix {remove_prefix}\n")
+                    sys.exit(1)
+                path = path[len(remove_prefix):]
+            if add_prefix:
+                path = add_prefix + path
+            if rewrite_match is not None:
+                if not rewrite_match.search(path):
+                    sys.stderr.write(f"Path rewrite pattern did not find a match in path {path}\n")
+                    sys.exit(1)
+                path = rewrite_match.sub(rewrite_out, path)
+            #print("path:", type(path), path)
+            yield path
+
+    out_lst.add_many(paths())
     out_lst.close()
     
     print(out_lst.NWritten)
+    if "-q" not in opts:
+        skew = out_lst.skew()
+        print("Partition sizes: min: %(min)d, max: %(max)d, mean: %(mean).1f, stddev: %(stddev).1f, max/mean: %(max_mean).3f" % skew)
     
    
 if __name__ == "__main__":
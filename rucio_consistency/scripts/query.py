@@ -0,0 +1,78 @@
+import sys, os, time, getopt
+
+from rucio_consistency import PartitionedList
+from rucio_consistency import columns
+
+Usage = """
+%(cmd)s [options] <list> [<list> ...] [-- <item> ...]
+    Checks whether the items are in the lists. Each <list> is either a partitioned list prefix or a single list file, e.g. dark list
+    produced by the comparison. Missing or stale hash indexes of the lists are built first, which requires reading the list once.
+
+    -i <file>       - read items from the file, one per line, "-" - from stdin
+    -f              - print only the items found in at least one list
+    -m              - print only the items not found in any list
+    -l              - print partition file and line number (record number for binary files) where the item was found
+    -b              - only build missing or stale hash indexes and exit
+    -r              - rebuild all hash indexes
+    -c <column>     - also print value of the column, e.g. "size", for each list where the item was found, as <list>:<value>
+
+    For each item, prints the item followed by the lists containing it, or "-" if the item is not in any list
+"""
+
+def open_list(spec):
+    if os.path.isfile(spec):
+        return PartitionedList.open(files=[spec])
+    return PartitionedList.open(spec)
+
+def main():
+    opts, args = getopt.getopt(sys.argv[1:], "i:fmlbrc:")
+    opts = dict(opts)
+    items = []
+    if "--" in args:
+        items = args[args.index("--")+1:]
+        args = args[:args.index("--")]
+
+    if not args:
+        cmd = sys.argv[0].rsplit("/", 1)[-1]
+        if cmd.endswith(".py"):
+            cmd = "python " + cmd
+        print(Usage % {"cmd":cmd})
+        sys.exit(2)
+
+    lists = []
+    for spec in args:
+        lst = open_list(spec)
+        t0 = time.time()
+        n = lst.build_hash_index(force="-r" in opts)
+        if n:
+            print("%s: %d of %d partitions indexed in %.1fs" % (spec, n, lst.NParts, time.time() - t0), file=sys.stderr)
+        lists.append((spec, lst))
+    if "-b" in opts:
+        return
+
+    if "-i" in opts:
+        f = sys.stdin if opts["-i"] == "-" else open(opts["-i"], "r")
+        items += [l.strip() for l in f if l.strip()]
+
+    column = opts.get("-c")
+    found = {item: [] for item in items}
+    for spec, lst in lists:
+        loaded = {}
+        for item, i, record in lst.locate(items):
+            if record is not None:
+                where = "%s:%d" % (lst.FileNames[i], record) if "-l" in opts else spec
+                if column:
+                    if i not in loaded:
+                        loaded[i] = lst.column(column, i)
+                    value = loaded[i][record]
+                    where += ":" + ("-" if value == columns.Missing else str(value))
+                found[item].append(where)
+
+    for item in items:
+        where = found[item]
+        if "-f" in opts and not where or "-m" in opts and where:
+            continue
+        print(item, " ".join(where) or "-")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import sys, time, getopt
+
+from rucio_consistency import PartitionedList, Stats
+from rucio_consistency.part import repartition
+
+Version = "1.0"
+
+Usage = """
+%(cmd)s [options] (-n <nparts>|-d|-H) <input prefix> <output prefix>
+    -n <nparts>     - new number of partitions, must be a multiple or a divisor of the current number of partitions
+    -d              - double the number of partitions
+    -H              - halve the number of partitions
+    -j <workers>    - number of parallel worker processes, default: number of CPUs
+    -z              - compress the output with gzip, default: compress the same way as the input
+    -Z <codec>[:<level>[:<threads>]] - compress the output with the codec: gzip, zstd or lz4
+    -b              - write the output in binary format, default: same format as the input
+    -O              - write the output sorted and front-coded, default: same format as the input
+    -s <stats file> [-S <stats key>] - write stats into JSON file under the key, default key: "repartition"
+"""
+
+def main():
+    t0 = time.time()
+    opts, args = getopt.getopt(sys.argv[1:], "n:dHj:zZ:bOs:S:")
+    opts = dict(opts)
+
+    if len(args) != 2 or not ("-n" in opts or "-d" in opts or "-H" in opts):
+        cmd = sys.argv[0].rsplit("/", 1)[-1]
+        if cmd.endswith(".py"):
+            cmd = "python " + cmd
+        print(Usage % {"cmd":cmd})
+        sys.exit(2)
+
+    in_prefix, out_prefix = args
+    in_list = PartitionedList.open(in_prefix)
+    in_list.validate()
+    n_in = in_list.NParts
+
+    if "-d" in opts:
+        nparts = n_in * 2
+    elif "-H" in opts:
+        if n_in % 2:
+            print("Can not halve odd number of partitions:", n_in)
+            sys.exit(2)
+        nparts = n_in // 2
+    else:
+        nparts = int(opts["-n"])
+
+    workers = int(opts.get("-j", 0)) or None
+    compressed = opts.get("-Z") or (True if "-z" in opts else None)
+    format = "binary" if "-b" in opts else ("sorted" if "-O" in opts else None)
+    stats_file = opts.get("-s")
+    stats_key = opts.get("-S", "repartition")
+    stats = Stats(stats_file) if stats_file else None
+
+    my_stats = {
+        "version": Version,
+        "start_time": t0,
+        "end_time": None,
+        "elapsed": None,
+        "in_prefix": in_prefix,
+        "out_prefix": out_prefix,
+        "in_nparts": n_in,
+        "out_nparts": nparts,
+        "files": None,
+        "status": "started"
+    }
+    if stats is not None:
+        stats[stats_key] = my_stats
+
+    manifest = repartition(in_list, out_prefix, nparts, workers=workers, compressed=compressed, format=format)
+    in_list.close()
+
+    t1 = time.time()
+    my_stats.update({
+        "end_time": t1,
+        "elapsed": t1 - t0,
+        "files": manifest.total_count,
+        "status": "done"
+    })
+    if stats is not None:
+        stats[stats_key] = my_stats
+
+    print("Repartitioned %d items from %d into %d partitions" % (manifest.total_count, n_in, nparts))
+    t = int(t1 - t0)
+    print("Elapsed time: %dm%02ds" % (t // 60, t % 60))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Set-algebra expressions over partitioned lists, e.g. "(A & B) - R", "R - (A | B)" or "A ^ B".
+
+Operators, in the order of decreasing precedence, as for Python sets::
+
+    -       difference
+    &       intersection
+    ^       symmetric difference
+    |       union
+
+Operands are names (letters, digits and "_", not starting with a digit) bound to partitioned lists with the same number of partitions.
+A name may be used more than once in the expression. Parentheses can be used to group the sub-expressions.
+
+The expression is evaluated partition by partition, reading each partition of each list once. Every item of the result must be in
+at least one of the "cover" operands of the expression: for "X & Y" - the cover of X or of Y, for "X - Y" - the cover of X, for "X | Y"
+and "X ^ Y" - both covers. For each partition, the cover with the smallest estimated size is read first and its items are kept in
+memory as candidates, then the other operands are streamed and only their membership for the candidates is recorded. The result
+is the candidates for which the expression is true, so the memory used does not depend on the size of the operands outside of the cover.
+"""
+
+import re
+from .cmplib import validate_lists, partition_memory, run_parallel, _sources
+
+_Token = re.compile(r"\s*(?:([A-Za-z_][A-Za-z0-9_]*)|(\S))")
+
+Operators = ("|", "^", "&", "-")        # in the order of increasing precedence
+
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _Token.match(text, pos)
+        name, char = m.groups()
+        if char is not None and char not in Operators and char not in "()":
+            raise ValueError("Unexpected character %r at position %d in expression: %s" % (char, m.start(2), text))
+        tokens.append(name or char)
+        pos = m.end()
+    return tokens
+
+def parse(text):
+    """Parses the expression.
+
+    Returns
+    -------
+    tuple
+        expression tree: ("name", <name>) for an operand or (<operator>, <left tree>, <right tree>)
+
+    Raises
+    ------
+    ValueError
+        if the expression is invalid
+    """
+    tokens = _tokenize(text)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def binary(level):
+        nonlocal pos
+        if level >= len(Operators):
+            return atom()
+        tree = binary(level + 1)
+        while peek() == Operators[level]:
+            pos += 1
+            tree = (Operators[level], tree, binary(level + 1))
+        return tree
+
+    def atom():
+        nonlocal pos
+        token = peek()
+        pos += 1
+        if token == "(":
+            tree = binary(0)
+            if peek() != ")":
+                raise ValueError("Missing ')' in expression: %s" % (text,))
+            pos += 1
+            return tree
+        if token is None or token in Operators or token == ")":
+            raise ValueError("Operand expected %s in expression: %s" % ("at the end" if token is None else "before %r" % (token,), text))
+        return ("name", token)
+
+    tree = binary(0)
+    if pos < len(tokens):
+        raise ValueError("Unexpected %r in expression: %s" % (tokens[pos], text))
+    return tree
+
+def names(tree):
+    """Returns sorted list of the operand names used in the expression tree
+    """
+    if tree[0] == "name":
+        return [tree[1]]
+    return sorted(set(names(tree[1]) + names(tree[2])))
+
+def cover(tree, sizes):
+    """Returns the set of operand names, such that every item of the result of the expression is in one of these operands, with
+    the smallest total size. ``sizes`` is dictionary {name: size}
+    """
+    op = tree[0]
+    if op == "name":
+        return {tree[1]}
+    left = cover(tree[1], sizes)
+    if op == "-":
+        return left
+    right = cover(tree[2], sizes)
+    if op == "&":
+        return min(left, right, key=lambda c: sum(sizes[name] for name in c))
+    return left | right
+
+def _test(tree, mask, bits):
+    # evaluates the expression for an item, which is in the operands with the bits set in the mask
+    op = tree[0]
+    if op == "name":
+        return bool(mask & bits[tree[1]])
+    left, right = _test(tree[1], mask, bits), _test(tree[2], mask, bits)
+    if op == "&":     return left and right
+    if op == "-":     return left and not right
+    if op == "^":     return left != right
+    return left or right
+
+
+class SetExpression(object):
+    """Parsed set-algebra expression, see the module documentation.
+    """
+
+    def __init__(self, text):
+        self.Text = text
+        self.Tree = parse(text)
+        self.Names = names(self.Tree)
+        self.Bits = {name: 1 << i for i, name in enumerate(self.Names)}
+
+    def __str__(self):
+        return self.Text
+
+    def cover(self, sizes):
+        return cover(self.Tree, sizes)
+
+    def evaluate(self, batches, sizes=None):
+        """Evaluates the expression for one partition.
+
+        Parameters
+        ----------
+        batches : dict
+            {name: callable returning iterable of batches (lists) of items} for all the operand names. Each callable is called once
+        sizes : dict or None
+            {name: estimated size} used to choose the operands kept in memory. If None, all the operands are assumed to be of the same size
+
+        Returns
+        -------
+        tuple (out, counts)
+            list of the items in the result and dictionary with the number of items read from each operand
+        """
+        sizes = sizes or dict.fromkeys(self.Names, 1)
+        kept = self.cover(sizes)
+        candidates = {}
+        counts = {}
+        for name in sorted(kept, key=lambda name: sizes[name]):
+            bit = self.Bits[name]
+            n = 0
+            for batch in batches[name]():
+                n += len(batch)
+                for item in batch:
+                    candidates[item] = candidates.get(item, 0) | bit
+            counts[name] = n
+        for name in self.Names:
+            if name in kept:
+                continue
+            bit = self.Bits[name]
+            n = 0
+            for batch in batches[name]():
+                n += len(batch)
+                for item in batch:
+                    mask = candidates.get(item)
+                    if mask is not None:
+                        candidates[item] = mask | bit
+            counts[name] = n
+        results = {}            # {mask: bool}
+        out = []
+        for item, mask in candidates.items():
+            keep = results.get(mask)
+            if keep is None:
+                keep = results[mask] = _test(self.Tree, mask, self.Bits)
+            if keep:
+                out.append(item)
+        return out, counts
+
+
+def _evaluate_task(params):
+    i, text, sources, sizes = params
+    out, counts = SetExpression(text).evaluate(sources, sizes)
+    return i, [f.decode("utf-8") for f in out], counts
+
+def _evaluate_sequential(expression, lists, sizes):
+    names = list(lists)
+    for i, partitions in enumerate(zip(*(lists[name].partitions for name in names))):
+        for p in partitions:
+            p.start(True)       # with read-ahead enabled, read the streamed partitions while the cover is being read
+        out, counts = expression.evaluate({name: p.iter_batches for name, p in zip(names, partitions)}, sizes[i])
+        yield i, [f.decode("utf-8") for f in out], counts
+
+def evaluate_generator(expression, lists, workers=None, mem_budget=None, partition_stats=None):
+    """Evaluates the set-algebra expression over partitioned lists partition by partition, reading each partition of each list once.
+
+    Parameters
+    ----------
+    expression : str or SetExpression
+        e.g. "(A & B) - R"
+    lists : dict
+        {name: PartitionedList} for all the operand names used in the expression
+    workers : int or None
+        If greater than 1, the partitions are processed in parallel worker processes, see ``cmplib.cmp3_generator``
+    mem_budget : int or None
+        With ``workers``, the memory budget for the partitions being processed at the same time, bytes
+    partition_stats : dict or None
+        If given, the numbers of items read from each list and the number of items produced for each partition are stored in
+        ``partition_stats[i]`` as <name> and "out"
+
+    Returns
+    -------
+    generator of str
+        the items in the result. The items of each partition of the result belong to the same partition of the input lists
+
+    Raises
+    ------
+    ValueError
+        if the expression is invalid or uses a name not bound to a list
+    ManifestError
+        if the lists are inconsistent, see ``cmplib.validate_lists``. The lists are validated when the function is called, before
+        the generator is returned, so that the caller can check them before creating the output
+    """
+    if not isinstance(expression, SetExpression):
+        expression = SetExpression(expression)
+    missing = [name for name in expression.Names if name not in lists]
+    if missing:
+        raise ValueError("Lists are not specified for: %s" % (", ".join(missing),))
+    lists = {name: lists[name] for name in expression.Names}
+    validate_lists(*lists.values())
+    return _evaluate_generator(expression, lists, workers, mem_budget, partition_stats)
+
+def _evaluate_generator(expression, lists, workers, mem_budget, partition_stats):
+    memory = {name: partition_memory(lst) for name, lst in lists.items()}
+    nparts = len(memory[expression.Names[0]])
+    sizes = [{name: memory[name][i] for name in lists} for i in range(nparts)]
+
+    if workers and workers > 1:
+        sources = {name: _sources(lst) for name, lst in lists.items()}
+        tasks = [(i, expression.Text, {name: sources[name][i] for name in lists}, sizes[i]) for i in range(nparts)]
+        task_memory = [sum(s[name] for name in expression.cover(s)) for s in sizes]
+        results = run_parallel(_evaluate_task, tasks, workers, task_memory, mem_budget)
+    else:
+        results = _evaluate_sequential(expression, lists, sizes)
+    for i, out, counts in results:
+        if partition_stats is not None:
+            partition_stats.setdefault(i, {}).update(dict(counts, out=len(out)))
+        yield from out
@@ -1,6 +1,6 @@
 from pythreader import synchronized, ShellCommand, Primitive
 import re, json, os, os.path, traceback
-import subprocess, time, random, gzip
+import subprocess, time, random, gzip, calendar
 from rucio_consistency import to_str
 
 def canonic_path(path):
@@ -49,8 +49,8 @@ class XRootDClient(Primitive):
         # xrdfs ls -l style
         r"""
                 (?P<mask>[drwx-]{4})\s+
-                \d{4}-\d{2}-\d{2}\s+
-                \d{2}:\d{2}:\d{2}\s+
+                (?P<date>\d{4}-\d{2}-\d{2})\s+
+                (?P<time>\d{2}:\d{2}:\d{2})\s+
                 (?P<size>\d+)\s+
                 (?P<path>[^ ]+)
         """,
@@ -60,8 +60,8 @@ class XRootDClient(Primitive):
                 \S+\s+
                 \S+\s+
                 (?P<size>\d+)\s+
-                \d{4}-\d{2}-\d{2}\s+
-                \d{2}:\d{2}:\d{2}\s+
+                (?P<date>\d{4}-\d{2}-\d{2})\s+
+                (?P<time>\d{2}:\d{2}:\d{2})\s+
                 (?P<path>[^ ]+)
         """
     ]
@@ -70,7 +70,7 @@ class XRootDClient(Primitive):
 
     def parse_scan_line(self, line, with_meta):
         """
-        returns (is_file, size, path)
+        returns (is_file, size, path, mtime), mtime is the modification time as UNIX timestamp, or None if not known
 
         dr-x 2021-07-13 04:00:26        4096 /store/unmerged//Run2016B//DoubleEG//MINIAOD//21Feb2020_ver2_UL2016_HIPM-v2//280004
         -r-- 2021-07-02 09:35:03   719124843 /store/unmerged//Run2016B//DoubleEG//MINIAOD//21Feb2020_ver2_UL2016_HIPM-v2//280004//1C576248-6EEF-B74F-A336-D1D5B8E41722.root
@@ -79,23 +79,27 @@ class XRootDClient(Primitive):
         """
         if with_meta:
             line = line.strip()
-            is_file = size = path = None
+            is_file = size = path = mtime = None
             for p in self.Line_Patterns:
                 m = p.match(line)
                 if m:
                     is_file = m.group("mask")[0] != 'd'
                     size = int(m.group("size"))
                     path = canonic_path(m.group("path"))
+                    try:
+                        mtime = calendar.timegm(time.strptime(m.group("date") + " " + m.group("time"), "%Y-%m-%d %H:%M:%S"))
+                    except ValueError:
+                        mtime = None
                     break
             else:
                 return None
         else:
-            size = None
+            size = mtime = None
             path = line.strip()
             last_item = path.rsplit("/",1)[-1]
             is_file = (not last_item in (".", "..")) and "." in last_item
         #print("parse:", line,"->",is_file, size, canonic_path(path))
-        return is_file, size, canonic_path(path)
+        return is_file, size, canonic_path(path), mtime
         
     HostPortRE = re.compile(r"[a-zA-Z-]+(\.[a-zA-Z0-9-]+)*(\:[0-9]+)?")
 
@@ -168,6 +172,7 @@ class XRootDClient(Primitive):
 
     def ls(self, location, recursive, with_meta, timeout=None):
         # returns list of paths relative to the server root, relative paths do start with "/"
+        # dirs: [(path, size), ...], files: [(path, size, mtime), ...], size and mtime are None unless with_meta
         #print(f"scan({location}, rec={recursive}, with_meta={with_meta}):...")
         files = []
         dirs = []
@@ -198,17 +203,17 @@ class XRootDClient(Primitive):
                     if typ == 'f':
                         status = "OK"
                         reason = ""
-                        files = [(location, size)]
+                        files = [(location, size, None)]
             else:
                 lines = [x.strip() for x in out.split("\n")]
                 for l in lines:
                     if not l: continue
                     tup = self.parse_scan_line(l, with_meta)
-                    if not tup or not tup[-1].startswith(location):
+                    if not tup or not tup[2].startswith(location):
                         status = "failed"
                         reason = "Invalid line in output: %s" % (l,)
                         break
-                    is_file, size, path = tup
+                    is_file, size, path, mtime = tup
                     if path.endswith("/."):
                         continue
                     path = canonic_path(path)
@@ -216,7 +221,7 @@ class XRootDClient(Primitive):
                     if self.ServerRoot != '/':
                         path = path[len(self.ServerRoot):]
                     if is_file:
-                        files.append((path, size))
+                        files.append((path, size, mtime))
                     else:
                         dirs.append((path, size))
         finally:
@@ -253,9 +258,9 @@ if __name__ == "__main__":
     if status == "OK":
         print("Files:   ", len(files))
         print("Dirs:    ", len(dirs))
-        for path in dirs:
+        for path, size in dirs:
             print("d", path)
-        for path in files:
-            print("f", path)
+        for path, size, mtime in files:
+            print("f", path, size, mtime)
     
     
@@ -1,10 +1,13 @@
 from pythreader import TaskQueue, Task, DEQueue, PyThread, synchronized, ShellCommand, Primitive
-import re, json, os, os.path, traceback, sys, time, random, gzip
+import re, json, os, os.path, traceback, sys, time, random
 from datetime import datetime, timezone, date
 from hashlib import md5
 
 from rucio_consistency import to_str, Stats, PartitionedList, CEConfiguration, Tracer, DummyTracer
 from rucio_consistency.xrootd import XRootDClient
+from rucio_consistency.part import splittable_nparts
+from rucio_consistency.hll import AutoNPartsOptions, nparts_from_options, auto_nparts_usage
+from rucio_consistency.compression import get_codec, codec_for_path, open_compressed
 
 Version = "6.2.0"
 
@@ -211,7 +214,7 @@ class Scanner(Task):
                     empty_dirs = set()
                     if recursive:
                         empty_dirs = set(p for p, _ in dirs)
-                        for path, _ in files:
+                        for path, _, _ in files:
                             dirpath = self.parent(path)
                             while dirpath and dirpath != '/':
                                 try:                empty_dirs.remove(dirpath)
@@ -226,7 +229,7 @@ class Scanner(Task):
 
             counts = " files: %-8d dirs: %-8d empty: %-8d" % (len(files), len(dirs), empty_dir_count)
             if self.IncludeSizes:
-                total_size = sum(size for _, size in files) + sum(size for _, size in dirs)
+                total_size = sum(size for _, size, _ in files) + sum(size for _, size in dirs)
                 counts += " size: %10.3fGB" % (total_size/GB,)
             self.message("done", stats+counts)
         return "done", dirs, files, empty_dirs, None
@@ -382,15 +385,21 @@ class ScannerMaster(PyThread):
                         self.addDirectoryToScan(logpath, True)
 
             self.NScanned += 1
-            for path, size in files:
+            out_paths = []
+            out_values = []
+            for path, size, mtime in files:
                 with te_tracer["files"]:
                     logpath = self.PathConverter.path_to_logpath(path)
                     self.NFiles += 1
                     if self.FilesOut is not None and not self.file_ignored(logpath):
-                        self.FilesOut.add(logpath)
+                        out_paths.append(logpath)
+                        out_values.append((size, mtime))
                         self.TotalSize += size
                     else:
                         self.IgnoredFiles += 1
+            if out_paths:
+                with te_tracer["add_files"]:
+                    self.FilesOut.add_many(out_paths, out_values)
 
             if empty_dirs:
                 self.NEmptyDirs += len(empty_dirs)
@@ -439,14 +448,24 @@ python xrootd_scanner.py [options] <rse>
     -m <max workers>            - default 5
     -R <recursion depth>        - start using -R at or below this depth (dfault 3)
     -n <nparts>
-    -k                          - do not treat individual directories scan errors as overall scan failure
+    -z                          - compress output with gzip
+    -Z <codec>[:<level>[:<threads>]] - compress output with the codec: gzip, zstd or lz4, e.g. gzip:6:4
+    -b                          - write output in binary format
+    -O                          - write output sorted and front-coded
+    -I                          - with gzip compression, write the output with access point index, so that partitions can be read in parallel
+    -P                          - round the number of partitions up to a power of 2
+    -B <fp rate>                - build Bloom filters for the output partitions with the false positive rate, e.g. 0.01
+    -H <hash>                   - hash function used to assign files to partitions: adler32 (default), crc32 or blake2b64
+""" + auto_nparts_usage() + """    -k                          - do not treat individual directories scan errors as overall scan failure
     -q                          - quiet - only print summary
     -x                          - do not use metadata (ls -l), do not include file sizes
+                                  Otherwise, file sizes and modification times are stored in the columns "size" and "mtime"
+                                  next to the output partitions, unless the output is sorted (-O)
     -M <max_files>              - stop scanning the root after so many files were found
     -s <stats_file>             - write final statistics to JSON file
     -r <root count file>        - JSON file with file counds by root
     -E <n>                      - compile empty directories only event n-th day. n > 0
-    -e <path>                   - output file for empty dits list. Use .gz extension to have it compressed
+    -e <path>                   - output file for empty dits list. Use .gz, .zst or .lz4 extension to have it compressed
     -e count-only               - do not produce empty dirs list, just count them
     -T                          - turn tracing on
 """
@@ -598,7 +617,7 @@ def main():
     import getopt, sys, time
 
     t0 = time.time()    
-    opts, args = getopt.getopt(sys.argv[1:], "t:m:o:R:n:c:vqM:s:S:zkxe:r:E:T")
+    opts, args = getopt.getopt(sys.argv[1:], "t:m:o:R:n:c:vqM:s:S:zZ:kxe:r:E:TbOIPB:H:", AutoNPartsOptions)
     opts = dict(opts)
     
     if len(args) != 1 or not "-c" in opts:
@@ -628,13 +647,23 @@ def main():
     
     stats = None if not stats_file else Stats(stats_file)
     
-    zout = "-z" in opts
+    zout = opts.get("-Z") or ("-z" in opts)
+    out_format = "binary" if "-b" in opts else ("sorted" if "-O" in opts else "text")
+    bloom_fp = float(opts["-B"]) if "-B" in opts else None
+    hash_name = opts.get("-H")
     do_trace = "-T" in opts
     
     if "-n" in opts:
         nparts = int(opts["-n"])
     else:
         nparts = config.NPartitions
+    try:
+        nparts = nparts_from_options(opts) or nparts
+    except ValueError as e:
+        print("Number of partitions can not be chosen automatically:", e, file=sys.stderr)
+        sys.exit(2)
+    if "-P" in opts:
+        nparts = splittable_nparts(nparts)
 
     if nparts > 1:
         if not "-o" in opts:
@@ -644,7 +673,10 @@ def main():
 
     output = opts.get("-o", "out.list")
 
-    out_list = PartitionedList.create(nparts, output, zout)
+    include_sizes = config.IncludeSizes and not "-x" in opts
+    column_names = ["size", "mtime"] if include_sizes and out_format != "sorted" else None
+    out_list = PartitionedList.create(nparts, output, zout, format=out_format, bloom_fp=bloom_fp, hash_name=hash_name, sketch=True,
+                gzip_index="-I" in opts, column_names=column_names)
 
     #
     # Do we need to compute empty dirs ?
@@ -668,14 +700,13 @@ def main():
     print("Empty dirs outut:", "count only" if empty_dirs_count_only else empty_dirs_file)
 
     if empty_dirs_file and compute_empty_dirs:
-        if empty_dirs_file.endswith(".gz"):
-            empty_dirs_out = gzip.open(empty_dirs_file, "wt")
-        else:
-            empty_dirs_out = open(empty_dirs_file, "w")
+        empty_dirs_codec = codec_for_path(empty_dirs_file)
+        if zout and get_codec(zout).Name == empty_dirs_codec.Name:
+            empty_dirs_codec = get_codec(zout)            # use the same level and threads as the files list
+        empty_dirs_out = open_compressed(empty_dirs_file, "wt", empty_dirs_codec)
         
     server = config.Server
     server_root = config.ServerRoot
-    include_sizes = config.IncludeSizes and not "-x" in opts
     if not server_root:
         print(f"Server root is not defined for {rse}. Should be defined as 'server_root'")
         sys.exit(2)
@@ -754,6 +785,8 @@ def main():
                 break
 
         out_list.close()
+        my_stats["partition_skew"] = out_list.skew()
+        my_stats["distinct_estimate"] = out_list.Sketch.estimate()
         if empty_dirs_out is not None:
             empty_dirs_out.close()
 
@@ -29,6 +29,10 @@ setup(
             "rce_cmp5 = rucio_consistency.scripts.cmp5:main",
             "rce_cmp3 = rucio_consistency.scripts.cmp3:main",
             "rce_cmp2 = rucio_consistency.scripts.cmp2:main",
+            "rce_repartition = rucio_consistency.scripts.repartition:main",
+            "rce_codec_bench = rucio_consistency.scripts.codec_bench:main",
+            "rce_gzindex = rucio_consistency.scripts.gzindex:main",
+            "rce_query = rucio_consistency.scripts.query:main",
             "rce_scan = rucio_consistency.xrootd.xrootd_scanner:main"
         ]
     }
@@ -0,0 +1,95 @@
+import pytest
+from array import array
+from rucio_consistency import PartitionedList
+from rucio_consistency.binfmt import BinaryWriter, BinaryReader, HeaderSize
+from rucio_consistency.hashes import get_hash
+
+Items = ["/store/data/run%d/file_%05d.root" % (i % 7, i) for i in range(1000)] + ["/store/ünïcode/файл"]
+
+
+def write_file(path, items, hash_name="adler32", block_size=100, update_count=True):
+    hash_function = get_hash(hash_name)
+    writer = BinaryWriter(open(path, "wb"), 3, 8, hash_name, update_count=update_count)
+    typecode = "I" if hash_name != "blake2b64" else "Q"
+    for i in range(0, len(items), block_size):
+        block = [item.encode("utf-8") for item in items[i:i+block_size]]
+        writer.write_block(block, array(typecode, map(hash_function, block)))
+    writer.close()
+    return writer
+
+@pytest.mark.parametrize("hash_name", ["adler32", "crc32", "blake2b64"])
+def test_round_trip(tmp_path, hash_name):
+    path = str(tmp_path / "part.bin")
+    write_file(path, Items, hash_name)
+    reader = BinaryReader(open(path, "rb"))
+    assert (reader.Index, reader.NParts, reader.Count, reader.HashName) == (3, 8, len(Items), hash_name)
+    assert list(reader.items()) == Items
+    reader.seek(0)
+    hash_function = get_hash(hash_name)
+    records = list(reader.records())
+    assert [item.decode("utf-8") for _, item in records] == Items
+    assert all(h == hash_function(item) for h, item in records)
+    reader.close()
+
+def test_readline(tmp_path):
+    path = str(tmp_path / "part.bin")
+    write_file(path, Items[:10])
+    reader = BinaryReader(open(path, "rb"))
+    lines = iter(reader.readline, "")
+    assert [line.rstrip("\n") for line in lines] == Items[:10]
+    reader.close()
+
+def test_unknown_count(tmp_path):
+    path = str(tmp_path / "part.bin")
+    write_file(path, Items, update_count=False)
+    reader = BinaryReader(open(path, "rb"))
+    assert reader.Count is None
+    assert list(reader.items()) == Items
+    reader.close()
+
+def test_truncated(tmp_path):
+    path = str(tmp_path / "part.bin")
+    write_file(path, Items)
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:-10])
+    reader = BinaryReader(open(path, "rb"))
+    with pytest.raises(ValueError):
+        list(reader.items())
+    reader.close()
+    with open(path, "wb") as f:
+        f.write(data[:HeaderSize-1])
+    with pytest.raises(ValueError):
+        BinaryReader(open(path, "rb"))
+
+def test_count_mismatch(tmp_path):
+    path = str(tmp_path / "part.bin")
+    write_file(path, Items[:10])
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data.replace(b"/store/data/run3", b"/store/data\nrun3"))      # same length, one more item in the block
+    for method in ("items", "records"):
+        reader = BinaryReader(open(path, "rb"))
+        with pytest.raises(ValueError, match="part.bin"):
+            list(getattr(reader, method)())
+        reader.close()
+
+def test_newline_rejected(tmp_path):
+    writer = BinaryWriter(open(str(tmp_path / "part.bin"), "wb"))
+    with pytest.raises(ValueError):
+        writer.write_block([b"/a", b"/b\n/c"], array("I", [1, 2]))
+    with pytest.raises(ValueError):
+        writer.write_block([b"/a", b"/b"], array("I", [1]))
+    writer.close()
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_partitioned_list(tmp_path, compressed):
+    prefix = str(tmp_path / "list")
+    lst = PartitionedList.create(4, prefix, compressed, format="binary", buffer_size=1000)
+    lst.add_many(Items)
+    lst.close()
+    lst = PartitionedList.open(prefix)
+    assert lst.counts() == [len(list(p)) for p in PartitionedList.open(prefix).partitions]
+    assert sorted(lst.items()) == sorted(Items)
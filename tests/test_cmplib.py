@@ -0,0 +1,400 @@
+import json, math, os, subprocess, sys, time, pytest
+from zlib import crc32
+from rucio_consistency import PartitionedList, Stats, digestcmp
+from rucio_consistency.cmplib import cmp3, cmp3_r, cmp5, cmp2, cmp3_generator, cmp5_generator, cmp2_generator, intersection_count, \
+    run_parallel, AbortGuard, ComparisonAborted, aborted_stats, sample_partitions, extrapolate, estimate_totals, sample_estimate
+from rucio_consistency.dirset import DirDictSet
+
+Engines = ["set", "dirset", "merge",
+    pytest.param("digest", marks=pytest.mark.skipif(not digestcmp.available(), reason="numpy is not installed"))]
+
+
+def lfns(numbers):
+    return ["/store/data/run%d/file_%05d.root" % (i % 7, i) for i in numbers]
+
+Cases = {
+    "overlap": {
+        "a": lfns(range(0, 3000)),
+        "r": lfns(range(1000, 4000)) + lfns(range(1000, 1010)),         # duplicate items
+        "b": lfns(range(500, 3500))
+    },
+    "sparse": {                                                         # most partitions are empty
+        "a": lfns([1, 2, 3]),
+        "r": lfns([2, 3, 4]),
+        "b": lfns([3, 4, 5])
+    },
+    "empty": {"a": [], "r": [], "b": []},
+    "empty r": {"a": lfns(range(100)), "r": [], "b": lfns(range(50, 150))}
+}
+
+def make_lists(tmp_path, items, nparts=8, format="text"):
+    lists = {}
+    for name, lst_items in items.items():
+        prefix = str(tmp_path / name.replace(" ", "_"))
+        lst = PartitionedList.create(nparts, prefix, format=format)
+        lst.add_many(lst_items)
+        lst.close()
+        lists[name] = PartitionedList.open(prefix)
+    return lists
+
+def expected_cmp3(items):
+    a, r, b = (set(items[name]) for name in ("a", "r", "b"))
+    return r - a - b, (a & b) - r
+
+Cases5 = {
+    "overlap": {
+        "a_m": lfns(range(0, 3000)),
+        "a_d": lfns(range(0, 3200)),
+        "r": lfns(range(1000, 4000)) + lfns(range(1000, 1010)),
+        "b_m": lfns(range(500, 3500)),
+        "b_d": lfns(range(500, 3600))
+    },
+    "sparse": {
+        "a_m": lfns([1, 2, 3]),
+        "a_d": lfns([1, 2, 3, 6]),
+        "r": lfns([2, 3, 4, 6, 7]),
+        "b_m": lfns([3, 4, 5]),
+        "b_d": lfns([3, 4, 5])
+    },
+    "empty": {"a_m": [], "a_d": [], "r": [], "b_m": [], "b_d": []},
+    "empty r": {"a_m": lfns(range(100)), "a_d": lfns(range(120)), "r": [], "b_m": lfns(range(50, 150)), "b_d": lfns(range(50, 150))}
+}
+
+def expected_cmp5(items):
+    a_m, a_d, r, b_m, b_d = (set(items[name]) for name in ("a_m", "a_d", "r", "b_m", "b_d"))
+    return r - a_d - b_d, (a_m & b_m) - r, len(a_m & b_m)
+
+def run_cmp3(tmp_path, *options):
+    # runs rce_cmp3 on the lists a, r and b made by make_lists, returns the exit status
+    args = [sys.executable, "-m", "rucio_consistency.scripts.cmp3"] + list(options) + \
+        [str(tmp_path / name) for name in ("b", "r", "a")] + [str(tmp_path / "dark.list"), str(tmp_path / "missing.list")]
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return subprocess.run(args, env=env, stdout=subprocess.DEVNULL).returncode
+
+def colliding_digests(batch):
+    # stub for digestcmp._digests: keys of different items collide all the time, check values still tell the items apart
+    np = digestcmp.np
+    n = len(batch)
+    return np.fromiter((len(item) % 3 for item in batch), dtype=np.int64, count=n), np.fromiter(map(crc32, batch), dtype=np.uint32, count=n)
+
+
+@pytest.mark.parametrize("set_factory", [set, DirDictSet])
+@pytest.mark.parametrize("batches", [False, True])
+@pytest.mark.parametrize("case", list(Cases))
+def test_cmp3_functions(case, batches, set_factory):
+    items = Cases[case]
+    d_expected, m_expected = expected_cmp3(items)
+    args = [items[name] for name in ("a", "r", "b")]
+    if batches:
+        args = [[lst[i:i+100] for i in range(0, len(lst), 100)] for lst in args]
+    for function in (cmp3, cmp3_r):
+        d, m = function(*args, batches=batches, set_factory=set_factory)
+        assert sorted(d) == sorted(d_expected)
+        assert sorted(m) == sorted(m_expected)
+    a_and_b, a_minus_b, b_minus_a = cmp2(args[0], args[2], batches=batches, set_factory=set_factory)
+    a, b = set(items["a"]), set(items["b"])
+    assert (set(a_and_b), set(a_minus_b), set(b_minus_a)) == (a & b, a - b, b - a)
+
+@pytest.mark.parametrize("workers", [None, 2])
+@pytest.mark.parametrize("engine", Engines)
+@pytest.mark.parametrize("case", list(Cases))
+def test_cmp3_generator(tmp_path, case, engine, workers):
+    items = Cases[case]
+    lists = make_lists(tmp_path, items)
+    d_expected, m_expected = expected_cmp3(items)
+    partition_stats = {}
+    results = list(cmp3_generator(lists["a"], lists["r"], lists["b"], batches=True, workers=workers, engine=engine,
+                    partition_stats=partition_stats))
+    d = [item for t, item in results if t == "d"]
+    m = [item for t, item in results if t == "m"]
+    assert sorted(d) == sorted(d_expected)
+    assert sorted(m) == sorted(m_expected)
+    assert sorted(partition_stats) == list(range(8))
+    assert sum(ps["dark"] for ps in partition_stats.values()) == len(d_expected)
+    assert sum(ps["missing"] for ps in partition_stats.values()) == len(m_expected)
+    for stream, expected in (("d", d_expected), ("m", m_expected)):
+        assert sorted(cmp3_generator(lists["a"], lists["r"], lists["b"], stream=stream, batches=True, workers=workers, engine=engine)) \
+            == sorted(expected)
+
+@pytest.mark.parametrize("engine", ["set", "dirset"])
+def test_cmp3_generator_items(tmp_path, engine):
+    # the partitions are iterated as str items, not batches
+    items = Cases["overlap"]
+    lists = make_lists(tmp_path, items)
+    d_expected, m_expected = expected_cmp3(items)
+    results = list(cmp3_generator(lists["a"], lists["r"], lists["b"], engine=engine))
+    assert sorted(item for t, item in results if t == "d") == sorted(d_expected)
+    assert sorted(item for t, item in results if t == "m") == sorted(m_expected)
+
+@pytest.mark.parametrize("set_factory", [set, DirDictSet])
+@pytest.mark.parametrize("batches", [False, True])
+@pytest.mark.parametrize("case", list(Cases5))
+def test_cmp5_function(case, batches, set_factory):
+    items = Cases5[case]
+    args = [items[name] for name in ("a_m", "a_d", "r", "b_m", "b_d")]
+    if batches:
+        args = [[lst[i:i+100] for i in range(0, len(lst), 100)] for lst in args]
+    d, m, expected = cmp5(*args, batches=batches, set_factory=set_factory)
+    d_expected, m_expected, n_expected = expected_cmp5(items)
+    assert sorted(d) == sorted(d_expected)
+    assert sorted(m) == sorted(m_expected)
+    assert expected == n_expected
+
+@pytest.mark.parametrize("workers", [None, 2])
+@pytest.mark.parametrize("engine", Engines)
+@pytest.mark.parametrize("case", list(Cases5))
+def test_cmp5_generator(tmp_path, case, engine, workers):
+    items = Cases5[case]
+    lists = make_lists(tmp_path, items)
+    partition_stats = {}
+    results = list(cmp5_generator(*(lists[name] for name in ("a_m", "a_d", "r", "b_m", "b_d")), workers=workers, engine=engine,
+                    partition_stats=partition_stats))
+    d_expected, m_expected, n_expected = expected_cmp5(items)
+    assert sorted(item for t, item in results if t == "d") == sorted(d_expected)
+    assert sorted(item for t, item in results if t == "m") == sorted(m_expected)
+    assert sorted(partition_stats) == list(range(8))
+    assert sum(ps["expected"] for ps in partition_stats.values()) == n_expected
+    assert sum(ps["dark"] for ps in partition_stats.values()) == len(d_expected)
+
+@pytest.mark.parametrize("engine", Engines)
+def test_cmp5_agrees_with_cmp3(tmp_path, engine):
+    # the fused comparison produces the same results as cmp3 applied to each pair of the dumps
+    items = Cases5["overlap"]
+    lists = make_lists(tmp_path, items)
+    results = list(cmp5_generator(*(lists[name] for name in ("a_m", "a_d", "r", "b_m", "b_d")), engine=engine))
+    dark = cmp3_generator(lists["a_d"], lists["r"], lists["b_d"], stream="d", batches=True, engine=engine)
+    missing = cmp3_generator(lists["a_m"], lists["r"], lists["b_m"], stream="m", batches=True, engine=engine)
+    assert sorted(item for t, item in results if t == "d") == sorted(dark)
+    assert sorted(item for t, item in results if t == "m") == sorted(missing)
+
+@pytest.mark.parametrize("workers", [None, 2])
+@pytest.mark.parametrize("engine", Engines)
+@pytest.mark.parametrize("case", list(Cases))
+def test_intersection_count(tmp_path, case, engine, workers):
+    items = Cases[case]
+    lists = make_lists(tmp_path, items)
+    assert intersection_count(lists["a"], lists["r"], workers=workers, engine=engine) == len(set(items["a"]) & set(items["r"]))
+
+@pytest.mark.parametrize("workers", [None, 2])
+@pytest.mark.parametrize("op", ["and", "join", "minus", "xor", "or"])
+@pytest.mark.parametrize("case", list(Cases))
+def test_cmp2_generator(tmp_path, case, op, workers):
+    items = Cases[case]
+    lists = make_lists(tmp_path, items)
+    a, b = set(items["a"]), set(items["b"])
+    expected = {"and": a & b, "join": a & b, "minus": a - b, "xor": a ^ b, "or": a | b}[op]
+    partition_stats = {}
+    assert sorted(cmp2_generator(lists["a"], lists["b"], op, workers=workers, partition_stats=partition_stats)) == sorted(expected)
+    assert sum(ps["out"] for ps in partition_stats.values()) == len(expected)
+    with pytest.raises(ValueError):
+        cmp2_generator(lists["a"], lists["b"], "plus")
+
+@pytest.mark.skipif(not digestcmp.available(), reason="numpy is not installed")
+@pytest.mark.parametrize("case", list(Cases))
+def test_digest_collisions(tmp_path, monkeypatch, case):
+    # with the stub, the items of each partition share 3 keys, so all of them are resolved by comparing the strings
+    monkeypatch.setattr(digestcmp, "_digests", colliding_digests)
+    items = Cases[case]
+    lists = make_lists(tmp_path, items)
+    d_expected, m_expected = expected_cmp3(items)
+    results = list(cmp3_generator(lists["a"], lists["r"], lists["b"], batches=True, engine="digest"))
+    assert sorted(item for t, item in results if t == "d") == sorted(d_expected)
+    assert sorted(item for t, item in results if t == "m") == sorted(m_expected)
+    assert intersection_count(lists["a"], lists["r"], engine="digest") == len(set(items["a"]) & set(items["r"]))
+
+@pytest.mark.skipif(not digestcmp.available(), reason="numpy is not installed")
+@pytest.mark.parametrize("case", list(Cases5))
+def test_digest_collisions_cmp5(tmp_path, monkeypatch, case):
+    monkeypatch.setattr(digestcmp, "_digests", colliding_digests)
+    items = Cases5[case]
+    lists = make_lists(tmp_path, items)
+    partition_stats = {}
+    results = list(cmp5_generator(*(lists[name] for name in ("a_m", "a_d", "r", "b_m", "b_d")), engine="digest",
+                    partition_stats=partition_stats))
+    d_expected, m_expected, n_expected = expected_cmp5(items)
+    assert sorted(item for t, item in results if t == "d") == sorted(d_expected)
+    assert sorted(item for t, item in results if t == "m") == sorted(m_expected)
+    assert sum(ps["expected"] for ps in partition_stats.values()) == n_expected
+
+@pytest.mark.skipif(not digestcmp.available(), reason="numpy is not installed")
+def test_digest_collisions_partial(monkeypatch):
+    # only some of the keys collide: items with equal keys and different check values are flagged, the rest is matched by the keys
+    np = digestcmp.np
+    def digests(batch):
+        n = len(batch)
+        return np.fromiter((hash(item) & 0xfff for item in batch), dtype=np.int64, count=n), np.fromiter(map(crc32, batch), dtype=np.uint32, count=n)
+    monkeypatch.setattr(digestcmp, "_digests", digests)
+    items = {name: [item.encode("utf-8") for item in lst] for name, lst in Cases["overlap"].items()}
+    sources = [lambda lst=items[name]: iter([lst[i:i+100] for i in range(0, len(lst), 100)]) for name in ("a", "r", "b")]
+    d, m = digestcmp.digest_cmp3(*sources)
+    d_expected, m_expected = expected_cmp3(items)
+    assert sorted(d) == sorted(d_expected)
+    assert sorted(m) == sorted(m_expected)
+
+def timed_task(task):
+    # worker function for run_parallel tests: records when it ran
+    i, seconds = task
+    t0 = time.time()
+    time.sleep(seconds)
+    return i, t0, time.time()
+
+def max_concurrency(results):
+    events = sorted([(t0, 1) for _, t0, _ in results] + [(t1, -1) for _, _, t1 in results])
+    n = peak = 0
+    for _, delta in events:
+        n += delta
+        peak = max(peak, n)
+    return peak
+
+@pytest.mark.parametrize("workers, memory, mem_budget, expected", [
+    (3, None, None, 3),
+    (2, [100]*6, None, 2),
+    (4, [100]*6, 250, 2),                   # the budget is tighter than the number of workers
+    (4, [100]*6, 1000, 4)
+])
+def test_run_parallel_concurrency(workers, memory, mem_budget, expected):
+    results = list(run_parallel(timed_task, [(i, 0.3) for i in range(6)], workers, memory, mem_budget))
+    assert sorted(i for i, _, _ in results) == list(range(6))
+    assert max_concurrency(results) == expected
+
+def test_run_parallel_over_budget():
+    # a task estimated to need more than the whole budget still runs, alone
+    results = list(run_parallel(timed_task, [(0, 0.3)], 4, [1000], 100))
+    assert [i for i, _, _ in results] == [0]
+    results = {i: (t0, t1) for i, t0, t1 in run_parallel(timed_task, [(i, 0.3) for i in range(4)], 4, [100, 1000, 100, 100], 250)}
+    assert sorted(results) == list(range(4))
+    big = results[1]
+    assert all(t1 <= big[0] or t0 >= big[1] for i, (t0, t1) in results.items() if i != 1)
+
+def wilson_lower(found, n, z):
+    p = found / n
+    return (p + z*z/(2*n) - z * math.sqrt(p*(1-p)/n + z*z/(4*n*n))) / (1 + z*z/n)
+
+def test_abort_guard():
+    guard = AbortGuard(max_dark=0.1, min_partitions=3)
+    guard.check(dark=50, r_count=100, missing=0, a_count=100)
+    guard.check(dark=50, r_count=100, missing=0, a_count=100)      # fraction 0.5, but fewer than min_partitions compared
+    with pytest.raises(ComparisonAborted) as e:
+        guard.check(dark=50, r_count=100, missing=0, a_count=100)
+    assert (e.value.Kind, e.value.Fraction, e.value.Partitions) == ("dark", 0.5, 3)
+    assert guard.lower_bound("dark") == pytest.approx(wilson_lower(150, 300, 3.0))
+
+def test_abort_guard_confidence():
+    # the observed fraction is above the limit, but the Wilson lower bound is not, so the comparison continues
+    guard = AbortGuard(max_missing=0.1, min_partitions=1)
+    guard.check(missing=3, a_count=20)
+    assert guard.fraction("missing") == 0.15
+    assert guard.lower_bound("missing") == pytest.approx(wilson_lower(3, 20, 3.0)) and guard.lower_bound("missing") < 0.1
+    for _ in range(20):
+        try:
+            guard.check(missing=30, a_count=200)
+        except ComparisonAborted as e:
+            assert e.Kind == "missing" and e.Partitions > 1
+            break
+    else:
+        assert False, "not aborted"
+    assert guard.lower_bound("missing") > 0.1
+    guard = AbortGuard(max_dark=0.2, max_missing=0.2, min_partitions=1)
+    for _ in range(100):
+        guard.check(dark=10, r_count=100, missing=None, a_count=100)        # missing not counted
+    assert guard.Counts["missing"] == [0, 0] and guard.lower_bound("missing") == 0.0
+
+def test_aborted_stats(tmp_path):
+    items = {
+        "a": lfns(range(0, 3000)),
+        "r": lfns(range(0, 6000)),          # half of the scanned items are dark
+        "b": lfns(range(0, 3000))
+    }
+    lists = make_lists(tmp_path, items)
+    partition_stats = {}
+    guard = AbortGuard(max_dark=0.1)
+    nd = nm = 0
+    with pytest.raises(ComparisonAborted) as e:
+        for t, item in cmp3_generator(lists["a"], lists["r"], lists["b"], batches=True, partition_stats=partition_stats, guard=guard):
+            if t == "d":
+                nd += 1
+            else:
+                nm += 1
+    assert e.value.Kind == "dark" and e.value.Partitions == 3 and len(partition_stats) == 3
+    stats_path = str(tmp_path / "stats.json")
+    stats = Stats(stats_path)
+    stats["cmp3"] = aborted_stats(e.value, partition_stats, nd, nm)
+    with open(stats_path, "r") as f:
+        saved = json.load(f)["cmp3"]
+    assert saved["status"] == "aborted" and saved["error"] == str(e.value)
+    assert saved["abort_reason"] == {"kind": "dark", "fraction": e.value.Fraction, "partitions_compared": 3}
+    assert (saved["dark"], saved["missing"]) == (nd, 0)
+    assert [ps["partition"] for ps in saved["partitions"]] == sorted(partition_stats)
+    assert sum(ps["dark"] for ps in saved["partitions"]) == nd
+
+def test_aborted_script(tmp_path):
+    items = {
+        "a": lfns(range(0, 3000)),
+        "r": lfns(range(0, 6000)),
+        "b": lfns(range(0, 3000))
+    }
+    lists = make_lists(tmp_path, items)
+    stats_path = str(tmp_path / "stats.json")
+    assert run_cmp3(tmp_path, "--max-dark", "0.1", "-s", stats_path) == 1
+    with open(stats_path, "r") as f:
+        saved = json.load(f)["cmp3"]
+    assert saved["status"] == "aborted" and saved["abort_reason"]["kind"] == "dark"
+    assert len(saved["partitions"]) == saved["abort_reason"]["partitions_compared"] == 3
+
+def test_sample_partitions():
+    assert sample_partitions(8, 8) == sample_partitions(8, 100) == list(range(8))
+    sample = sample_partitions(100, 10, seed=1)
+    assert len(sample) == 10 and sample == sorted(set(sample)) and all(0 <= i < 100 for i in sample)
+    assert sample_partitions(100, 10, seed=1) == sample
+
+def test_estimate_totals_all_sampled():
+    partition_stats = {i: {"dark": i * 10, "missing": (i * 7) % 5} for i in range(8)}
+    totals = estimate_totals(partition_stats, 8)
+    for key in ("dark", "missing"):
+        total = sum(ps[key] for ps in partition_stats.values())
+        assert totals[key] == {"estimate": total, "low": total, "high": total}
+    estimate = sample_estimate(partition_stats, list(range(8)), 8, quiet=True)
+    assert estimate["dark"]["estimate"] == 280 and estimate["sampled_partitions"] == list(range(8))
+
+def test_estimate_totals_sampled():
+    values = [10, 12, 9, 11]
+    totals = estimate_totals({i: {"dark": x} for i, x in enumerate(values)}, 16, keys=("dark",))["dark"]
+    assert totals["estimate"] == pytest.approx(42 * 4)
+    assert totals["low"] < totals["estimate"] < totals["high"]
+    assert extrapolate([5], 16) == (80, None, None)
+    assert extrapolate([], 16) == (None, None, None)
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_estimate_comparison(tmp_path, workers):
+    # comparing all the partitions as a "sample" gives the exact totals
+    items = Cases["overlap"]
+    lists = make_lists(tmp_path, items)
+    d_expected, m_expected = expected_cmp3(items)
+    partitions = sample_partitions(8, 8)
+    partition_stats = {}
+    list(cmp3_generator(lists["a"], lists["r"], lists["b"], batches=True, workers=workers, partition_stats=partition_stats,
+            partitions=partitions))
+    totals = estimate_totals(partition_stats, 8)
+    assert totals["dark"] == {"estimate": len(d_expected), "low": len(d_expected), "high": len(d_expected)}
+    assert totals["missing"] == {"estimate": len(m_expected), "low": len(m_expected), "high": len(m_expected)}
+    partitions = sample_partitions(8, 3, seed=2)
+    partition_stats = {}
+    results = list(cmp3_generator(lists["a"], lists["r"], lists["b"], batches=True, workers=workers, partition_stats=partition_stats,
+            partitions=partitions))
+    assert sorted(partition_stats) == partitions
+    assert len(results) == sum(ps["dark"] + ps["missing"] for ps in partition_stats.values())
+
+@pytest.mark.parametrize("k, status", [(8, "done"), (100, "done"), (3, "estimated")])
+def test_estimate_script(tmp_path, k, status):
+    items = Cases["overlap"]
+    lists = make_lists(tmp_path, items)
+    d_expected, m_expected = expected_cmp3(items)
+    stats_path = str(tmp_path / "stats.json")
+    assert run_cmp3(tmp_path, "--estimate", str(k), "-s", stats_path) == 0
+    with open(stats_path, "r") as f:
+        saved = json.load(f)["cmp3"]
+    assert saved["status"] == status
+    assert len(saved["estimate"]["sampled_partitions"]) == min(k, 8)
+    if k >= 8:
+        assert saved["estimate"]["dark"] == {"estimate": len(d_expected), "low": len(d_expected), "high": len(d_expected)}
+        assert saved["estimate"]["missing"]["estimate"] == saved["missing"] == len(m_expected)
@@ -0,0 +1,74 @@
+import random, pytest
+from rucio_consistency.dirset import DirDictSet
+
+Items = ["/store/data/run%d/file_%05d.root" % (i % 7, i) for i in range(3000)] + ["/store/ünïcode/файл", "/top", "nodir", ""]
+
+
+def check(s, reference):
+    assert len(s) == len(reference)
+    assert sorted(s) == sorted(reference)
+
+@pytest.mark.parametrize("as_bytes", [False, True])
+def test_set_operations(as_bytes):
+    items = [item.encode("utf-8") for item in Items] if as_bytes else Items
+    s = DirDictSet(items[:2000])
+    reference = set(items[:2000])
+    check(s, reference)
+    s.update(items[1000:] + items[:10])
+    reference.update(items[1000:])
+    check(s, reference)
+    assert all(item in s for item in items)
+    assert s.intersection(items[-100:] + [items[0][:-1]]) == set(items[-100:])
+
+@pytest.mark.parametrize("as_bytes", [False, True])
+def test_removals(as_bytes):
+    items = [item.encode("utf-8") for item in Items] if as_bytes else Items
+    s, reference = DirDictSet(items), set(items)
+    for item in items[::3]:
+        s.remove(item)
+        reference.remove(item)
+    with pytest.raises(KeyError):
+        s.remove(items[0])
+    s.discard(items[0])
+    s.discard(items[1])
+    reference.discard(items[1])
+    check(s, reference)
+    assert all((item in s) == (item in reference) for item in items)
+    s.difference_update(items[:1500])
+    reference.difference_update(items[:1500])
+    check(s, reference)
+    assert s.intersection(items) == reference
+    s.update(items[:100])               # re-added items reuse the deleted slots
+    reference.update(items[:100])
+    check(s, reference)
+    s.difference_update(items)
+    assert len(s) == 0 and list(s) == [] and items[0] not in s
+    assert s.intersection(items) == set()
+    s.update(items)
+    check(s, set(items))
+
+def test_random_operations():
+    rng = random.Random(42)
+    items = Items[:500]
+    s, reference = DirDictSet(), set()
+    for _ in range(20000):
+        item = rng.choice(items)
+        op = rng.random()
+        if op < 0.5:
+            s.add(item)
+            reference.add(item)
+        elif op < 0.8:
+            s.discard(item)
+            reference.discard(item)
+        else:
+            assert (item in s) == (item in reference)
+    check(s, reference)
+
+def test_empty():
+    s = DirDictSet()
+    assert len(s) == 0 and list(s) == []
+    assert "/a/b" not in s
+    assert s.intersection(["/a/b"]) == set()
+    s.difference_update(["/a/b"])
+    with pytest.raises(KeyError):
+        s.remove("/a/b")
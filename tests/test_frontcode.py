@@ -0,0 +1,68 @@
+import pytest
+from rucio_consistency import PartitionedList
+from rucio_consistency.frontcode import FrontCodedWriter, FrontCodedReader, common_prefix_length, MaxPrefix
+
+Items = sorted(set(["/store/data/run%d/file_%05d.root" % (i % 7, i) for i in range(5000)] + ["/store/ünïcode/файл", "/a", "/a/b", "/b"]))
+
+
+def write_file(path, items, block_size=1000):
+    writer = FrontCodedWriter(open(path, "wb"), 1, 4, "crc32", len(items))
+    writer.write_items([item.encode("utf-8") for item in items], block_size)
+    writer.close()
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "part.rcef")
+    write_file(path, Items)
+    reader = FrontCodedReader(open(path, "rb"))
+    assert (reader.Index, reader.NParts, reader.Count, reader.HashName) == (1, 4, len(Items), "crc32")
+    assert list(reader.items()) == Items
+    reader.seek(0)
+    assert [line.rstrip("\n") for line in iter(reader.readline, "")] == Items
+    reader.close()
+
+def test_long_prefix(tmp_path):
+    long_prefix = "/" + "x" * (MaxPrefix + 100)
+    items = [long_prefix + "/a", long_prefix + "/b"]
+    assert common_prefix_length(items[0].encode(), items[1].encode()) == MaxPrefix
+    path = str(tmp_path / "part.rcef")
+    write_file(path, items)
+    with open(path, "rb") as f:
+        assert list(FrontCodedReader(f).items()) == items
+
+@pytest.mark.parametrize("block_size", [1, 7, 1000, 10000])
+def test_find(tmp_path, block_size):
+    path = str(tmp_path / "part.rcef")
+    write_file(path, Items, block_size)
+    with open(path, "rb") as f:
+        reader = FrontCodedReader(f)
+        for item in Items[::97] + [Items[0], Items[-1]]:
+            reader.seek(0)
+            assert reader.find(item), item
+        for item in ["/", "/a/a", "/store/data/run0/file_00000.rootx", "/zzz", Items[0][:-1]]:
+            reader.seek(0)
+            assert not reader.find(item), item
+
+def test_truncated(tmp_path):
+    path = str(tmp_path / "part.rcef")
+    write_file(path, Items)
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:-10])
+    reader = FrontCodedReader(open(path, "rb"))
+    with pytest.raises(ValueError):
+        list(reader.items())
+    reader.close()
+
+def test_partitioned_list(tmp_path):
+    prefix = str(tmp_path / "list")
+    lst = PartitionedList.create(4, prefix, True, format="sorted", buffer_size=1000)
+    lst.add_many(reversed(Items))
+    assert sum(lst.counts()) == len(Items)
+    lst.close()
+    lst = PartitionedList.open(prefix)
+    assert sum(lst.counts()) == len(Items)
+    for p in lst.partitions:
+        items = list(p)
+        assert items == sorted(items)
+    assert sorted(lst.items()) == Items
@@ -0,0 +1,107 @@
+import gzip, pytest
+from rucio_consistency import PartitionedList
+from rucio_consistency.gzindex import GzipIndex, index_path, iter_range
+from rucio_consistency.part import read_chunk, read_chunks, read_partition
+from rucio_consistency.cmplib import cmp3_generator
+
+Lines = ["/store/data/run%d/file_%05d.root" % (i % 7, i) for i in range(20000)]
+
+
+def write_gzip(path, lines):
+    with gzip.open(path, "wt") as f:
+        f.write("".join(line + "\n" for line in lines))
+
+def read_ranges(path, ranges):
+    return [line.decode("utf-8") for start, end in ranges for batch in iter_range(path, start, end, 1000) for line in batch]
+
+def test_index_path():
+    assert index_path("prefix.00001.gz") == "prefix.00001.gzi"
+    assert index_path("prefix.00001") == "prefix.00001.gzi"
+
+def test_build_split(tmp_path):
+    path = str(tmp_path / "part.00000.gz")
+    write_gzip(path, Lines)
+    with open(path, "rb") as f:
+        original = f.read()
+    assert GzipIndex.build(path, chunk_size=10000) == (None, False)
+    with open(path, "rb") as f:
+        assert f.read() == original                 # not rewritten without the opt-in
+    assert GzipIndex.load(index_path(path)) is None
+    index, rewritten = GzipIndex.build(path, chunk_size=10000, rewrite=True)
+    assert rewritten and len(index) > 10
+    with gzip.open(path, "rt") as f:
+        assert f.read().splitlines() == Lines          # still a valid gzip file
+    assert index.is_valid_for(path)
+    for n in (1, 2, 3, 8, 1000):
+        ranges = index.split(n)
+        assert 1 <= len(ranges) <= n
+        assert ranges[0][0] == 0 and ranges[-1][1] == index.CompressedSize
+        assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+        assert read_ranges(path, ranges) == Lines
+
+def test_save_load(tmp_path):
+    path = str(tmp_path / "part.00000.gz")
+    write_gzip(path, Lines)
+    index, _ = GzipIndex.build(path, chunk_size=10000, rewrite=True)
+    loaded = GzipIndex.load(index_path(path))
+    assert list(loaded.Points) == list(index.Points)
+    assert (loaded.CompressedSize, loaded.UncompressedSize) == (index.CompressedSize, index.UncompressedSize)
+    assert loaded.is_valid_for(path)
+    write_gzip(path, Lines[:10])
+    assert not loaded.is_valid_for(path)
+    with open(index_path(path), "r+b") as f:
+        f.truncate(40)
+    with pytest.raises(ValueError):
+        GzipIndex.load(index_path(path))
+    assert GzipIndex.load(str(tmp_path / "none.gzi")) is None
+
+def test_partitioned_list(tmp_path):
+    prefix = str(tmp_path / "list")
+    lst = PartitionedList.create(2, prefix, True, gzip_index=True)
+    lst.add_many(Lines)
+    lst.close()
+    lst = PartitionedList.open(prefix)
+    assert lst.build_gzip_index() == (0, [])    # indexed by the writer
+    for path in lst.FileNames:
+        write_gzip(path, Lines[:10000])         # invalidates the index
+    assert lst.build_gzip_index(chunk_size=10000) == (0, lst.FileNames)
+    assert lst.build_gzip_index(chunk_size=10000, rewrite=True) == (2, [])
+    for p, path in zip(lst.partitions, lst.FileNames):
+        chunks = p.chunks(4)
+        assert len(chunks) == 4
+        items = [item.decode("utf-8") for chunk in chunks for batch in read_chunk(chunk) for item in batch]
+        with gzip.open(path, "rt") as f:
+            assert items == f.read().splitlines()
+    assert sorted(PartitionedList.open(prefix).items()) == sorted(Lines[:10000] * 2)
+
+def test_read_chunks(tmp_path):
+    path = str(tmp_path / "part.00000.gz")
+    write_gzip(path, Lines)
+    GzipIndex.build(path, chunk_size=10000, rewrite=True)
+    chunks = GzipIndex.load(index_path(path)).split(4)
+    batches = list(read_chunks([(path, start, end) for start, end in chunks], batch_size=10000))
+    assert batches == list(read_chunks([(path, start, end) for start, end in chunks], batch_size=10000))    # same order every time
+    assert sorted(item.decode("utf-8") for batch in batches for item in batch) == sorted(Lines)
+    assert sorted(item for batch in read_partition(path) for item in batch) == sorted(line.encode("utf-8") for line in Lines)
+
+@pytest.mark.parametrize("engine", ["set", "dirset", "digest", "merge"])
+def test_cmp3_indexed(tmp_path, engine):
+    # indexed partitions are read in chunks by several threads by all the comparison engines
+    items = {
+        "a": Lines[:15000],
+        "r": Lines[5000:],
+        "b": Lines[:12000]
+    }
+    lists = {}
+    for name, lst_items in items.items():
+        prefix = str(tmp_path / name)
+        lst = PartitionedList.create(2, prefix, True)
+        lst.add_many(lst_items)
+        lst.close()
+        lists[name] = PartitionedList.open(prefix)
+        assert lists[name].build_gzip_index(chunk_size=10000, rewrite=True) == (2, [])
+    assert all(len(p.chunks(4)) == 4 for p in lists["r"].partitions)
+    results = list(cmp3_generator(lists["a"], lists["r"], lists["b"], batches=True, engine=engine))
+    a, r, b = (set(lst_items) for lst_items in (items["a"], items["r"], items["b"]))
+    assert sorted(item for t, item in results if t == "d") == sorted(r - a - b)
+    assert sorted(item for t, item in results if t == "m") == sorted((a & b) - r)
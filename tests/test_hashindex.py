@@ -0,0 +1,59 @@
+import pytest
+from rucio_consistency import PartitionedList
+from rucio_consistency.hashindex import HashIndex, digest, file_signature
+
+Items = ["/store/data/file_%05d.root" % (i,) for i in range(3000)]
+
+
+def test_from_digests():
+    index = HashIndex.from_digests([digest(item) for item in Items + Items[:5]])
+    assert index.Count == len(Items)
+    for record, item in enumerate(Items):
+        assert index.lookup(item) == record
+        assert index.lookup(item.encode("utf-8")) == record
+    assert index.lookup("/store/data/missing") is None
+    assert "/store/data/missing" not in index
+
+def test_save_load(tmp_path):
+    data = tmp_path / "part.00000"
+    data.write_text("\n".join(Items) + "\n")
+    path = str(tmp_path / "part.00000.hidx")
+    HashIndex.from_digests([digest(item) for item in Items], file_signature(str(data))).save(path)
+    index = HashIndex.load(path)
+    assert index.is_valid_for(str(data))
+    assert [index.lookup(item) for item in Items[::101]] == list(range(0, len(Items), 101))
+    assert index.lookup("/store/data/missing") is None
+    index.close()
+    data.write_text("changed\n")
+    index = HashIndex.load(path)
+    assert not index.is_valid_for(str(data))
+    index.close()
+    assert HashIndex.load(str(tmp_path / "none.hidx")) is None
+
+def test_load_damaged(tmp_path):
+    path = str(tmp_path / "part.hidx")
+    HashIndex.from_digests([digest(item) for item in Items]).save(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:-8])
+    with pytest.raises(ValueError):
+        HashIndex.load(path)
+
+@pytest.mark.parametrize("format", ["text", "binary", "sorted"])
+def test_locate(tmp_path, format):
+    prefix = str(tmp_path / "list")
+    lst = PartitionedList.create(4, prefix, format=format)
+    lst.add_many(Items)
+    lst.close()
+    lst = PartitionedList.open(prefix)
+    with pytest.raises(ValueError):
+        list(lst.locate(Items[:1]))
+    assert lst.build_hash_index() == 4
+    assert lst.build_hash_index() == 0
+    records = [list(p) for p in PartitionedList.open(prefix).partitions]
+    for item, i, record in lst.locate(Items[::37] + ["/store/data/missing"]):
+        if item == "/store/data/missing":
+            assert record is None
+        else:
+            assert records[i][record] == item
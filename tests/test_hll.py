@@ -0,0 +1,23 @@
+import pytest
+from rucio_consistency import PartitionedList
+from rucio_consistency.hll import nparts_from_options, nparts_for_budget, auto_nparts_usage
+
+
+def test_nparts_for_budget():
+    assert nparts_for_budget(0, 50, 1000) == 1
+    assert nparts_for_budget(1000, 100, 200*1000) == 1
+    assert nparts_for_budget(1000, 100, 200*100) == 16           # 10 rounded up to a power of 2
+
+def test_nparts_from_options(tmp_path):
+    prefix = str(tmp_path / "list")
+    lst = PartitionedList.create(2, prefix, sketch=True)
+    lst.add_many(["/store/data/file_%05d.root" % (i,) for i in range(10000)])
+    lst.close()
+    assert nparts_from_options({"-n": "3"}) is None
+    assert nparts_from_options({"--auto-nparts": "", "--mem-budget": "1G", "--sketches": prefix}) == 1
+    assert nparts_from_options({"--auto-nparts": "", "--mem-budget": "100k", "--sketches": prefix}) == 16
+    with pytest.raises(ValueError):
+        nparts_from_options({"--auto-nparts": "", "--sketches": prefix})
+    with pytest.raises(ValueError):
+        nparts_from_options({"--auto-nparts": "", "--mem-budget": "1G", "--sketches": prefix + "," + str(tmp_path / "none")})
+    assert auto_nparts_usage("  ").startswith("  --auto-nparts")
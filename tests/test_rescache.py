@@ -0,0 +1,60 @@
+import os, pytest
+from rucio_consistency import PartitionedList
+from rucio_consistency.manifest import Manifest, content_digest
+from rucio_consistency.rescache import ResultCache, partition_digests, cached_results
+
+
+def make_list(prefix, items, format="text", compressed=False):
+    lst = PartitionedList.create(2, prefix, compressed, format=format)
+    lst.add_many(items)
+    lst.close()
+    return PartitionedList.open(prefix)
+
+@pytest.mark.parametrize("format", ["text", "binary", "sorted"])
+@pytest.mark.parametrize("compressed", [False, True])
+def test_manifest_digest(tmp_path, format, compressed):
+    prefix = str(tmp_path / "list")
+    lst = make_list(prefix, ["/f/%d" % i for i in range(1000)], format, compressed)
+    digests = partition_digests(lst)
+    assert all(d.startswith("blake2b:") for d in digests)
+    assert digests == [content_digest(path) for path in lst.FileNames]
+    lst.Manifest.validate(deep=True)
+    Manifest.remove(prefix)
+    assert partition_digests(PartitionedList.open(prefix)) == digests
+
+def test_same_count_changed_contents(tmp_path):
+    a = make_list(str(tmp_path / "a"), ["/f/%d" % i for i in range(100)])
+    b = make_list(str(tmp_path / "b"), ["/g/%d" % i for i in range(100)])
+    cache = ResultCache(str(tmp_path / "cache"))
+    assert cache.partition_keys("cmp", [a]) != cache.partition_keys("cmp", [b])
+    for name in ("a", "b"):
+        Manifest.remove(str(tmp_path / name))
+    a, b = PartitionedList.open(str(tmp_path / "a")), PartitionedList.open(str(tmp_path / "b"))
+    assert cache.partition_keys("cmp", [a]) != cache.partition_keys("cmp", [b])
+
+def test_cached_results(tmp_path):
+    lst = make_list(str(tmp_path / "a"), ["/f/%d" % i for i in range(100)])
+    cache = ResultCache(str(tmp_path / "cache"))
+    keys = cache.partition_keys("cmp", [lst])
+    tasks = [(i,) for i in range(lst.NParts)]
+    ran = []
+    def run(todo):
+        ran.extend(todo)
+        return [(task[0], ["x%d" % task[0]]) for task in todo]
+    partition_stats = {}
+    assert sorted(cached_results(cache, keys, tasks, run)) == [(0, ["x0"]), (1, ["x1"])]
+    assert sorted(cached_results(cache, keys, tasks, run, partition_stats)) == [(0, ["x0"]), (1, ["x1"])]
+    assert len(ran) == 2 and partition_stats == {0: {"cached": True}, 1: {"cached": True}}
+
+def test_eviction(tmp_path):
+    directory = str(tmp_path / "cache")
+    cache = ResultCache(directory, 5000)
+    for i in range(100):
+        cache.put("k%d" % i, [os.urandom(50).hex(), i])
+    assert cache.size() <= 5000
+    assert cache.Size == cache.size()
+    assert cache.get("k99")[1] == 99
+    assert cache.get("k0") is None
+    with open(cache.path("k99"), "r+b") as f:
+        f.truncate(10)
+    assert cache.get("k99") is None and not os.path.exists(cache.path("k99"))
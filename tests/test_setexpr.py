@@ -0,0 +1,75 @@
+import itertools, pytest
+from rucio_consistency import PartitionedList, ManifestError
+from rucio_consistency.setexpr import parse, names, cover, _test, SetExpression, evaluate_generator
+
+
+def test_parse():
+    assert parse("A") == ("name", "A")
+    assert parse("A - B - C") == ("-", ("-", ("name", "A"), ("name", "B")), ("name", "C"))
+    assert parse("A | B & C") == ("|", ("name", "A"), ("&", ("name", "B"), ("name", "C")))
+    assert parse("A ^ B | C") == ("|", ("^", ("name", "A"), ("name", "B")), ("name", "C"))
+    assert parse("A & B - C") == ("&", ("name", "A"), ("-", ("name", "B"), ("name", "C")))
+    assert parse("(A & B) - R_1") == ("-", ("&", ("name", "A"), ("name", "B")), ("name", "R_1"))
+    assert parse(" ( ( dump ) ) ") == ("name", "dump")
+
+@pytest.mark.parametrize("text", ["", "A &", "(A", "A B", "A + B", ")", "A)", "& A", "()", "1A"])
+def test_parse_errors(text):
+    with pytest.raises(ValueError):
+        parse(text)
+
+def test_names():
+    assert names(parse("(B & A) - B | C")) == ["A", "B", "C"]
+
+def test_cover():
+    sizes = {"A": 10, "B": 1, "C": 5}
+    assert cover(parse("A - B"), sizes) == {"A"}
+    assert cover(parse("A & B"), sizes) == {"B"}
+    assert cover(parse("A | B"), sizes) == {"A", "B"}
+    assert cover(parse("A ^ B"), sizes) == {"A", "B"}
+    assert cover(parse("(A | C) & B"), sizes) == {"B"}
+    assert cover(parse("(A & C) - B"), sizes) == {"C"}
+
+Expressions = ["A - B", "A & B", "A | B", "A ^ B", "(A & B) - C", "C - (A | B)", "A & B & C", "A ^ B ^ C", "(A - B) | (C & A)", "A - A"]
+
+@pytest.mark.parametrize("text", Expressions)
+def test_test(text):
+    # _test agrees with Python set operations for items in every combination of the operands
+    expression = SetExpression(text)
+    for bits in itertools.product([0, 1], repeat=len(expression.Names)):
+        sets = {name: ({"x"} if bit else set()) for name, bit in zip(expression.Names, bits)}
+        mask = sum(expression.Bits[name] for name, bit in zip(expression.Names, bits) if bit)
+        assert _test(expression.Tree, mask, expression.Bits) == ("x" in eval(text, {}, sets))
+
+def make_lists(tmp_path, nparts=4):
+    items = {
+        "A": ["/f/%d" % i for i in range(0, 3000)],
+        "B": ["/f/%d" % i for i in range(1000, 4000)],
+        "C": ["/f/%d" % i for i in range(0, 4000, 3)]
+    }
+    lists = {}
+    for name, lst_items in items.items():
+        prefix = str(tmp_path / name)
+        lst = PartitionedList.create(nparts, prefix)
+        lst.add_many(lst_items)
+        lst.close()
+        lists[name] = PartitionedList.open(prefix)
+    return items, lists
+
+@pytest.mark.parametrize("workers", [None, 2])
+@pytest.mark.parametrize("text", Expressions)
+def test_evaluate(tmp_path, text, workers):
+    items, lists = make_lists(tmp_path)
+    expected = eval(text, {}, {name: set(lst_items) for name, lst_items in items.items()})
+    partition_stats = {}
+    result = list(evaluate_generator(text, lists, workers=workers, partition_stats=partition_stats))
+    assert sorted(result) == sorted(expected)
+    assert sum(ps["out"] for ps in partition_stats.values()) == len(expected)
+
+def test_evaluate_errors(tmp_path):
+    items, lists = make_lists(tmp_path)
+    with pytest.raises(ValueError):
+        evaluate_generator("A - D", lists)
+    with open(lists["B"].FileNames[1], "a") as f:
+        f.write("/extra\n")
+    with pytest.raises(ManifestError):
+        evaluate_generator("A - B", lists)         # raised when called, before the generator is returned